@@ -1,6 +1,16 @@
 import os
-from typing import List, Dict
-from openai import OpenAI
+import json
+import time
+import asyncio
+from typing import Any, Callable, List, Dict, Optional, Tuple
+
+from hedging import HedgePolicy
+from lazy import lazy_class_attr, reset
+from limiter import estimate_tokens, get_limiter
+from llm_cache import ResponseCache, response_cache
+from score_parser import SCORE_FIELDS, ScoreParseError, render_score, score_json_schema, validate_score_json
+from tracing import tracer
+from usage import usage_meter
 
 """
 这里定义评价模型和裁判模型来对内容进行评价打分，在instruction部分定义评价模型的指令
@@ -10,35 +20,114 @@ from openai import OpenAI
 2. 便宜（主要是我穷）
 """
 class ModelBase:
-    client = OpenAI(
-        api_key=os.getenv("DEEPSEEK_API_KEY"),
-        base_url="https://gateway.ai.cloudflare.com/v1/edeb2ef5eb5f3c565759f172924e2638/sci-report/deepseek"
-    )
+    # 异步客户端，避免评分时阻塞整个 event loop；第一次发请求时才创建
+    @lazy_class_attr
+    def client():
+        from openai import AsyncOpenAI
+        from http_pool import http_pool
+
+        http_pool.on_close(lambda: reset(ModelBase, "client"))
+        return AsyncOpenAI(
+            api_key=os.getenv("DEEPSEEK_API_KEY"),
+            base_url=os.getenv(
+                "DEEPSEEK_BASE_URL",
+                "https://gateway.ai.cloudflare.com/v1/edeb2ef5eb5f3c565759f172924e2638/sci-report/deepseek"
+            ),
+            http_client=http_pool.async_client(),
+            # HedgePolicy retries and the limiter backs off, an SDK retry would hide the 429 from both
+            max_retries=0,
+        )
+
+    cache: ResponseCache = response_cache
+    endpoint = "deepseek"  # the name of the rate limiter, see limiter.py
+    policy: Optional[HedgePolicy] = None  # deadline / retry / hedge policy, see hedging.py
+    model_name: str
     instruction: str
     rule: str
 
     def _set_rule(self, rule: str):
         self.rule = rule
 
+    async def _chat(self, msg: List[Dict[str, str]], sample: int = 0,
+                    accept: Optional[Callable[[str], bool]] = None, **params) -> str:
+        """
+        Send the messages to the judge model, byte-identical requests are served from the cache.
+        :param msg: the chat messages
+        :param sample: index of the sample when the same request is drawn several times,
+            it only goes into the cache key (sample 0 keeps the plain key)
+        :param accept: only a content for which it returns True is cached, default to any non-empty one;
+            a rejected answer is still returned, and the same request is drawn afresh next time
+        :param params: extra sampling params for `chat.completions.create`
+        :return: the content of the first choice
+        """
+        with tracer.span("judge.chat", model=self.model_name) as sp:
+            if sample:
+                key = self.cache.make_key(self.model_name, msg, sample=sample, **params)
+            else:
+                key = self.cache.make_key(self.model_name, msg, **params)
+            cached = self.cache.get(key)
+            sp.set(cache_hit=cached is not None)
+            if cached is not None:
+                return cached
+            tokens = estimate_tokens("".join(m["content"] or "" for m in msg))
+
+            async def _request() -> str:
+                with tracer.span("judge.request", model=self.model_name) as req:
+                    start = time.perf_counter()
+                    resp = await self.client.chat.completions.create(
+                        model=self.model_name,
+                        messages=msg,
+                        **params
+                    )
+                    req.add_usage(self.model_name, resp.usage)
+                # 记录 provider 端的 prompt cache 命中情况
+                usage_meter.record(self.model_name, resp.usage, time.perf_counter() - start)
+                return resp.choices[0].message.content
+
+            limiter = get_limiter(self.endpoint)
+            if self.policy is not None:
+                # the policy takes the limiter slot of every request itself, the wait for it is not timed
+                content = await self.policy.call(_request, limiter=limiter, tokens=tokens)
+            else:
+                async with limiter.slot(tokens=tokens):
+                    content = await _request()
+            if content and (accept is None or accept(content)):
+                self.cache.set(key, content)
+            return content
+
 
 class Advice(ModelBase):
     model_name = "deepseek-reasoner"
+    # deepseek-reasoner has a very long latency tail, one stuck call should not hold the whole cell
+    policy = HedgePolicy(
+        deadline=float(os.getenv("ADVICE_DEADLINE", "600")),
+        retries=int(os.getenv("ADVICE_RETRIES", "2")),
+        hedge=os.getenv("ADVICE_HEDGE", "1").lower() in ("1", "true", "yes"),
+        hedge_budget=float(os.getenv("ADVICE_HEDGE_BUDGET", "0.1")),
+    )
 
     def __init__(self, rule: str = None):
         self._set_rule(rule)
 
-    def advice(self, processer: str) -> str:
-        msg = [
+    def prefix_messages(self) -> List[Dict[str, str]]:
+        """
+        The part shared by every model's transcript of the same task.
+        Keep it byte-stable and put nothing cell specific in it, otherwise the provider cache misses.
+        """
+        return [
             {"role": "system", "content": self.instruction},
             {"role": "user", "content": self.rule},
             {"role": "assistant", "content": "I have known the rule, now please give me the process information"},
+        ]
+
+    def messages(self, processer: str) -> List[Dict[str, str]]:
+        return self.prefix_messages() + [
             {"role": "user", "content": processer},
         ]
-        resp = self.client.chat.completions.create(
-            model=self.model_name,
-            messages=msg
-        )
-        return resp.choices[0].message.content
+
+    async def advice(self, processer: str) -> str:
+        with tracer.span("judge.advice", kind=type(self).__name__):
+            return await self._chat(self.messages(processer))
 
 
 class AdvicePositiveCN(Advice):
@@ -100,6 +189,11 @@ class AdviceNegative(Advice):
 
 class ScoreModel(ModelBase):
     model_name = "deepseek-chat"
+    policy = HedgePolicy(
+        deadline=float(os.getenv("JUDGE_DEADLINE", "600")),
+        retries=int(os.getenv("JUDGE_RETRIES", "2")),
+        hedge=False,
+    )
 
     instruction = """
     ## Role
@@ -184,12 +278,14 @@ class ScoreModel(ModelBase):
         self._set_rule(rule)
         self.advice_positive = AdvicePositive(rule)
         self.advice_negative = AdviceNegative(rule)
+        self._advice: Optional[asyncio.Future] = None
 
-    def score_it(self) -> str:
-        positive_advice = self.advice_positive.advice(self.processer)
-        negative_advice = self.advice_negative.advice(self.processer)
-
-        msg: List[Dict[str, str]] = [
+    def prefix_messages(self) -> List[Dict[str, str]]:
+        """
+        Task, rule and instruction only, so the judge requests of one task share this prefix.
+        The processer and result must come after it.
+        """
+        return [
             {"role": "system", "content": self.instruction},
 
             {"role": "user", "content": "Here is the task:"+self.task+"\nAnd task id is:"+self.task_id},
@@ -205,7 +301,100 @@ class ScoreModel(ModelBase):
                     "I have known about the task and the score rule! "
                     "Please give me the processer and the result."
             },  # 用这个可以提高Cache，能够显著的减少成本
+        ]
+
+    async def advices(self) -> Tuple[str, str]:
+        """The positive and negative advice, requested once and shared by every sample of this cell."""
+        if self._advice is None:
+            # 正面和负面的建议互不依赖，可以并发请求
+            self._advice = asyncio.ensure_future(asyncio.gather(
+                self.advice_positive.advice(self.processer),
+                self.advice_negative.advice(self.processer),
+            ))
+        positive_advice, negative_advice = await self._advice
+        return positive_advice, negative_advice
+
+    async def score_it(self, sample: int = 0) -> str:
+        """
+        :param sample: the sample index, see `sampling.SequentialSampler`; different indexes are independent draws
+        """
+        with tracer.span("judge.score_it", task_id=self.task_id, sample=sample):
+            positive_advice, negative_advice = await self.advices()
+            return await self._chat(self.messages(positive_advice, negative_advice), sample=sample)
+
+    def response_format(self) -> Dict[str, object]:
+        """
+        JUDGE_RESPONSE_FORMAT=json_schema asks the server to enforce the schema, json_object (the default,
+        the only one DeepSeek supports) only asks for valid JSON and the schema is checked here.
+        """
+        if os.getenv("JUDGE_RESPONSE_FORMAT", "json_object") == "json_schema":
+            return {"type": "json_schema",
+                    "json_schema": {"name": "score", "strict": True, "schema": score_json_schema()}}
+        return {"type": "json_object"}
+
+    def json_messages(self, positive_advice: str, negative_advice: str) -> List[Dict[str, str]]:
+        """The same conversation as `messages`, the last turn asks for the scores as one JSON object."""
+        return self.messages(positive_advice, negative_advice)[:-1] + [{
+            "role": "user",
+            "content":
+                "Now please give me the finial score and the details as a single json object, no other text. "
+                "It has exactly these keys: " + ", ".join(SCORE_FIELDS) + ". "
+                "language is \"EN\" or \"zh-CN\"; every *_score is an int: result_score out of 20, "
+                "reasoning_score, tool_usage_score, error_handling_score and planning_score out of 20 each, "
+                "processer_score is their sum (out of 80) and final_score = result_score + processer_score; "
+                "every *_reason is the reason of that score."
+        }]
 
+    async def score_it_json(self, sample: int = 0) -> str:
+        """
+        The single-pass mode (JUDGE_OUTPUT=json): the judge returns the scores as JSON, they are validated
+        and rendered into the `<score>` layout, so the extraction never needs the LLM.
+        An invalid answer is drawn again, up to JUDGE_JSON_RETRIES times.
+        :param sample: the sample index, see `score_it`
+        :raise ScoreParseError: if no valid answer came back
+        """
+        with tracer.span("judge.score_it", task_id=self.task_id, sample=sample, output="json") as sp:
+            positive_advice, negative_advice = await self.advices()
+            msg = self.json_messages(positive_advice, negative_advice)
+            retries = int(os.getenv("JUDGE_JSON_RETRIES", "1"))
+            error = None
+            for attempt in range(retries + 1):
+                # 只有通过校验的回答才进缓存，所以重试用同一个 key 也会重新请求
+                content = await self._chat(msg, sample=sample, accept=self._valid_json,
+                                           response_format=self.response_format())
+                try:
+                    data = self.parse_json(content)
+                except ScoreParseError as e:
+                    error = e
+                    sp.set(invalid=attempt + 1, error=str(e))
+                    continue
+                return render_score(data, self.task_id)
+            raise ScoreParseError(f"no valid JSON score after {retries + 1} attempts: {error}")
+
+    @staticmethod
+    def parse_json(content: Optional[str]) -> Dict[str, Any]:
+        """
+        :return: the validated scores of a JSON-mode answer, a ```json fence is tolerated
+        :raise ScoreParseError: if it is not JSON or does not match the schema
+        """
+        text = (content or "").strip()
+        if text.startswith("```"):
+            text = text.strip("`").removeprefix("json").strip()
+        try:
+            return validate_score_json(json.loads(text))
+        except json.JSONDecodeError as e:
+            raise ScoreParseError(f"not JSON: {e}") from e
+
+    @classmethod
+    def _valid_json(cls, content: str) -> bool:
+        try:
+            cls.parse_json(content)
+        except ScoreParseError:
+            return False
+        return True
+
+    def messages(self, positive_advice: str, negative_advice: str) -> List[Dict[str, str]]:
+        return self.prefix_messages() + [
             {"role": "user", "content": "Here is the processer:"+self.processer},
             {"role": "user", "content": "Here is the result:"+self.results},
 
@@ -218,10 +407,3 @@ class ScoreModel(ModelBase):
 
             {"role": "user", "content": "Now please give me the finial score and the details"},
         ]
-        resp = self.client.chat.completions.create(
-            model=self.model_name,
-            messages=msg
-        )
-        return resp.choices[0].message.content
-
-
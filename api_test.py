@@ -18,7 +18,7 @@ from langchain.chat_models import init_chat_model
 llm = init_chat_model(
     model="deepseek/deepseek-chat-v3.1:free",  # this model is free to use
     api_key=os.getenv("OPENROUTER_API_KEY"),
-    api_base=os.getenv("OPENROUTER_BASE_URL"),
+    base_url=os.getenv("OPENROUTER_BASE_URL"),
 )
 
 result = llm.invoke("Who are you? Answer me within 30 words")
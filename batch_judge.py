@@ -0,0 +1,394 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : batch_judge.py
+
+"""
+Offline batch judging for big re-scoring sweeps.
+
+Every cell in the ledger which has a formatted transcript but no score is judged through an
+OpenAI-compatible batch API instead of one `chat.completions.create` per request:
+
+    1. advice phase: AdvicePositive / AdviceNegative requests of all the cells in one batch file
+    2. score phase:  the ScoreModel requests, built with the advice from phase 1
+
+The scores are written back to the ledger (stage "score") and to the response cache, so a normal
+`python main.py` afterwards only runs the extraction stage for those cells.
+
+Batch mode always asks for the text `<score>` layout, one sample per cell: JUDGE_OUTPUT=json and the
+sequential sampler (JUDGE_SAMPLES_MAX > 1) are not applied, a warning is printed when they are set.
+A batch which is still in progress after --timeout seconds is given up; the results of the other
+batches are kept, and the next run submits the cells left again.
+
+Usage:
+    python batch_judge.py --backend openai
+    python batch_judge.py --backend local --work-dir ./batches   # file based stand-in, for testing
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import time
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from adjust_score import ModelBase, ScoreModel
+from ledger import RunLedger
+from sampling import SequentialSampler
+from usage import usage_meter
+
+CHAT_URL = "/v1/chat/completions"
+_SEP = "::"
+
+
+def make_custom_id(model: str, task_id: str, kind: str) -> str:
+    return _SEP.join((model, task_id, kind))
+
+
+def split_custom_id(custom_id: str) -> Tuple[str, str, str]:
+    model, task_id, kind = custom_id.rsplit(_SEP, 2)
+    return model, task_id, kind
+
+
+def build_request(custom_id: str, model: str, messages: List[Dict[str, str]], **params: Any) -> Dict[str, Any]:
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": CHAT_URL,
+        "body": {"model": model, "messages": messages, **params},
+    }
+
+
+def parse_output_line(record: Dict[str, Any]) -> Tuple[str, Optional[str], Any, Optional[str]]:
+    """
+    :return: (custom_id, content, usage, error) of one line of a batch output file
+    """
+    custom_id = record.get("custom_id")
+    response = record.get("response") or {}
+    if record.get("error") or response.get("status_code", 200) != 200:
+        return custom_id, None, None, json.dumps(record.get("error") or response, ensure_ascii=False)
+    body = response.get("body") or {}
+    try:
+        content = body["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError):
+        return custom_id, None, None, "no content in response body"
+    return custom_id, content, body.get("usage"), None
+
+
+class BatchBackend(ABC):
+    """Submit a batch JSONL file and fetch its output lines."""
+
+    @abstractmethod
+    async def submit(self, input_path: Path) -> str:
+        """:return: the batch id"""
+
+    @abstractmethod
+    async def status(self, batch_id: str) -> str:
+        """One of "in_progress", "completed", "failed"."""
+
+    @abstractmethod
+    async def results(self, batch_id: str) -> List[Dict[str, Any]]:
+        """The output lines (and error lines) of a completed batch."""
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """
+    The `/v1/batches` API of an OpenAI-compatible provider.
+    :param client: an AsyncOpenAI client, default to the judge client in adjust_score.py
+        (with the SDK retries back on, the batch API calls are not under a limiter or HedgePolicy)
+    """
+    _failed = ("failed", "expired", "cancelled", "cancelling")
+
+    def __init__(self, client=None, completion_window: str = "24h"):
+        self.client = client or ModelBase.client.with_options(max_retries=2)
+        self.completion_window = completion_window
+
+    async def submit(self, input_path: Path) -> str:
+        with open(input_path, "rb") as f:
+            uploaded = await self.client.files.create(file=f, purpose="batch")
+        batch = await self.client.batches.create(
+            input_file_id=uploaded.id,
+            endpoint=CHAT_URL,
+            completion_window=self.completion_window,
+        )
+        return batch.id
+
+    async def status(self, batch_id: str) -> str:
+        batch = await self.client.batches.retrieve(batch_id)
+        if batch.status == "completed":
+            return "completed"
+        if batch.status in self._failed:
+            return "failed"
+        return "in_progress"
+
+    async def results(self, batch_id: str) -> List[Dict[str, Any]]:
+        batch = await self.client.batches.retrieve(batch_id)
+        records = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            content = await self.client.files.content(file_id)
+            records += [json.loads(line) for line in content.text.splitlines() if line.strip()]
+        return records
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    A file based stand-in for testing.
+
+    `submit` copies the input to `<root>/<batch_id>/input.jsonl`, and the batch is completed as soon as
+    `<root>/<batch_id>/output.jsonl` exists. If a responder is given it writes that file right away,
+    otherwise another process (or a person) can drop it there.
+    :param root: the directory of the batches
+    :param responder: optional callable, request body -> assistant content
+    """
+
+    def __init__(self, root: str = "./batches/local", responder: Callable[[Dict[str, Any]], str] = None):
+        self.root = Path(root)
+        self.responder = responder
+
+    async def submit(self, input_path: Path) -> str:
+        batch_id = f"local_{uuid.uuid4().hex[:12]}"
+        batch_dir = self.root / batch_id
+        batch_dir.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(input_path, batch_dir / "input.jsonl")
+        if self.responder is not None:
+            await asyncio.to_thread(self._respond, batch_dir)
+        return batch_id
+
+    def _respond(self, batch_dir: Path) -> None:
+        with open(batch_dir / "input.jsonl", "r", encoding="utf-8") as fin, \
+                open(batch_dir / "output.tmp", "w", encoding="utf-8") as fout:
+            for line in fin:
+                if not line.strip():
+                    continue
+                request = json.loads(line)
+                content = self.responder(request["body"])
+                record = {
+                    "custom_id": request["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "body": {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]},
+                    },
+                    "error": None,
+                }
+                fout.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(batch_dir / "output.tmp", batch_dir / "output.jsonl")
+
+    async def status(self, batch_id: str) -> str:
+        return "completed" if (self.root / batch_id / "output.jsonl").exists() else "in_progress"
+
+    async def results(self, batch_id: str) -> List[Dict[str, Any]]:
+        with open(self.root / batch_id / "output.jsonl", "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+class BatchJudge:
+    """
+    :param backend: where the batch files go
+    :param ledger: the run ledger, cells with "format" but no "score" are judged
+    :param work_dir: the batch input files are written here
+    :param poll_interval: seconds between two status checks
+    :param timeout: seconds to wait for one batch, None waits as long as the backend says in_progress
+    :param max_requests_per_file: the provider limit of one batch file
+    """
+
+    def __init__(self,
+                 backend: BatchBackend,
+                 ledger: RunLedger,
+                 work_dir: str = "./batches",
+                 poll_interval: float = 30.0,
+                 timeout: Optional[float] = None,
+                 max_requests_per_file: int = 50000):
+        self.backend = backend
+        self.ledger = ledger
+        self.work_dir = Path(work_dir)
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.max_requests_per_file = max_requests_per_file
+        self.cache = ModelBase.cache
+
+        self.errors: Dict[str, str] = {}
+        self.timed_out: List[str] = []
+
+    def pending_cells(self) -> List[Dict[str, Any]]:
+        pending = []
+        rules: Dict[str, Tuple[str, str]] = {}
+        for (model, task_id), cell in self.ledger.cells():
+            if "format" not in cell or "score" in cell:
+                continue
+            if task_id not in rules:
+                with open(f"./tasks/{task_id}.md", encoding="utf-8") as f:
+                    task_content = f.read()
+                with open(f"./answers/{task_id}.md", encoding="utf-8") as f:
+                    rules[task_id] = (task_content, f.read())
+            task_content, rule = rules[task_id]
+            pending.append({
+                "model": model,
+                "task_id": task_id,
+                "judge": ScoreModel(
+                    task=task_content, task_id=task_id, rule=rule,
+                    processer=cell["format"]["processer"], results=cell["format"]["result"],
+                ),
+            })
+        return pending
+
+    async def _run_batch(self, name: str, requests: List[Dict[str, Any]]) -> Dict[str, str]:
+        """Submit the requests (split per model and per file limit) and wait for all of them."""
+        by_model: Dict[str, List[Dict[str, Any]]] = {}
+        for request in requests:
+            by_model.setdefault(request["body"]["model"], []).append(request)
+
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        batch_ids = []
+        for model, reqs in by_model.items():
+            for start in range(0, len(reqs), self.max_requests_per_file):
+                path = self.work_dir / f"{name}_{model.replace('/', '_')}_{start // self.max_requests_per_file}.jsonl"
+                with open(path, "w", encoding="utf-8") as f:
+                    for request in reqs[start:start + self.max_requests_per_file]:
+                        f.write(json.dumps(request, ensure_ascii=False) + "\n")
+                batch_ids.append(await self.backend.submit(path))
+                print(f"[batch] {name}: submitted {path} as {batch_ids[-1]}")
+
+        contents: Dict[str, str] = {}
+        models = {r["custom_id"]: r["body"]["model"] for r in requests}
+        for batch_id in batch_ids:
+            started = time.monotonic()
+            while True:
+                status = await self.backend.status(batch_id)
+                if status != "in_progress":
+                    break
+                if self.timeout is not None and time.monotonic() - started >= self.timeout:
+                    status = "timeout"
+                    break
+                await asyncio.sleep(self.poll_interval)
+            if status == "timeout":
+                self.timed_out.append(batch_id)
+                print(f"[batch] {name}: {batch_id} still in progress after {self.timeout:.0f}s, given up; "
+                      f"its cells are submitted again by the next run")
+                continue
+            if status == "failed":
+                print(f"[batch] {name}: {batch_id} failed")
+                continue
+            for record in await self.backend.results(batch_id):
+                custom_id, content, usage, error = parse_output_line(record)
+                if error is not None or not content:
+                    self.errors[custom_id] = error or "empty content"
+                    continue
+                if usage is not None:
+                    usage_meter.record(models.get(custom_id, ""), usage)
+                contents[custom_id] = content
+        return contents
+
+    def _cached(self, model_name: str, msg: List[Dict[str, str]]) -> Optional[str]:
+        return self.cache.get(self.cache.make_key(model_name, msg))
+
+    async def _advice_phase(self, cells: List[Dict[str, Any]]) -> Dict[str, str]:
+        advice: Dict[str, str] = {}
+        requests: List[Dict[str, Any]] = []
+        messages: Dict[str, Tuple[str, List[Dict[str, str]]]] = {}
+        for cell in cells:
+            judge = cell["judge"]
+            for kind, adviser in (("positive", judge.advice_positive), ("negative", judge.advice_negative)):
+                custom_id = make_custom_id(cell["model"], cell["task_id"], kind)
+                msg = adviser.messages(judge.processer)
+                cached = self._cached(adviser.model_name, msg)
+                if cached is not None:
+                    advice[custom_id] = cached
+                    continue
+                messages[custom_id] = (adviser.model_name, msg)
+                requests.append(build_request(custom_id, adviser.model_name, msg))
+        if requests:
+            results = await self._run_batch("advice", requests)
+            for custom_id, content in results.items():
+                model_name, msg = messages[custom_id]
+                self.cache.set(self.cache.make_key(model_name, msg), content)
+            advice.update(results)
+        return advice
+
+    async def _score_phase(self, cells: List[Dict[str, Any]], advice: Dict[str, str]) -> Dict[str, str]:
+        scores: Dict[str, str] = {}
+        requests: List[Dict[str, Any]] = []
+        messages: Dict[str, List[Dict[str, str]]] = {}
+        for cell in cells:
+            model, task_id, judge = cell["model"], cell["task_id"], cell["judge"]
+            positive = advice.get(make_custom_id(model, task_id, "positive"))
+            negative = advice.get(make_custom_id(model, task_id, "negative"))
+            if positive is None or negative is None:
+                # 建议没拿到，这个 cell 留给下一次
+                continue
+            custom_id = make_custom_id(model, task_id, "score")
+            msg = judge.messages(positive, negative)
+            cached = self._cached(judge.model_name, msg)
+            if cached is not None:
+                scores[custom_id] = cached
+                continue
+            messages[custom_id] = msg
+            requests.append(build_request(custom_id, judge.model_name, msg))
+        if requests:
+            results = await self._run_batch("score", requests)
+            for custom_id, content in results.items():
+                self.cache.set(self.cache.make_key(ScoreModel.model_name, messages[custom_id]), content)
+            scores.update(results)
+        return scores
+
+    @staticmethod
+    def warn_unsupported() -> None:
+        """Batch mode judges one text sample per cell, say so when the environment asks for more."""
+        if os.getenv("JUDGE_OUTPUT", "text") == "json":
+            print("[batch] JUDGE_OUTPUT=json is not supported in batch mode, the judge answers in the text layout")
+        sampler = SequentialSampler.from_env()
+        if sampler.enabled:
+            print(f"[batch] JUDGE_SAMPLES_MAX={sampler.max_samples} is ignored in batch mode, one sample per cell")
+
+    async def run(self) -> Dict[str, int]:
+        self.warn_unsupported()
+        cells = self.pending_cells()
+        print(f"[batch] {len(cells)} cells to judge")
+        if not cells:
+            return {"pending": 0, "scored": 0, "errors": 0, "timed_out": 0}
+        advice = await self._advice_phase(cells)
+        scores = await self._score_phase(cells, advice)
+        for custom_id, score_str in scores.items():
+            model, task_id, _ = split_custom_id(custom_id)
+            score_str += f"\nModel name: {model}\nTask time: {str(datetime.now())}"
+            self.ledger.record(model, task_id, "score", score_str)
+        for custom_id, error in self.errors.items():
+            print(f"[batch] {custom_id}: {error}")
+        return {"pending": len(cells), "scored": len(scores), "errors": len(self.errors),
+                "timed_out": len(self.timed_out)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Judge the pending cells of the ledger through a batch API")
+    parser.add_argument("--backend", choices=("openai", "local"), default="openai")
+    parser.add_argument("--work-dir", default="./batches")
+    parser.add_argument("--poll", type=float, default=60.0, help="seconds between two status checks")
+    parser.add_argument("--timeout", type=float,
+                        help="seconds to wait for one batch, default 25h for openai (the 24h window), 10min for local")
+    args = parser.parse_args()
+
+    if args.backend == "openai":
+        backend = OpenAIBatchBackend()
+        timeout = args.timeout or 25 * 3600
+    else:
+        backend = LocalBatchBackend(os.path.join(args.work_dir, "local"))
+        timeout = args.timeout or 600
+        print(f"[batch] local backend: waiting for <batch dir>/output.jsonl under {backend.root}")
+    judge = BatchJudge(
+        backend,
+        RunLedger(os.getenv("RUN_LEDGER_PATH", "./ledger/ledger.jsonl")),
+        work_dir=args.work_dir,
+        poll_interval=args.poll,
+        timeout=timeout,
+    )
+    print(asyncio.run(judge.run()))
+    print(f"Judge token usage: {usage_meter.stats()}")
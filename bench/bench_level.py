@@ -0,0 +1,75 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : bench_level.py
+
+"""
+One concurrency level of the benchmark, started by run_bench.py inside a prepared workspace.
+The last line of stdout is the JSON result; the exit code is 1 when any cell failed or did not finish,
+the numbers of such a level do not measure the pipeline.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import time
+
+import main
+from models import model_list
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, required=True)
+    parser.add_argument("--models", type=int, default=2)
+    args = parser.parse_args()
+
+    # the grid of the benchmark: mock models through the OpenAI provider
+    model_list[:] = [f"openai:mock-agent-{i}" for i in range(args.models)]
+
+    expected = main.count_cells()
+    started = time.perf_counter()
+    stats = asyncio.run(main.main(
+        main.task_generator(),
+        agent_workers=args.workers,
+        judge_workers=args.workers,
+        extract_workers=args.workers,
+    ))
+    wall = time.perf_counter() - started
+
+    latencies = []
+    with open(os.environ["TRACE_PATH"], encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record.get("type") == "cell":
+                latencies.append(record["duration"])
+
+    # ru_maxrss is KB on Linux; RUSAGE_CHILDREN gives the largest MCP server process
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    failed = max(sum(stage["failed"] for stage in stats.values()), len(main.ledger.failed()))
+    print(json.dumps({
+        "cells": len(latencies),
+        "expected": expected,
+        "failed": failed,
+        "wall": wall,
+        "cells_per_min": len(latencies) / wall * 60 if wall else 0.0,
+        "p50": percentile(latencies, 0.5),
+        "p99": percentile(latencies, 0.99),
+        "peak_rss_mb": rss / 1024,
+    }))
+    for (model, task_id), error in main.ledger.failed().items():
+        print(f"[FAILED] {model} {task_id} at {error['stage']}: {error['error']}", file=sys.stderr)
+    sys.exit(1 if failed or len(latencies) < expected else 0)
@@ -0,0 +1,49 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : mock_mcp_server.py
+
+"""
+A stdio MCP server standing in for stata-mcp in the benchmark.
+It exposes a few tools with the same names as stata-mcp, each one sleeps MOCK_MCP_LATENCY seconds.
+
+servers_config.json:
+    {"mcpServers": {"stata-mcp": {"command": "python", "args": ["bench/mock_mcp_server.py"], "transport": "stdio"}}}
+"""
+import asyncio
+import os
+
+from mcp.server.fastmcp import FastMCP
+
+LATENCY = float(os.getenv("MOCK_MCP_LATENCY", "0.05"))
+
+mcp = FastMCP("stata-mcp")
+
+
+@mcp.tool()
+async def get_data_info(data_path: str) -> str:
+    """Describe a dataset."""
+    await asyncio.sleep(LATENCY)
+    return f"Mock description of {data_path}: 706 obs, 34 vars."
+
+
+@mcp.tool()
+async def stata_do(dofile_path: str) -> str:
+    """Run a do-file."""
+    await asyncio.sleep(LATENCY)
+    return f"Mock log of {dofile_path}: regression finished."
+
+
+@mcp.tool()
+async def write_dofile(content: str) -> str:
+    """Write a do-file."""
+    await asyncio.sleep(LATENCY)
+    return "/tmp/mock.do"
+
+
+if __name__ == "__main__":
+    mcp.run(transport="stdio")
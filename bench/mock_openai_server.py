@@ -0,0 +1,219 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : mock_openai_server.py
+
+"""
+A local OpenAI-compatible `/v1/chat/completions` server for the benchmark.
+
+    - latency is drawn from a log-normal distribution (median, sigma)
+    - a fraction of the requests is answered with 429
+    - usage is filled from the request size (4 chars a token) and a fixed completion size
+    - agent requests get one tool call first, then a final answer
+    - judge requests get a well-formed `<score>` block so the local parser handles extraction
+
+Usage:
+    python bench/mock_openai_server.py --port 8765 --latency-median 0.5 --rate-429 0.02
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+SCORE_TEMPLATE = """<meta>
+TaskID: {task_id}
+Language: EN
+</meta>
+<score>
+<score_from_results>
+Result Score: {result} / 20
+Reason: Mock reason for the result.
+</score_from_results>
+<score_from_processer>
+Processer Score: {processer} / 80
+Reason: Mock reason for the process.
+<detail>
+<agent_reasoning>
+Score: {d0} / 20
+Reason: Mock reasoning.
+</agent_reasoning>
+<tool_usage>
+Score: {d1} / 20
+Reason: Mock tool usage.
+</tool_usage>
+<error_handling>
+Score: {d2} / 20
+Reason: Mock error handling.
+</error_handling>
+<planning>
+Score: {d3} / 20
+Reason: Mock planning.
+</planning>
+</detail>
+</score_from_processer>
+<final_score>
+FinalScore: {final} = {result} + {processer}
+</final_score>
+</score>"""
+
+
+class MockConfig:
+    def __init__(self,
+                 latency_median: float = 0.5,
+                 latency_sigma: float = 0.5,
+                 rate_429: float = 0.0,
+                 completion_tokens: int = 200,
+                 seed: Optional[int] = None):
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.rate_429 = rate_429
+        self.completion_tokens = completion_tokens
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rejected = 0
+
+    def latency(self) -> float:
+        with self.lock:
+            return self.random.lognormvariate(math.log(self.latency_median), self.latency_sigma)
+
+    def reject(self) -> bool:
+        with self.lock:
+            self.requests += 1
+            if self.random.random() < self.rate_429:
+                self.rejected += 1
+                return True
+            return False
+
+    def score(self, task_id: str) -> str:
+        with self.lock:
+            dims = [self.random.randint(5, 20) for _ in range(4)]
+            result = self.random.randint(0, 20)
+        processer = sum(dims)
+        return SCORE_TEMPLATE.format(task_id=task_id, result=result, processer=processer,
+                                     d0=dims[0], d1=dims[1], d2=dims[2], d3=dims[3],
+                                     final=result + processer)
+
+
+def _text(content: Any) -> str:
+    if isinstance(content, list):
+        return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content)
+    return content or ""
+
+
+def _tool_call(tools: List[Dict[str, Any]]) -> Dict[str, Any]:
+    names = [t["function"]["name"] for t in tools]
+    tool = tools[names.index("get_data_info")] if "get_data_info" in names else tools[0]
+    params = tool["function"].get("parameters") or {}
+    args = {name: "mock" for name in params.get("required", [])}
+    return {
+        "id": f"call_{uuid.uuid4().hex[:12]}",
+        "type": "function",
+        "function": {"name": tool["function"]["name"], "arguments": json.dumps(args)},
+    }
+
+
+def respond(config: MockConfig, body: Dict[str, Any]) -> Dict[str, Any]:
+    messages = body.get("messages", [])
+    system = _text(messages[0].get("content")) if messages else ""
+    message: Dict[str, Any] = {"role": "assistant", "content": ""}
+    finish = "stop"
+
+    if "evaluation and scoring model" in system:
+        task_id = "mock"
+        for m in messages:
+            text = _text(m.get("content"))
+            if "And task id is:" in text:
+                task_id = text.rsplit("And task id is:", 1)[1].strip()
+                break
+        message["content"] = config.score(task_id)
+    elif body.get("tools") and not any(m.get("role") == "tool" for m in messages):
+        message["content"] = None
+        message["tool_calls"] = [_tool_call(body["tools"])]
+        finish = "tool_calls"
+    else:
+        message["content"] = "Mock answer. " * max(1, config.completion_tokens // 3)
+
+    prompt_tokens = sum(len(_text(m.get("content"))) for m in messages) // 4
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": [{"index": 0, "message": message, "finish_reason": finish}],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": config.completion_tokens,
+            "total_tokens": prompt_tokens + config.completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": 0},
+        },
+    }
+
+
+def make_handler(config: MockConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):  # keep the benchmark output clean
+            pass
+
+        def _send(self, status: int, payload: Dict[str, Any], headers: Dict[str, str] = None):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send(404, {"error": {"message": f"unknown path {self.path}"}})
+                return
+            time.sleep(config.latency())
+            if config.reject():
+                self._send(429, {"error": {"message": "rate limited (mock)", "type": "rate_limit_exceeded"}},
+                           {"retry-after": "0"})
+                return
+            self._send(200, respond(config, body))
+
+    return Handler
+
+
+def serve(config: MockConfig, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Start the server in a daemon thread; the real port is `server.server_address[1]`."""
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="mock-openai", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-median", type=float, default=0.5)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--completion-tokens", type=int, default=200)
+    args = parser.parse_args()
+
+    cfg = MockConfig(args.latency_median, args.latency_sigma, args.rate_429, args.completion_tokens)
+    srv = ThreadingHTTPServer((args.host, args.port), make_handler(cfg))
+    print(f"mock OpenAI server on http://{args.host}:{args.port}/v1")
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : run_bench.py
+
+"""
+Hermetic benchmark of the whole pipeline (`main.main`), no real API is called.
+
+A mock chat-completions server (bench/mock_openai_server.py) serves the agents, the judge and
+LangExtract, and a mock stdio MCP server (bench/mock_mcp_server.py) stands in for stata-mcp.
+Every concurrency level runs in a fresh process over a fresh workspace, and reports
+cells/minute, p50 / p99 cell latency and peak RSS.
+
+Usage:
+    python bench/run_bench.py --levels 1,4,16 --tasks 20 --models 3 --latency-median 0.3 --rate-429 0.02
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List
+
+from mock_openai_server import MockConfig, serve
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+
+
+def make_workspace(root: Path, n_tasks: int, task_chars: int) -> None:
+    (root / "tasks").mkdir(parents=True)
+    (root / "answers").mkdir()
+    for i in range(n_tasks):
+        task_id = f"B{i:04d}"
+        (root / "tasks" / f"{task_id}.md").write_text(
+            f"# Task {task_id}\n" + "Estimate the model and report the results. " * (task_chars // 43),
+            encoding="utf-8",
+        )
+        (root / "answers" / f"{task_id}.md").write_text(f"Reference answer of {task_id}.\n", encoding="utf-8")
+    config = {"mcpServers": {"stata-mcp": {
+        "command": sys.executable,
+        "args": [str(BENCH_DIR / "mock_mcp_server.py")],
+        "transport": "stdio",
+    }}}
+    (root / "servers_config.json").write_text(json.dumps(config), encoding="utf-8")
+
+
+def run_level(level: int, args: argparse.Namespace, base_url: str) -> Dict[str, Any]:
+    root = Path(tempfile.mkdtemp(prefix=f"bench_{level}_"))
+    try:
+        make_workspace(root, args.tasks, args.task_chars)
+        env = dict(os.environ)
+        env.update({
+            "PYTHONPATH": os.pathsep.join(filter(None, [str(REPO_DIR), env.get("PYTHONPATH")])),
+            # every upstream goes to the mock server
+            "OPENROUTER_BASE_URL": base_url, "OPENROUTER_API_KEY": "mock",
+            "OPENAI_API_BASE": base_url, "OPENAI_BASE_URL": base_url, "OPENAI_API_KEY": "mock",
+            "DEEPSEEK_BASE_URL": base_url, "DEEPSEEK_API_KEY": "mock",
+            "LEARN_BASE_URL": base_url,
+            "MCP_SERVERS_CONFIG": str(root / "servers_config.json"),
+            "MOCK_MCP_LATENCY": str(args.mcp_latency),
+            # fresh state for every level
+            "LLM_CACHE_PATH": str(root / ".cache" / "llm_cache.sqlite"),
+            "RUN_LEDGER_PATH": str(root / "ledger" / "ledger.jsonl"),
+            "TRACE_PATH": str(root / "traces" / "trace.jsonl"),
+            "TRACE_PROM_PATH": str(root / "traces" / "metrics.prom"),
+            "MCP_POOL_SIZE": str(level),
+            "PIPELINE_REPORT_INTERVAL": "0",
+        })
+        cmd = [sys.executable, str(BENCH_DIR / "bench_level.py"),
+               "--workers", str(level), "--models", str(args.models)]
+        proc = subprocess.run(cmd, cwd=root, env=env, capture_output=True, text=True)
+        try:
+            row = json.loads(proc.stdout.strip().splitlines()[-1])
+        except (IndexError, json.JSONDecodeError):
+            raise RuntimeError(f"level {level} crashed:\n{proc.stdout[-2000:]}\n{proc.stderr[-4000:]}")
+        row["ok"] = proc.returncode == 0
+        if not row["ok"]:
+            # 有 cell 失败时这一档的吞吐和延迟没有意义，把原因打出来
+            print(f"level {level}: {row['failed']} failed, {row['cells']} of {row['expected']} cells finished\n"
+                  f"{proc.stderr[-4000:]}", file=sys.stderr)
+        return row
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def print_table(rows: List[Dict[str, Any]]) -> None:
+    header = f"{'level':>6} {'cells':>6} {'failed':>6} {'wall_s':>8} {'cells/min':>10} {'p50_s':>8} {'p99_s':>8} {'rss_mb':>8}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(f"{r['level']:>6} {r['cells']:>6} {r['failed']:>6} {r['wall']:>8.2f} {r['cells_per_min']:>10.1f} "
+              f"{r['p50']:>8.2f} {r['p99']:>8.2f} {r['peak_rss_mb']:>8.1f}" + ("" if r["ok"] else "  INVALID"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", default="1,4,16", help="comma separated concurrency levels")
+    parser.add_argument("--tasks", type=int, default=10)
+    parser.add_argument("--models", type=int, default=2)
+    parser.add_argument("--task-chars", type=int, default=2000)
+    parser.add_argument("--latency-median", type=float, default=0.3)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--completion-tokens", type=int, default=200)
+    parser.add_argument("--mcp-latency", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the workspaces for inspection")
+    args = parser.parse_args()
+
+    mock = MockConfig(args.latency_median, args.latency_sigma, args.rate_429, args.completion_tokens, args.seed)
+    server = serve(mock)
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    results = []
+    for lvl in (int(x) for x in args.levels.split(",")):
+        row = run_level(lvl, args, url)
+        row["level"] = lvl
+        results.append(row)
+    server.shutdown()
+
+    print_table(results)
+    print(f"mock server: {mock.requests} requests, {mock.rejected} answered with 429")
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2), encoding="utf-8")
+    if mock.requests == 0 or not all(r["ok"] for r in results):
+        print("benchmark INVALID: cells failed or the mock server was never called", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,273 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : cli.py
+
+"""
+The command line entry point.
+
+    python cli.py run        # run the pending cells of the grid
+    python cli.py resume     # only the cells which were started before and did not finish
+    python cli.py plan       # what a run would do and cost, estimated from the trace history, no network
+    python cli.py aggregate  # ingest outputs/ and print the leaderboard
+
+    python cli.py run --spawn 4                   # 4 local processes, merged at the end
+    python cli.py run --shard 1/4                 # one static part of the grid, e.g. on another machine
+    python cli.py run --queue /shared/queue.db    # pull cells from a shared work queue
+    python cli.py merge                           # join the per-worker ledgers
+
+Only the standard library is imported at the top; langchain, langextract and the API clients are
+loaded by the subcommands which need them, so `plan` and `aggregate` start fast and need no credentials.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from typing import List, Optional
+
+DEFAULT_LEDGER = "./ledger/ledger.jsonl"
+
+
+def _models(args: argparse.Namespace) -> List[str]:
+    from models import model_list
+
+    if args.models:
+        model_list[:] = [m.strip() for m in args.models.split(",") if m.strip()]
+    return model_list
+
+
+def _merged_ledger(args: argparse.Namespace) -> str:
+    """The ledger of the whole grid; shard and queue workers write their own next to it."""
+    return getattr(args, "ledger", None) or os.getenv("RUN_LEDGER_PATH", DEFAULT_LEDGER)
+
+
+def _worker_ledger(merged: str, tag: str) -> str:
+    path = Path(merged)
+    return str(path.with_name(f"{path.stem}.{tag}{path.suffix}"))
+
+
+def _apply_env(args: argparse.Namespace) -> None:
+    # the modules read their config from the environment when they are imported
+    merged = _merged_ledger(args)
+    ledger, bases = merged, []
+    # 分片 / 队列模式下每个 worker 写自己的 ledger，跑完再 merge；之前跑完的 cell 从合并后的 ledger 里读
+    if getattr(args, "shard", None):
+        i, n = args.shard.split("/")
+        ledger, bases = _worker_ledger(merged, f"shard{i}of{n}"), [merged]
+    elif getattr(args, "queue", None):
+        from sharding import default_worker_id
+
+        args.worker_id = args.worker_id or default_worker_id()
+        ledger = _worker_ledger(merged, args.worker_id)
+        # a re-leased cell may have been half done by another worker, or by this host before a restart
+        path = Path(merged)
+        bases = [merged] + sorted(glob.glob(str(path.with_name(f"{path.stem}.*{path.suffix}"))))
+    os.environ["RUN_LEDGER_PATH"] = ledger
+    os.environ["RUN_LEDGER_BASES"] = os.pathsep.join(bases)
+
+
+def _spawn_shards(args: argparse.Namespace) -> int:
+    """Run the grid in `args.spawn` local processes, one static shard each, and merge their ledgers."""
+    import subprocess
+
+    from sharding import merge_ledgers
+
+    # 去掉 --spawn N，换成每个子进程自己的 --shard k/N；--ledger 原样传下去，子进程的 ledger 由它派生
+    argv, rest = [], iter(sys.argv[1:])
+    for arg in rest:
+        if arg == "--spawn":
+            next(rest, None)
+        elif not arg.startswith("--spawn="):
+            argv.append(arg)
+    procs = [subprocess.Popen([sys.executable, os.path.abspath(__file__), *argv, "--shard", f"{k}/{args.spawn}"])
+             for k in range(args.spawn)]
+    codes = [p.wait() for p in procs]
+    out = _merged_ledger(args)
+    paths = [_worker_ledger(out, f"shard{k}of{args.spawn}") for k in range(args.spawn)]
+    print(f"Merged ledger: {merge_ledgers([p for p in paths if os.path.exists(p)], out)}")
+    return max(codes)
+
+
+def cmd_run(args: argparse.Namespace, started_only: bool = False) -> int:
+    import asyncio
+
+    if args.spawn:
+        return _spawn_shards(args)
+    _apply_env(args)
+    models = _models(args)
+    import main
+
+    queue = None
+    if args.shard:
+        from sharding import in_shard, parse_shard
+
+        items = in_shard(main.task_generator(started_only=started_only, order=args.order), *parse_shard(args.shard))
+    elif args.queue:
+        import grid
+        from sharding import WorkQueue, queue_items
+
+        queue = WorkQueue(args.queue, worker_id=args.worker_id, lease_seconds=args.lease)
+        # main.ledger replays the merged ledger and the other workers' ledgers, finished cells are not queued
+        seeded = queue.seed((model, task_id) for task_id in grid.list_tasks()
+                            for model in grid.pending_models(main.ledger, task_id, models))
+        print(f"Work queue {args.queue}: {seeded} new cells, {queue.stats()}")
+        items = queue_items(queue, main.ledger)
+    else:
+        print(f"Total tasks: {main.count_cells()}")
+        items = main.task_generator(started_only=started_only, order=args.order)
+
+    async def _run():
+        keep_alive = asyncio.create_task(queue.keep_alive(main.ledger)) if queue is not None else None
+        try:
+            return await main.main(
+                items,
+                agent_workers=args.agent_workers,
+                judge_workers=args.judge_workers,
+                extract_workers=args.extract_workers,
+                report_interval=args.report_interval,
+                judge_schedule=args.judge_schedule,
+            )
+        finally:
+            if keep_alive is not None:
+                keep_alive.cancel()
+                queue.reconcile(main.ledger, release=True)
+                print(f"Work queue: {queue.stats()}")
+                queue.close()
+
+    results = asyncio.run(_run())
+    print(f"Results: {results}")
+    # main.ledger also replays the failures of earlier runs and other workers, count only this process
+    return 1 if sum(stage["failed"] for stage in results.values()) else 0
+
+
+def cmd_merge(args: argparse.Namespace) -> int:
+    from sharding import merge_ledgers
+
+    paths = args.paths or sorted(glob.glob(_worker_ledger(args.out, "*")))
+    print(f"Merged {len(paths)} ledgers into {args.out}: {merge_ledgers(paths, args.out)}")
+    return 0
+
+
+def cmd_resume(args: argparse.Namespace) -> int:
+    return cmd_run(args, started_only=True)
+
+
+def cmd_plan(args: argparse.Namespace) -> int:
+    import grid
+    from ledger import RunLedger
+    from planner import Planner, lpt_order, summary
+
+    models = _models(args)
+    ledger = RunLedger(args.ledger or os.getenv("RUN_LEDGER_PATH", DEFAULT_LEDGER))
+    tasks = grid.list_tasks(args.tasks_dir)
+    planner = Planner.from_env(tasks_dir=args.tasks_dir)
+    history = planner.load_trace(args.trace)
+    cells = planner.plan(ledger, models)
+    by_stage: Counter = Counter(cell["stage"] for cell in cells)
+    print(f"Grid: {len(models)} models x {len(tasks)} tasks = {len(models) * len(tasks)} cells, {len(cells)} pending")
+    print(f"Resume at: {dict(by_stage)}")
+    print(f"History: {history} finished cells in {args.trace}")
+    for model in models:
+        mine = [cell for cell in cells if cell["model"] == model]
+        sources = Counter(cell["source"] for cell in mine)
+        print(f"  {model}: {len(mine)} pending, ~{sum(c['seconds'] for c in mine) / 60:.1f} min, "
+              f"${sum(c['cost'] for c in mine):.4f} ({dict(sources)})")
+    print(f"Estimate: {summary(cells, args.concurrency)}")
+    if args.top:
+        print(f"Longest {args.top} cells (started first):")
+        for cell in lpt_order(cells)[:args.top]:
+            print(f"  {cell['seconds']:8.1f}s  {cell['model']}  {cell['task_id']}  at {cell['stage']}")
+    failed = ledger.failed()
+    if failed:
+        print(f"Failed before: {len(failed)} cells")
+    return 0
+
+
+def cmd_aggregate(args: argparse.Namespace) -> int:
+    import json
+    import time
+
+    from results_store import ResultsStore, format_table
+
+    start = time.perf_counter()
+    store = ResultsStore(args.db)
+    ingested = store.ingest()
+    rows = store.aggregate(by=args.by, n_boot=args.bootstrap)
+    store.close()
+    print(json.dumps(rows, ensure_ascii=False, indent=2) if args.json else format_table(rows, args.by))
+    print(f"ingested {ingested['records']} records from {ingested['files']} files, "
+          f"{time.perf_counter() - start:.3f}s")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--models", help="comma separated models, default to models.model_list")
+    common.add_argument("--ledger", help="the ledger of the grid, default to $RUN_LEDGER_PATH; "
+                                         "shard and queue workers write their own next to it")
+
+    # the per-endpoint limiters do the throttling, these are only the number of items in flight per stage
+    running = argparse.ArgumentParser(add_help=False, parents=[common])
+    running.add_argument("--agent-workers", type=int, default=int(os.getenv("AGENT_WORKERS", "5")))
+    running.add_argument("--judge-workers", type=int, default=int(os.getenv("JUDGE_WORKERS", "16")))
+    running.add_argument("--extract-workers", type=int, default=int(os.getenv("EXTRACT_WORKERS", "4")))
+    running.add_argument("--report-interval", type=float, default=float(os.getenv("PIPELINE_REPORT_INTERVAL", "30")))
+    running.add_argument("--judge-schedule", choices=("task", "fifo"), default=os.getenv("JUDGE_SCHEDULE", "task"))
+    running.add_argument("--order", choices=("file", "lpt"), default=os.getenv("RUN_ORDER", "file"),
+                         help="lpt starts the longest estimated cells first (plans the whole grid up front), "
+                              "see planner.py")
+
+    # several processes / machines, see sharding.py
+    running.add_argument("--shard", help="i/n, run only the i-th of n deterministic parts of the grid")
+    running.add_argument("--spawn", type=int, default=0, help="run n local processes, one shard each")
+    running.add_argument("--queue", help="pull the cells from this shared SQLite work queue")
+    running.add_argument("--worker-id", help="the name of a queue worker, default to <hostname>-<pid>")
+    running.add_argument("--lease", type=float, default=900, help="seconds before an unrenewed lease expires")
+
+    sub.add_parser("run", parents=[running], help="run the pending cells").set_defaults(func=cmd_run)
+    sub.add_parser("resume", parents=[running], help="finish the started cells only").set_defaults(func=cmd_resume)
+
+    merge = sub.add_parser("merge", help="merge the per-worker ledgers into one")
+    merge.add_argument("paths", nargs="*", help="default to the worker ledgers next to --out")
+    merge.add_argument("--out", default=os.getenv("RUN_LEDGER_PATH", DEFAULT_LEDGER))
+    merge.set_defaults(func=cmd_merge)
+
+    plan = sub.add_parser("plan", parents=[common], help="show the pending work, no network")
+    plan.add_argument("--tasks-dir", default="./tasks")
+    plan.add_argument("--trace", default=os.getenv("TRACE_PATH", "./traces/trace.jsonl"),
+                      help="the trace of earlier runs, the history of the estimates")
+    plan.add_argument("--concurrency", type=int, default=int(os.getenv("AGENT_WORKERS", "5")),
+                      help="agent workers the makespan is estimated for")
+    plan.add_argument("--top", type=int, default=10, help="list the longest cells")
+    plan.set_defaults(func=cmd_plan)
+
+    agg = sub.add_parser("aggregate", help="ingest the results and print the leaderboard")
+    agg.add_argument("--db", default="./results/results.sqlite")
+    agg.add_argument("--by", choices=("model", "task"), default="model")
+    agg.add_argument("--bootstrap", type=int, default=2000, help="number of bootstrap resamples")
+    agg.add_argument("--json", action="store_true", help="print JSON instead of a table")
+    agg.set_defaults(func=cmd_aggregate)
+    return parser
+
+
+def cli(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    start = time.perf_counter()
+    code = args.func(args)
+    if args.command in ("plan", "aggregate"):
+        print(f"({time.perf_counter() - start:.3f}s)", file=sys.stderr)
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
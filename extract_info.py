@@ -10,23 +10,182 @@
 """
 This file is based on the Google's LangExtract.
 If you are finding more powerful usage method, you can get it from this repo.
+
+The score strings which the local parser cannot read go to LangExtract in batches (`ExtractBatcher`):
+one `lx.extract` call with a list of Documents per batch, on a bounded thread pool. Every extract
+worker of the pipeline waits for one document, so a batch is sent at once when all of them
+(--extract-workers, `ScoreExtract.set_workers`) are waiting, no need to wait EXTRACT_BATCH_WAIT then.
+
+Environment:
+    EXTRACT_BATCH_SIZE    documents per lx.extract call, default to the number of extract workers (8 if unknown)
+    EXTRACT_BATCH_WAIT    seconds a batch waits for more documents, default 2
+    EXTRACT_THREADS       concurrent lx.extract calls, default 2
+    EXTRACT_LLM_WORKERS   LangExtract max_workers inside one call, default 4
+    EXTRACT_RETRIES       retries of a batch failing with a 429 / 5xx / connection error, default 2
+    EXTRACT_DEADLINE      seconds to wait for one attempt of a batch, default 900
 """
 import os
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Set, Tuple
 
 import langextract as lx
 import textwrap
+from langextract import data_lib
 # If you are located in China, you also could use DeepSeek as your model provider.
 from langextract.providers.openai import OpenAILanguageModel
 
+from grid import cell_stem
+from hedging import HedgePolicy
+from lazy import is_loaded, lazy_class_attr, reset
+from limiter import estimate_tokens, get_limiter
+from llm_cache import ResponseCache, response_cache
+from score_parser import ParseStats, ScoreParseError, ScoreParser
+from tracing import tracer
+
+
+class ExtractBatcher:
+    """
+    Gather the documents which need the LLM extraction and send them together: a batch goes out when it
+    has `batch_size` documents, when all the `waiters` callers are waiting for a result, or `max_wait`
+    seconds after its first one. The blocking call runs on a pool of `threads` threads, so the event loop
+    never waits for the network.
+    :param run_batch: blocking, {doc_id: text} -> {doc_id: AnnotatedDocument}
+    :param tokens: the estimated tokens of one document, for the rate limiter of `endpoint`
+    :param waiters: how many callers can submit at the same time (the extract workers), None if unknown
+    :param policy: retries a failed batch, every attempt holds its own limiter slot
+    """
+
+    def __init__(self,
+                 run_batch: Callable[[Dict[str, str]], Dict[str, lx.data.AnnotatedDocument]],
+                 tokens: Callable[[str], int],
+                 endpoint: str,
+                 batch_size: int = 8,
+                 max_wait: float = 2.0,
+                 threads: int = 2,
+                 waiters: Optional[int] = None,
+                 policy: Optional[HedgePolicy] = None):
+        self.run_batch = run_batch
+        self.tokens = tokens
+        self.endpoint = endpoint
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.waiters = waiters
+        self.policy = policy
+        self._waiting = 0  # submit calls waiting for a result, in the pending batch or in one being sent
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="extract")
+        self._pending: Dict[str, Tuple[str, asyncio.Future]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._sending: Set[asyncio.Task] = set()
+        self.batches = 0
+        self.documents = 0
+
+    async def submit(self, doc_id: str, text: str) -> lx.data.AnnotatedDocument:
+        loop = asyncio.get_running_loop()
+        self._waiting += 1
+        try:
+            shared = doc_id in self._pending
+            if shared:
+                future = self._pending[doc_id][1]
+            else:
+                future = loop.create_future()
+                self._pending[doc_id] = (text, future)
+            if len(self._pending) >= self.batch_size or (self.waiters and self._waiting >= self.waiters):
+                # 批满了，或者每个 worker 都在这里等，不会再有新文档进来
+                self._flush()
+            elif self._timer is None:
+                self._timer = loop.call_later(self.max_wait, self._flush)
+            return await (asyncio.shield(future) if shared else future)
+        finally:
+            self._waiting -= 1
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            task = asyncio.ensure_future(self._send(batch))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, batch: Dict[str, Tuple[str, asyncio.Future]]) -> None:
+        texts = {doc_id: text for doc_id, (text, _) in batch.items()}
+        limiter = get_limiter(self.endpoint)
+        tokens = sum(map(self.tokens, texts.values()))
+
+        async def _request() -> Dict[str, lx.data.AnnotatedDocument]:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, self.run_batch, texts)
+
+        async def _send_once() -> Dict[str, lx.data.AnnotatedDocument]:
+            async with limiter.slot(tokens=tokens):
+                return await _request()
+
+        with tracer.span("extract.batch", documents=len(texts)) as sp:
+            try:
+                if self.policy is not None:
+                    results = await self.policy.call(_request, limiter=limiter, tokens=tokens)
+                else:
+                    results = await _send_once()
+            except BaseException as e:
+                # 整批失败，每个在等的 cell 都拿到这个异常
+                for _, future in batch.values():
+                    if future.done():
+                        continue
+                    if isinstance(e, asyncio.CancelledError):
+                        future.cancel()
+                    else:
+                        future.set_exception(e)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                sp.set(error=repr(e))
+                return
+        self.batches += 1
+        self.documents += len(texts)
+        for doc_id, (_, future) in batch.items():
+            if future.done():
+                continue  # the waiting cell was cancelled
+            if doc_id in results:
+                future.set_result(results[doc_id])
+            else:
+                future.set_exception(RuntimeError(f"LangExtract returned no document for {doc_id}"))
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "batches": self.batches,
+            "documents": self.documents,
+            "mean_batch": round(self.documents / self.batches, 2) if self.batches else 0.0,
+        }
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
 
 class ScoreExtract:
     # Set model provider
     # You can change it to any model provider whatever you want.
-    model = OpenAILanguageModel(
-        api_key=os.getenv("DEEPSEEK_API_KEY"),
-        base_url=os.getenv("LEARN_BASE_URL"),
-        model_id="deepseek-chat"
-    )
+    # (built on first use, the fast path never needs it)
+    @lazy_class_attr
+    def model():
+        import openai
+        from http_pool import http_pool
+
+        model = OpenAILanguageModel(
+            api_key=os.getenv("DEEPSEEK_API_KEY"),
+            base_url=os.getenv("LEARN_BASE_URL"),
+            model_id="deepseek-chat"
+        )
+        # LangExtract builds its own sync client without a way to pass one in, swap in the shared pool
+        http_pool.on_close(lambda: reset(ScoreExtract, "model"))
+        model._client = openai.OpenAI(
+            api_key=model.api_key,
+            base_url=model.base_url,
+            organization=model.organization,
+            http_client=http_pool.sync_client(),
+            max_retries=0,  # ExtractBatcher retries, see its policy
+        )
+        return model
 
     # 1. Define the prompt and extraction rules
     prompt_text = "仅提取评分信息：总分、结果分（及原因）、过程分（及原因）、四个维度分（及原因）。不要改写原文。"
@@ -110,26 +269,130 @@ class ScoreExtract:
         )
     ]
 
-    def run(self, input_text: str, task_id: str, model_id: str):
-        # save input text to file with the same name of extracted file name but another dir
-        with open(f"./score_str/{model_id}_{task_id}_score.txt") as f:
-            f.write(input_text)
-        # Run the extraction
-        result = lx.extract(
-            text_or_documents=input_text,
-            prompt_description=self.prompt,
-            examples=self.examples,
-            model=self.model,
-
-            # OpenAI adaptor
+    # the LLM extraction of the cells the local parser cannot read, see ExtractBatcher
+    @lazy_class_attr
+    def batcher():
+        workers = ScoreExtract.workers
+        return ExtractBatcher(
+            run_batch=ScoreExtract().llm_extract_batch,
+            tokens=lambda text: estimate_tokens(ScoreExtract.prompt + ScoreExtract.example_text + text),
+            endpoint=ScoreExtract.endpoint,
+            batch_size=int(os.getenv("EXTRACT_BATCH_SIZE", "0")) or workers or 8,
+            max_wait=float(os.getenv("EXTRACT_BATCH_WAIT", "2")),
+            threads=int(os.getenv("EXTRACT_THREADS", "2")),
+            waiters=workers,
+            # the thread of a timed out batch cannot be stopped, the deadline only bounds the wait
+            policy=HedgePolicy(deadline=float(os.getenv("EXTRACT_DEADLINE", "900")),
+                               retries=int(os.getenv("EXTRACT_RETRIES", "2")), hedge=False),
+        )
+
+    workers: Optional[int] = None  # the extract workers of the pipeline, see set_workers
+    cache: ResponseCache = response_cache
+    endpoint = "learn"  # the name of the rate limiter, see limiter.py
+    parse_stats = ParseStats()
+
+    def _cache_key(self, input_text: str) -> str:
+        return self.cache.make_key(
+            self.model.model_id,
+            [self.prompt, self.example_text, input_text],
             fence_output=True,
             use_schema_constraints=False,
         )
 
-        # Config output setting
-        out_dir = "outputs"
+    def fast_extract(self, input_text: str) -> lx.data.AnnotatedDocument:
+        """
+        Parse the fixed `<score>` layout locally, the records are the same as `lx.extract` gives.
+        :raise ScoreParseError: if the text does not follow the layout or the scores do not sum up
+        """
+        parser = ScoreParser()
+        parser.feed(input_text)
+        extractions = [
+            lx.data.Extraction(
+                extraction_class=name,
+                extraction_text=input_text[start:end],
+                char_interval=lx.data.CharInterval(start_pos=start, end_pos=end),
+                alignment_status=lx.data.AlignmentStatus.MATCH_EXACT,
+                extraction_index=idx,
+            )
+            for idx, (name, start, end) in enumerate(parser.close(), start=1)
+        ]
+        return lx.data.AnnotatedDocument(text=input_text, extractions=extractions)
+
+    def llm_extract_batch(self, texts: Dict[str, str], out_dir: str = "outputs") -> Dict[str, lx.data.AnnotatedDocument]:
+        """
+        Extract many documents with one `lx.extract` call, the cached ones are not sent again,
+        and write every result to `out_dir/{doc_id}.jsonl`. Blocking, run it off the event loop.
+        :param texts: {doc_id: score string}, the doc_id is `grid.cell_stem(model, task_id)`
+        """
+        results: Dict[str, lx.data.AnnotatedDocument] = {}
+        todo: Dict[str, str] = {}
+        for doc_id, text in texts.items():
+            cached = self.cache.get(self._cache_key(text))
+            if cached is not None:
+                results[doc_id] = data_lib.dict_to_annotated_document(json.loads(cached))
+            else:
+                todo[doc_id] = text
+        if todo:
+            documents = [lx.data.Document(text=text, document_id=doc_id) for doc_id, text in todo.items()]
+            extracted = lx.extract(
+                text_or_documents=documents,
+                prompt_description=self.prompt,
+                examples=self.examples,
+                model=self.model,
+                # LangExtract sends the chunks of the documents in parallel
+                batch_length=len(documents),
+                max_workers=int(os.getenv("EXTRACT_LLM_WORKERS", "4")),
+
+                # OpenAI adaptor
+                fence_output=True,
+                use_schema_constraints=False,
+            )
+            for result in extracted:
+                results[result.document_id] = result
+                self.cache.set(self._cache_key(todo[result.document_id]),
+                               json.dumps(data_lib.annotated_document_to_dict(result), ensure_ascii=False))
         os.makedirs(out_dir, exist_ok=True)
-        lx.io.save_annotated_documents([result], out_dir, f"{model_id}_{task_id}.jsonl")
+        for doc_id, result in results.items():
+            lx.io.save_annotated_documents([result], out_dir, f"{doc_id}.jsonl")
+        return results
+
+    @classmethod
+    def set_workers(cls, workers: int) -> None:
+        """The number of pipeline workers which call `run`, the batcher never waits for more documents."""
+        cls.workers = workers
+        if is_loaded(cls, "batcher"):
+            cls.batcher.waiters = workers
+
+    @classmethod
+    def batch_stats(cls) -> Dict[str, float]:
+        return cls.batcher.stats() if is_loaded(cls, "batcher") else {}
+
+    @classmethod
+    def close(cls) -> None:
+        if is_loaded(cls, "batcher"):
+            cls.batcher.close()
+
+    async def run(self, input_text: str, task_id: str, model_id: str):
+        with tracer.span("extract.run", task_id=task_id, model=model_id) as sp:
+            # save input text to file with the same name of extracted file name but another dir
+            os.makedirs("./score_str", exist_ok=True)
+            with open(f"./score_str/{cell_stem(model_id, task_id)}_score.txt", "w", encoding="utf-8") as f:
+                f.write(input_text)
+            # 格式是固定的，先本地解析，解析不了再交给 LLM
+            try:
+                result = self.fast_extract(input_text)
+                self.parse_stats.record(True)
+                sp.set(path="fast")
+            except ScoreParseError as e:
+                self.parse_stats.record(False, str(e))
+                sp.set(path="llm", parse_error=str(e))
+                # batched with the other cells waiting for the LLM, the batch writes the outputs
+                await self.batcher.submit(cell_stem(model_id, task_id), input_text)
+            else:
+                # Config output setting
+                out_dir = "outputs"
+                os.makedirs(out_dir, exist_ok=True)
+                lx.io.save_annotated_documents([result], out_dir, f"{cell_stem(model_id, task_id)}.jsonl")
         print("OK")
 
 
@@ -175,4 +438,4 @@ Task time: 2025-09-19 23:32:51.251420
     """
     task_id = "C2_C1"
     model_name = "deepseek-chat"
-    extractor = ScoreExtract().run(test_text, task_id, model_name)
+    extractor = asyncio.run(ScoreExtract().run(test_text, task_id, model_name))
@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : grid.py
+
+"""
+The model × task grid: which cells exist, which are still pending in the ledger, and the work items.
+
+Nothing heavy is imported here, so the CLI can plan a run without loading langchain or the API clients.
+"""
+from functools import lru_cache
+from pathlib import Path
+from urllib.parse import quote
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from ledger import STAGES, RunLedger
+
+
+def cell_stem(model: str, task_id: str) -> str:
+    """
+    The file name stem of a cell in outputs/, score_str/ and transcripts/: `{model}_{task_id}` with the
+    model percent-encoded, model ids like "deepseek/deepseek-chat-v3.1:free" are no valid file names.
+    `urllib.parse.unquote` gives the model back.
+    """
+    return f"{quote(model, safe='')}_{task_id}"
+
+
+def list_tasks(tasks_dir: str = "./tasks") -> List[str]:
+    # for fix error caused by file `.DS_Store` from macOS
+    return sorted(p.stem for p in Path(tasks_dir).iterdir() if p.is_file() and not p.name.startswith("."))
+
+
+def pending_models(ledger: RunLedger, task_id: str, models: Sequence[str]) -> List[str]:
+    return [model for model in models if not ledger.is_done(model, task_id)]
+
+
+def next_stage(ledger: RunLedger, model: str, task_id: str) -> Optional[str]:
+    """The stage a cell resumes at, None when it is finished."""
+    cell = ledger.cell(model, task_id)
+    for stage in STAGES:
+        if stage not in cell:
+            return stage
+    return None
+
+
+def pending_cells(ledger: RunLedger,
+                  models: Sequence[str],
+                  tasks_dir: str = "./tasks",
+                  started_only: bool = False) -> List[Tuple[str, str]]:
+    """(model, task_id) of the pending cells in file order, see task_generator for started_only."""
+    cells = []
+    for task_id in list_tasks(tasks_dir):
+        for model in pending_models(ledger, task_id, models):
+            if not started_only or ledger.cell(model, task_id):
+                cells.append((model, task_id))
+    return cells
+
+
+@lru_cache(maxsize=256)
+def _read(path: str) -> str:
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def cell_items(cells: Iterable[Tuple[str, str]],
+               tasks_dir: str = "./tasks",
+               answers_dir: str = "./answers") -> Iterator[Dict[str, str]]:
+    """The work items of the cells in the given order (e.g. planner.lpt_order), the files are read once."""
+    for model, task_id in cells:
+        yield {
+            "task": _read(str(Path(tasks_dir) / f"{task_id}.md")),
+            "task_id": task_id,
+            "rule": _read(str(Path(answers_dir) / f"{task_id}.md")),
+            "model": model,
+        }
+
+
+def task_generator(ledger: RunLedger,
+                   models: Sequence[str],
+                   tasks_dir: str = "./tasks",
+                   answers_dir: str = "./answers",
+                   started_only: bool = False) -> Iterator[Dict[str, str]]:
+    """
+    Lazily yield the work items of the grid in file order.
+    The models of a task follow each other, so its files are read once and shared by all of them.
+    :param started_only: only the cells which have a ledger record but are not finished (resume)
+    """
+    # ~~把两个任务都加到列表里~~
+    # 先不测试RAG的效果了，这里只对基本的任务进行测试：有好的提示词，没有RAG，有各种提示信息，语言选择英文。
+    return cell_items(pending_cells(ledger, models, tasks_dir, started_only=started_only), tasks_dir, answers_dir)
+
+
+def count_cells(ledger: RunLedger, models: Sequence[str], tasks_dir: str = "./tasks") -> int:
+    return sum(len(pending_models(ledger, task_id, models)) for task_id in list_tasks(tasks_dir))
@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : hedging.py
+
+"""
+Tail-latency control for slow LLM calls (mainly deepseek-reasoner in `Advice`).
+
+    - with a limiter, every request holds its own slot; the local wait for it (token buckets, AIMD window)
+      is neither latency nor part of the deadline, and a hedge is only sent when a slot is free at once
+    - every attempt has a deadline, the requests still running then are cancelled with `limiter.DEADLINE`
+      so their endpoint limiter sees a timeout
+    - attempts failing with a timeout, 429, 5xx or a connection error are retried with full-jitter
+      exponential backoff, any other error is raised at once
+    - if no response arrives by the observed p90 latency, a duplicate request is sent and the first
+      answer wins; the duplicates are capped by a budget (a fraction of all calls), the loser is
+      cancelled plainly and is neither a success nor a failure for the limiter
+"""
+import asyncio
+import bisect
+import random
+from typing import Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from limiter import DEADLINE, EndpointLimiter, is_overload_error
+
+T = TypeVar("T")
+
+
+class _NoSlot(Exception):
+    """The limiter had no free slot for a hedge, it was not sent."""
+
+
+def is_retryable_error(exc: BaseException) -> bool:
+    """
+    Timeouts, 429, 5xx and connection errors (openai.APIConnectionError, httpx.ConnectError, ...),
+    also when a library wrapped them (`raise ... from e`, e.g. LangExtract's InferenceRuntimeError).
+    """
+    while exc is not None:
+        if is_overload_error(exc) or isinstance(exc, ConnectionError) or "Connect" in type(exc).__name__:
+            return True
+        exc = exc.__cause__
+    return False
+
+
+class LatencyHistogram:
+    """
+    Latency histogram with fixed, roughly log-spaced buckets (seconds).
+    """
+    bounds = [0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 240, 300, 450, 600]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+        self.total += 1
+        self.sum += seconds
+
+    def quantile(self, q: float) -> Optional[float]:
+        """The upper bound of the bucket which holds the q-quantile, None when there is no data."""
+        if self.total == 0:
+            return None
+        rank = q * self.total
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.bounds[idx] if idx < len(self.bounds) else float("inf")
+        return float("inf")
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "count": self.total,
+            "mean": round(self.sum / self.total, 3) if self.total else None,
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+        }
+
+
+class HedgePolicy:
+    """
+    :param deadline: seconds allowed for one attempt (hedges included)
+    :param retries: the number of retries after the first attempt
+    :param backoff: base of the exponential backoff in seconds
+    :param max_backoff: cap of one backoff sleep
+    :param hedge: whether to send duplicate requests at all
+    :param hedge_quantile: the latency quantile which triggers the duplicate
+    :param hedge_budget: at most this fraction of calls may be hedged
+    :param min_samples: the histogram needs this many samples before hedging starts
+    """
+
+    def __init__(self,
+                 deadline: float = 600.0,
+                 retries: int = 2,
+                 backoff: float = 2.0,
+                 max_backoff: float = 60.0,
+                 hedge: bool = True,
+                 hedge_quantile: float = 0.9,
+                 hedge_budget: float = 0.1,
+                 min_samples: int = 20):
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_budget = hedge_budget
+        self.min_samples = min_samples
+
+        self.histogram = LatencyHistogram()
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.hedge_skipped = 0
+        self.retried = 0
+
+    def hedge_after(self) -> Optional[float]:
+        """Seconds to wait before the duplicate request, None means do not hedge this call."""
+        if not self.hedge or self.histogram.total < self.min_samples:
+            return None
+        if self.hedged + 1 > self.hedge_budget * max(self.calls, 1):
+            return None
+        delay = self.histogram.quantile(self.hedge_quantile)
+        if delay is None or delay >= self.deadline:
+            return None
+        return delay
+
+    def _sleep_for(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def _held(self, factory: Callable[[], Awaitable[T]], limiter: Optional[EndpointLimiter], tokens: int,
+                    sent: Optional[asyncio.Event] = None) -> T:
+        """
+        One request holding its own limiter slot. The primary (`sent` given) waits for the slot, a hedge only
+        goes out if a slot is free right now. The slot is taken inside this coroutine, a cancelled request
+        never leaks it.
+        """
+        if limiter is not None:
+            if sent is not None:
+                await limiter.acquire(tokens)
+            elif not limiter.try_acquire(tokens):
+                self.hedge_skipped += 1
+                raise _NoSlot()
+        if sent is not None:
+            sent.set()
+        else:
+            self.hedged += 1
+        try:
+            result = await factory()
+        except BaseException as e:
+            if limiter is not None:
+                await limiter.release(e)
+            raise
+        if limiter is not None:
+            await limiter.release()
+        return result
+
+    async def _attempt(self, factory: Callable[[], Awaitable[T]], limiter: Optional[EndpointLimiter], tokens: int) -> T:
+        loop = asyncio.get_running_loop()
+        sent = asyncio.Event()
+        primary = asyncio.ensure_future(self._held(factory, limiter, tokens, sent))
+        pending: List[asyncio.Future] = [primary]
+        reason = None  # 输掉的对冲请求只是被取消，超时的才算 timeout
+        try:
+            # 在本地排队等令牌桶和并发窗口的时间不是延迟：不进直方图，不算 deadline，也不触发对冲
+            queued = asyncio.ensure_future(sent.wait())
+            await asyncio.wait([primary, queued], return_when=asyncio.FIRST_COMPLETED)
+            queued.cancel()
+            started = loop.time()
+
+            delay = self.hedge_after()
+            if delay is not None:
+                done, _ = await asyncio.wait(pending, timeout=delay)
+                if not done:
+                    pending.append(asyncio.ensure_future(self._held(factory, limiter, tokens)))
+
+            while pending:
+                remaining = self.deadline - (loop.time() - started)
+                done = set()
+                if remaining > 0:
+                    done, _ = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    reason = DEADLINE
+                    raise asyncio.TimeoutError()
+                for fut in done:
+                    pending.remove(fut)
+                    if fut.exception() is None:
+                        # 哪个先回来就用哪个
+                        if fut is not primary:
+                            self.hedge_wins += 1
+                        self.histogram.observe(loop.time() - started)
+                        return fut.result()
+                # 一个失败了，还有另一个在跑就继续等；没拿到并发槽位的对冲不算失败
+                if not pending:
+                    raise primary.exception()
+            raise asyncio.TimeoutError()
+        finally:
+            for fut in pending:
+                fut.cancel(reason)
+
+    async def call(self, factory: Callable[[], Awaitable[T]],
+                   limiter: Optional[EndpointLimiter] = None, tokens: int = 1) -> T:
+        """
+        Run `factory()` under the policy.
+        :param factory: builds a fresh awaitable for every attempt / hedge
+        :param limiter: if given, every request holds one of its slots; the wait for the slot is not timed
+        :param tokens: the estimated tokens of one request, for the limiter
+        :return: the first successful result
+        :raise: the last error once the retries are used up, a non-retryable error at once
+        """
+        self.calls += 1
+        for attempt in range(self.retries + 1):
+            try:
+                return await self._attempt(factory, limiter, tokens)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempt >= self.retries or not is_retryable_error(e):
+                    raise
+                self.retried += 1
+                await asyncio.sleep(self._sleep_for(attempt))
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "hedge_skipped": self.hedge_skipped,
+            "retried": self.retried,
+            "latency": self.histogram.snapshot(),
+        }
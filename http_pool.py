@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : http_pool.py
+
+"""
+One process-wide pooled HTTP transport for every API client the pipeline creates.
+
+The judge (`AsyncOpenAI`), the agents (`init_chat_model(..., http_async_client=...)`) and LangExtract
+share the connections instead of each opening its own pool, so keep-alive connections are reused
+across cells and the TLS handshakes are paid once per upstream. HTTP/2 comes with the `httpx[http2]`
+dependency, the protocol in effect is printed when the first client is built.
+LangExtract calls the API from worker threads with the sync SDK, it gets the sync twin of the pool.
+
+Environment:
+    HTTP_MAX_CONNECTIONS     total connections, default 100
+    HTTP_MAX_KEEPALIVE       idle keep-alive connections, default 20
+    HTTP_KEEPALIVE_EXPIRY    seconds an idle connection is kept, default 30
+    HTTP_CONNECT_TIMEOUT     default 10
+    HTTP_HTTP2               "auto" (default), "1" or "0"
+"""
+import importlib.util
+import os
+import sys
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+
+def _http2_enabled(setting: str) -> bool:
+    if setting.lower() in ("0", "false", "no"):
+        return False
+    available = importlib.util.find_spec("h2") is not None
+    if setting.lower() in ("1", "true", "yes") and not available:
+        raise RuntimeError("HTTP_HTTP2=1 needs the `h2` package: pip install 'httpx[http2]'")
+    return available
+
+
+class HTTPPool:
+    def __init__(self,
+                 max_connections: int = 100,
+                 max_keepalive: int = 20,
+                 keepalive_expiry: float = 30.0,
+                 connect_timeout: float = 10.0,
+                 http2: str = "auto"):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        # the SDKs pass their own per-request timeouts, this is only the fallback
+        self.timeout = httpx.Timeout(600.0, connect=connect_timeout)
+        self.http2 = _http2_enabled(http2)
+        self._announced = False
+        self._lock = threading.Lock()
+        self._async: Optional[httpx.AsyncClient] = None
+        self._sync: Optional[httpx.Client] = None
+        self._on_close: List[Callable[[], None]] = []
+
+    @property
+    def protocol(self) -> str:
+        if self.http2:
+            return "HTTP/2"
+        return "HTTP/1.1" if importlib.util.find_spec("h2") is not None else "HTTP/1.1 (h2 not installed)"
+
+    def _announce(self) -> None:
+        # 第一次真正建连接池的时候打印一次，省得以为开了 HTTP/2 其实没开
+        if not self._announced:
+            self._announced = True
+            print(f"HTTP pool: {self.protocol}, max {self.limits.max_connections} connections", file=sys.stderr)
+
+    def async_client(self) -> httpx.AsyncClient:
+        """The shared async client, built inside the running event loop on first use."""
+        with self._lock:
+            if self._async is None or self._async.is_closed:
+                self._announce()
+                self._async = httpx.AsyncClient(limits=self.limits, timeout=self.timeout,
+                                                http2=self.http2, follow_redirects=True)
+            return self._async
+
+    def sync_client(self) -> httpx.Client:
+        with self._lock:
+            if self._sync is None or self._sync.is_closed:
+                self._announce()
+                self._sync = httpx.Client(limits=self.limits, timeout=self.timeout,
+                                          http2=self.http2, follow_redirects=True)
+            return self._sync
+
+    def on_close(self, callback: Callable[[], None]) -> None:
+        """
+        Register a callback run by `aclose()`, the SDK clients built on the pooled clients use it to
+        drop themselves, so nothing keeps using a closed client.
+        """
+        with self._lock:
+            self._on_close.append(callback)
+
+    @staticmethod
+    def _connections(client: Any) -> Dict[str, int]:
+        # httpcore keeps the pool on the transport; read it defensively, it is not a public API
+        pool = getattr(getattr(client, "_transport", None), "_pool", None)
+        conns = list(getattr(pool, "connections", []) or [])
+        return {
+            "open": len(conns),
+            "idle": sum(1 for c in conns if getattr(c, "is_idle", lambda: False)()),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "http2": self.http2,
+            "protocol": self.protocol,
+            "max_connections": self.limits.max_connections,
+            "async": self._connections(self._async),
+            "sync": self._connections(self._sync),
+        }
+
+    async def aclose(self) -> None:
+        """Close both clients at shutdown, the SDK clients built on top of them are dropped first."""
+        with self._lock:
+            async_client, sync_client = self._async, self._sync
+            self._async = self._sync = None
+            callbacks, self._on_close = self._on_close, []
+        for callback in callbacks:
+            callback()
+        if async_client is not None:
+            await async_client.aclose()
+        if sync_client is not None:
+            sync_client.close()
+
+    @classmethod
+    def from_env(cls) -> "HTTPPool":
+        return cls(
+            max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "100")),
+            max_keepalive=int(os.getenv("HTTP_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30")),
+            connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT", "10")),
+            http2=os.getenv("HTTP_HTTP2", "auto"),
+        )
+
+
+http_pool = HTTPPool.from_env()
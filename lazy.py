@@ -0,0 +1,67 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : lazy.py
+
+"""
+Class attributes which are built on first use.
+
+The API clients, the LangExtract model and the MCP pool used to be created in the class bodies,
+so importing a module needed the credentials and the config files. With `lazy_class_attr` they are
+only built when a request is actually sent.
+
+Usage:
+    class ModelBase:
+        @lazy_class_attr
+        def client():
+            from openai import AsyncOpenAI
+            return AsyncOpenAI(...)
+
+    ModelBase.client  # built here, then shared by the class and its subclasses
+"""
+import inspect
+import threading
+from typing import Any, Callable
+
+_UNSET = object()
+
+
+class lazy_class_attr:
+    def __init__(self, factory: Callable[[], Any]):
+        self.factory = factory
+        self.__doc__ = factory.__doc__
+        self._value = _UNSET
+        self._lock = threading.Lock()
+
+    def __get__(self, obj: Any, owner: type = None) -> Any:
+        if self._value is _UNSET:
+            with self._lock:
+                if self._value is _UNSET:
+                    self._value = self.factory()
+        return self._value
+
+    @property
+    def loaded(self) -> bool:
+        return self._value is not _UNSET
+
+    def reset(self) -> None:
+        """Forget the value, the next access builds it again."""
+        with self._lock:
+            self._value = _UNSET
+
+
+def is_loaded(owner: type, name: str) -> bool:
+    """Whether `owner.name` was built already, without building it."""
+    attr = inspect.getattr_static(owner, name, None)
+    return not isinstance(attr, lazy_class_attr) or attr.loaded
+
+
+def reset(owner: type, name: str) -> None:
+    """Drop the built value of `owner.name`, e.g. when the HTTP client under it was closed."""
+    attr = inspect.getattr_static(owner, name, None)
+    if isinstance(attr, lazy_class_attr):
+        attr.reset()
@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : ledger.py
+
+"""
+An append-only JSONL ledger of the model × task grid.
+
+Every finished stage of a cell is one line:
+    {"model": ..., "task_id": ..., "stage": "agent" | "format" | "score" | "extract" | "error", "ts": ..., "data": ...}
+
+On restart the ledger is replayed, completed cells are skipped and unfinished cells resume after
+their last completed stage, e.g. a cell whose agent run finished but whose scoring failed resumes at scoring.
+Auxiliary records such as "budget" (why the agent run stopped) and "samples" (the multi-sample judge
+summary, see sampling.py) are kept on the cell but do not count as stages.
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, Sequence, Tuple
+
+STAGES = ("agent", "format", "score", "extract")
+
+
+class RunLedger:
+    def __init__(self, path: str = "./ledger/ledger.jsonl", bases: Sequence[str] = ()):
+        """
+        :param path: the ledger this process appends to
+        :param bases: ledgers replayed before it but never written, e.g. the merged ledger of earlier
+            runs and the ledgers of the other workers (see sharding.py); `refresh()` reads what was
+            appended to them since
+        """
+        self.path = Path(path)
+        self.bases = [Path(base) for base in bases if Path(base).resolve() != self.path.resolve()]
+        self._lock = threading.Lock()
+        self._cells: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._offsets: Dict[Path, int] = {}
+        self._load()
+
+    def _replay(self, path: Path) -> None:
+        if not path.exists():
+            return
+        with open(path, "rb") as f:
+            f.seek(self._offsets.get(path, 0))
+            data = f.read()
+        # 只读到最后一个完整的行，没写完的那一行下次再读
+        end = data.rfind(b"\n") + 1
+        self._offsets[path] = self._offsets.get(path, 0) + end
+        for line in data[:end].decode("utf-8").splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 崩溃时最后一行可能没写完，跳过即可
+                continue
+            self._apply(record)
+
+    def _load(self) -> None:
+        for path in self.bases:
+            self._replay(path)
+        if not self.path.exists():
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # 崩溃时最后一行可能没写完，跳过即可
+                    continue
+                self._apply(record)
+
+    def refresh(self) -> None:
+        """Apply the records appended to the base ledgers since they were read."""
+        with self._lock:
+            for path in self.bases:
+                self._replay(path)
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        cell = self._cells.setdefault((record["model"], record["task_id"]), {})
+        if record["stage"] == "error":
+            cell["error"] = record["data"]
+        else:
+            cell[record["stage"]] = record["data"]
+            cell.pop("error", None)
+
+    def record(self, model: str, task_id: str, stage: str, data: Any) -> None:
+        """
+        Append one stage output, it is flushed and fsync-ed before returning.
+        :param model: model name
+        :param task_id: id of task
+        :param stage: one of STAGES or "error"
+        :param data: anything json serializable
+        """
+        record = {"model": model, "task_id": task_id, "stage": stage, "ts": time.time(), "data": data}
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._apply(record)
+
+    def cell(self, model: str, task_id: str) -> Dict[str, Any]:
+        return dict(self._cells.get((model, task_id), {}))
+
+    def cells(self) -> Iterator[Tuple[Tuple[str, str], Dict[str, Any]]]:
+        for key, cell in list(self._cells.items()):
+            yield key, dict(cell)
+
+    def is_done(self, model: str, task_id: str) -> bool:
+        return STAGES[-1] in self._cells.get((model, task_id), {})
+
+    def failed(self) -> Dict[Tuple[str, str], Any]:
+        return {key: cell["error"] for key, cell in self._cells.items() if "error" in cell}
+
+    def summary(self) -> Dict[str, int]:
+        counts = {stage: 0 for stage in STAGES}
+        for cell in self._cells.values():
+            for stage in STAGES:
+                if stage in cell:
+                    counts[stage] += 1
+        counts["error"] = len(self.failed())
+        return counts
@@ -0,0 +1,248 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : limiter.py
+
+"""
+Per-endpoint rate limiting with adaptive concurrency.
+
+Every upstream (OpenRouter for the agents, the DeepSeek gateway for the judge, LEARN_BASE_URL for
+LangExtract) gets its own `EndpointLimiter`:
+    - a token bucket for requests per minute (RPM) and one for tokens per minute (TPM)
+    - an AIMD concurrency window: +1 per window of successful calls, ×0.5 on 429 / 5xx / timeouts
+A call cancelled by its caller (e.g. the loser of a hedged pair) frees its slot without counting as a
+success or a failure; a call cancelled because a deadline ran out (`DEADLINE`) counts as a timeout.
+
+Environment (NAME is the endpoint name in upper case, e.g. DEEPSEEK):
+    LIMIT_<NAME>_RPM              requests per minute, 0 means unlimited
+    LIMIT_<NAME>_TPM              tokens per minute, 0 means unlimited
+    LIMIT_<NAME>_CONCURRENCY      initial concurrency
+    LIMIT_<NAME>_MAX_CONCURRENCY  ceiling of the concurrency window
+"""
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional
+
+
+def estimate_tokens(text: str) -> int:
+    # 粗略估计，大约 4 个字符一个 token
+    return max(1, len(text) // 4)
+
+
+# the message of `Task.cancel()` when a deadline, not the caller, stops the request
+DEADLINE = "deadline"
+
+
+def is_cancelled(exc: BaseException) -> bool:
+    """Whether the call was abandoned by its caller, which says nothing about the upstream."""
+    return isinstance(exc, asyncio.CancelledError) and exc.args != (DEADLINE,)
+
+
+def is_overload_error(exc: BaseException) -> bool:
+    """Whether the error means the upstream is overloaded (429, 5xx or a timeout)."""
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError)):
+        return True
+    if isinstance(exc, asyncio.CancelledError):
+        return exc.args == (DEADLINE,)
+    if "Timeout" in type(exc).__name__:
+        return True
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return isinstance(status, int) and (status == 429 or status >= 500)
+
+
+class TokenBucket:
+    """
+    :param per_minute: refill rate, 0 means unlimited
+    :param capacity: the burst size, default to one minute of tokens
+    """
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = capacity or per_minute
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def available(self, amount: float = 1) -> bool:
+        """Whether `amount` can be taken right now without jumping the queue of the waiting callers."""
+        if self.rate <= 0:
+            return True
+        if self._lock is not None and self._lock.locked():
+            return False
+        self._refill()
+        return self.tokens >= min(amount, self.capacity)
+
+    def take(self, amount: float = 1) -> None:
+        if self.rate > 0:
+            self.tokens -= min(amount, self.capacity)
+
+    async def acquire(self, amount: float = 1) -> None:
+        if self.rate <= 0:
+            return
+        amount = min(amount, self.capacity)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # 拿锁排队，保证先来先得
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD concurrency window.
+    :param initial: the starting window
+    :param minimum: the window never shrinks below it
+    :param maximum: the window never grows above it
+    :param decrease: multiplicative factor applied on overload
+    """
+
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 64, decrease: float = 0.5):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.decrease = decrease
+        self.in_flight = 0
+        self._cond: Optional[asyncio.Condition] = None
+
+    def _condition(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def acquire(self) -> None:
+        cond = self._condition()
+        async with cond:
+            await cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    def try_acquire(self) -> bool:
+        if self.in_flight >= int(self.limit):
+            return False
+        self.in_flight += 1
+        return True
+
+    async def release(self, ok: bool, overload: bool) -> None:
+        cond = self._condition()
+        async with cond:
+            self.in_flight -= 1
+            if overload:
+                self.limit = max(self.minimum, self.limit * self.decrease)
+            elif ok:
+                # additive increase: about +1 after a full window of successful calls
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            cond.notify_all()
+
+
+class EndpointLimiter:
+    def __init__(self,
+                 name: str,
+                 rpm: float = 0,
+                 tpm: float = 0,
+                 concurrency: int = 4,
+                 max_concurrency: int = 64):
+        self.name = name
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.window = AdaptiveConcurrency(initial=concurrency, maximum=max_concurrency)
+
+        self.calls = 0
+        self.overloads = 0
+        self.failures = 0
+        self.cancelled = 0
+
+    @classmethod
+    def from_env(cls, name: str) -> "EndpointLimiter":
+        prefix = f"LIMIT_{name.upper()}_"
+        return cls(
+            name,
+            rpm=float(os.getenv(prefix + "RPM", "0")),
+            tpm=float(os.getenv(prefix + "TPM", "0")),
+            concurrency=int(os.getenv(prefix + "CONCURRENCY", "4")),
+            max_concurrency=int(os.getenv(prefix + "MAX_CONCURRENCY", "64")),
+        )
+
+    async def acquire(self, tokens: int = 1) -> None:
+        await self.requests.acquire(1)
+        await self.tokens.acquire(tokens)
+        await self.window.acquire()
+
+    def try_acquire(self, tokens: int = 1) -> bool:
+        """
+        Take a slot only if one is free right now, for a request which is only worth sending without waiting
+        (a hedge); `release` it like any other slot.
+        """
+        if not (self.requests.available(1) and self.tokens.available(tokens)) or not self.window.try_acquire():
+            return False
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        return True
+
+    async def release(self, exc: Optional[BaseException] = None) -> None:
+        """
+        :param exc: None on success; a cancellation only frees the slot, 429 / 5xx / timeouts shrink the window
+        """
+        overload = exc is not None and is_overload_error(exc)
+        self.calls += 1
+        if overload:
+            self.overloads += 1
+        elif exc is not None and is_cancelled(exc):
+            self.cancelled += 1
+        elif exc is not None:
+            self.failures += 1
+        await self.window.release(ok=exc is None, overload=overload)
+
+    @asynccontextmanager
+    async def slot(self, tokens: int = 1) -> AsyncIterator[None]:
+        """
+        Hold one request slot of the endpoint.
+        :param tokens: the estimated prompt + completion tokens of the request
+        """
+        await self.acquire(tokens)
+        try:
+            yield
+        except BaseException as e:
+            await self.release(e)
+            raise
+        await self.release()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "concurrency": round(self.window.limit, 2),
+            "in_flight": self.window.in_flight,
+            "calls": self.calls,
+            "overloads": self.overloads,
+            "failures": self.failures,
+            "cancelled": self.cancelled,
+        }
+
+
+_limiters: Dict[str, EndpointLimiter] = {}
+
+
+def get_limiter(name: str) -> EndpointLimiter:
+    """The process-wide limiter of an endpoint, configured from the environment on first use."""
+    if name not in _limiters:
+        _limiters[name] = EndpointLimiter.from_env(name)
+    return _limiters[name]
+
+
+def all_stats() -> Dict[str, Dict[str, float]]:
+    return {name: limiter.stats() for name, limiter in _limiters.items()}
@@ -0,0 +1,149 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : llm_cache.py
+
+"""
+A content-addressed, on-disk cache for the judge and extraction LLM calls.
+
+The key is the sha256 of (model name + messages + sampling params), so a re-run with byte-identical
+inputs is served from disk. The store is SQLite with LRU eviction once it is larger than max_bytes.
+
+Environment:
+    LLM_CACHE_PATH    where the sqlite file lives (default: ./.cache/llm_cache.sqlite)
+    LLM_CACHE_MAX_MB  size cap of the stored responses (default: 512)
+    LLM_CACHE_BYPASS  set to 1 to skip lookups (fresh responses still refresh the cache)
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+
+class ResponseCache:
+    def __init__(self,
+                 path: str = "./.cache/llm_cache.sqlite",
+                 max_bytes: int = 512 * 1024 * 1024,
+                 bypass: bool = False):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.bypass = bypass
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._conn: Optional[sqlite3.Connection] = None
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "ResponseCache":
+        return cls(
+            path=os.getenv("LLM_CACHE_PATH", "./.cache/llm_cache.sqlite"),
+            max_bytes=int(float(os.getenv("LLM_CACHE_MAX_MB", "512")) * 1024 * 1024),
+            bypass=os.getenv("LLM_CACHE_BYPASS", "0").lower() in ("1", "true", "yes"),
+        )
+
+    @staticmethod
+    def make_key(model: str, messages: Any, **params: Any) -> str:
+        """
+        Hash the request content.
+        :param model: model name
+        :param messages: anything json serializable which describes the prompt
+        :param params: sampling params (temperature, response_format, ...)
+        :return: the hex digest
+        """
+        payload = json.dumps(
+            {"model": model, "messages": messages, "params": params},
+            ensure_ascii=False, sort_keys=True, default=str,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _connect(self) -> sqlite3.Connection:
+        # 第一次用到的时候才打开数据库
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " last_access REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON responses(last_access)")
+            self._total_bytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> Optional[str]:
+        if self.bypass:
+            self.misses += 1
+            return None
+        with self._lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        self.hits += 1
+        return row[0]
+
+    def set(self, key: str, value: str) -> None:
+        size = len(value.encode("utf-8"))
+        with self._lock:
+            conn = self._connect()
+            old = conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time()),
+            )
+            self._total_bytes += size - (old[0] if old else 0)
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        while self._total_bytes > self.max_bytes:
+            rows = conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access ASC LIMIT 64"
+            ).fetchall()
+            if not rows:
+                self._total_bytes = 0
+                break
+            for key, size in rows:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._total_bytes -= size
+                self.evictions += 1
+                if self._total_bytes <= self.max_bytes:
+                    break
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "evictions": self.evictions,
+            "bytes": self._total_bytes,
+            "bypass": self.bypass,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# 进程内共享一个缓存实例
+response_cache = ResponseCache.from_env()
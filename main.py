@@ -1,18 +1,160 @@
 import asyncio
+import os
+import time
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime
-from typing import List, Iterable, Awaitable, Any
+from typing import Any, Dict, Iterable, Iterator, Optional
 
+from langchain_core.messages import messages_from_dict, messages_to_dict
+
+import grid
+from ledger import RunLedger
 from models import model_list
 from run_client import RunClient
-from adjust_score import ScoreModel
+from adjust_score import Advice, ScoreModel
 from extract_info import ScoreExtract
-from utils import resort_ai_msg
+from http_pool import http_pool
+from limiter import all_stats as limiter_stats
+from llm_cache import response_cache
+from pipeline import Pipeline, Stage
+from planner import Planner, lpt_order
+from sampling import SequentialSampler
+from tool_cache import tool_cache
+from tracing import LoopWatchdog, tracer
+from usage import usage_meter
+from utils import ResortBuilder, TranscriptCompactor, TranscriptWriter, read_transcript
 
 
 se = ScoreExtract()
+# RUN_LEDGER_BASES: ledgers replayed before our own, set by cli.py for the shard / queue workers
+ledger = RunLedger(os.getenv("RUN_LEDGER_PATH", "./ledger/ledger.jsonl"),
+                   bases=[path for path in os.getenv("RUN_LEDGER_BASES", "").split(os.pathsep) if path])
+# the processer is sent to the judge three times, keep it inside a token budget
+compactor = TranscriptCompactor(
+    token_budget=int(os.getenv("JUDGE_TOKEN_BUDGET", "24000")),
+    max_tool_tokens=int(os.getenv("TOOL_OUTPUT_TOKENS", "1500")),
+) if os.getenv("COMPACT_TRANSCRIPT", "1").lower() in ("1", "true", "yes") else None
+
+# every agent message is appended to transcripts/{cell_stem}.jsonl as it arrives, "" keeps them in memory
+transcript_dir = os.getenv("TRANSCRIPT_DIR", "./transcripts")
+
+# JUDGE_SAMPLES_MAX > 1 judges every cell several times, stopping early once the FinalScore is stable
+sampler = SequentialSampler.from_env()
+
+# JUDGE_OUTPUT=json: the judge answers with JSON (response_format) and the extraction needs no LLM call
+judge_output = os.getenv("JUDGE_OUTPUT", "text")
+
+@contextmanager
+def _stage_guard(item: Dict[str, Any], stage: str):
+    # 失败的阶段记到 ledger 里，重跑的时候从这里继续
+    try:
+        yield
+    except Exception as e:
+        ledger.record(item["model"], item["task_id"], "error", {"stage": stage, "error": repr(e)})
+        raise
+
+
+def _cell(item: Dict[str, Any]) -> Dict[str, Any]:
+    if "cell" not in item:
+        item["cell"] = ledger.cell(item["model"], item["task_id"])
+    return item["cell"]
+
+
+async def stage_agent(item: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Run the agent and format its messages into processer and result.
+    """
+    item.setdefault("started", time.time())
+    cell = _cell(item)
+    model, task_id = item["model"], item["task_id"]
+    # 让它先去跑工作流（已经跑过的阶段直接从 ledger 里恢复）
+    if "format" in cell:
+        return item
+    # huge tool outputs are cut on arrival, the compactor trims them further afterwards
+    builder = ResortBuilder(max_entry_tokens=compactor.max_tool_tokens * 4 if compactor is not None else None)
+    with _stage_guard(item, "agent"):
+        if "agent" in cell:
+            # 新的 ledger 里记的是 transcript 文件，旧的是整个 message 列表
+            agent = cell["agent"]
+            for message in (read_transcript(agent["transcript"]) if isinstance(agent, dict)
+                            else messages_from_dict(agent)):
+                builder.add(message)
+        else:
+            client = RunClient(model)
+            if transcript_dir:
+                # 边跑边写盘：进度可以实时看，中途挂掉也留下部分 transcript
+                path = Path(transcript_dir) / f"{grid.cell_stem(model, task_id)}.jsonl"
+                with TranscriptWriter(path) as writer:
+                    def sink(message):
+                        writer.write(message)
+                        builder.add(message)
+
+                    await client.run(item["task"], sink=sink)
+                agent = {"transcript": str(path), "messages": writer.count}
+            else:
+                ai_result = await client.run(item["task"])
+                for message in ai_result:
+                    builder.add(message)
+                agent = messages_to_dict(ai_result)
+            # 预算用完被停下的 run 也照样评分，只是带上停止的原因
+            cell["budget"] = {"stop_reason": client.stop_reason}
+            ledger.record(model, task_id, "budget", cell["budget"])
+            ledger.record(model, task_id, "agent", agent)
+    stop_reason = cell.get("budget", {}).get("stop_reason")
+    with _stage_guard(item, "format"), tracer.span("resort_ai_msg", model=model, task_id=task_id) as sp:
+        cell["format"] = builder.finish(compactor, stop_reason)
+        if compactor is not None:
+            sp.set(**compactor.stats)
+        ledger.record(model, task_id, "format", cell["format"])
+    return item
+
+
+async def stage_score(item: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Judge the processer and result of the agent.
+    """
+    cell = _cell(item)
+    model, task_id = item["model"], item["task_id"]
+    # 然后提取过程和结果进行评分
+    if "score" in cell:
+        return item
+    with _stage_guard(item, "score"):
+        sm = ScoreModel(
+            task=item["task"], task_id=task_id, rule=item["rule"],
+            processer=cell["format"]["processer"], results=cell["format"]["result"]
+        )
+        score_it = sm.score_it_json if judge_output == "json" else sm.score_it
+        if sampler.enabled:
+            with tracer.span("judge.samples", model=model, task_id=task_id) as sp:
+                sampled = await sampler.run(score_it)
+                sp.set(**{k: sampled[k] for k in ("n", "valid", "failed", "mean", "var", "ci_width", "stop")})
+            ledger.record(model, task_id, "samples", {k: v for k, v in sampled.items() if k != "score"})
+            score_str: str = sampled["score"]
+        else:
+            score_str: str = await score_it()
+        score_str += f"\nModel name: {model}\nTask time: {str(datetime.now())}"
+        cell["score"] = score_str
+        ledger.record(model, task_id, "score", score_str)
+    return item
+
+
+async def stage_extract(item: Dict[str, Any]) -> None:
+    """
+    Extract the structured scores and save them to outputs/.
+    """
+    cell = _cell(item)
+    model, task_id = item["model"], item["task_id"]
+    # 结构化数据提取
+    # 服啦，好麻烦啊，我还要给这个函数写示例的prompt和信息提取的结构啥的这些东西，真烦，烦，烦！
+    with _stage_guard(item, "extract"):
+        await se.run(cell["score"], task_id, model)
+        ledger.record(model, task_id, "extract", f"outputs/{grid.cell_stem(model, task_id)}.jsonl")
+    # 整个 cell 的耗时，bench 用它算 p50 / p99
+    tracer.emit({"type": "cell", "model": model, "task_id": task_id,
+                 "start": item["started"], "duration": round(time.time() - item["started"], 6)})
+    print(f"===== {model} works {task_id} run over =====")
 
-task_names: List[str] = [p.stem for p in Path("./tasks").iterdir() if p.is_file()]
 
 async def run_term(task: str,
                    task_id: str,
@@ -20,7 +162,7 @@ async def run_term(task: str,
                    is_RAG: bool,  # at present, this is useless
                    model: str) -> None:
     """
-    the one term runner
+    the one term runner, it runs all the stages of one cell in sequence
     :param task: the content of task
     :param task_id: id of task
     :param rule: the reference answer
@@ -28,58 +170,93 @@ async def run_term(task: str,
     :param model: model name
     :return: None
     """
-    # 让它先去跑工作流
-    client = RunClient(model)
-    ai_result = await client.run(task)
-    format_ai_result = resort_ai_msg(ai_result)
-    processer: str = format_ai_result["processer"]
-    result: str = format_ai_result["result"]
-    # 然后提取过程和结果进行评分
-    sm = ScoreModel(
-        task=task, task_id=task_id, rule=rule, processer=processer, results=result
-    )
-    score_str: str = sm.score_it()
-    score_str += f"\nModel name: {model}\nTask time: {str(datetime.now())}"
-    # 结构化数据提取
-    # 服啦，好麻烦啊，我还要给这个函数写示例的prompt和信息提取的结构啥的这些东西，真烦，烦，烦！
-    se.run(score_str, task_id, model)
-    print(f"===== {model} works {task_id} run over =====")
-
-
-def task_generator():
-    tasks = []
-    for model in model_list:
-        for task_id in task_names:
-            # for fix error caused by file `.DS_Store` from macOS
-            if task_id == ".DS_Store":
-                continue
-            with open(f"./tasks/{task_id}.md", encoding="utf-8") as f:
-                task_content = f.read()
-            with open(f"./answers/{task_id}.md", encoding="utf-8") as f:
-                reference_answer = f.read()
+    item = {"task": task, "task_id": task_id, "rule": rule, "model": model}
+    for stage in (stage_agent, stage_score, stage_extract):
+        item = await stage(item)
 
-            # ~~把两个任务都加到列表里~~
-            # 先不测试RAG的效果了，这里只对基本的任务进行测试：有好的提示词，没有RAG，有各种提示信息，语言选择英文。
-            tasks.append(run_term(task_content, task_id, reference_answer, is_RAG=False, model=model))  # without RAG
-    return tasks
 
+def task_generator(started_only: bool = False, order: Optional[str] = None) -> Iterator[Dict[str, str]]:
+    """
+    The pending cells of `model_list` × ./tasks, see grid.task_generator.
+    :param order: "file" (default, $RUN_ORDER) streams the cells in file order, the first cell starts at once;
+        "lpt" starts the longest cells first (estimated from the trace history, see planner.py), which has
+        to read every task and answer file and the whole trace before the first cell can start
+    """
+    if (order or os.getenv("RUN_ORDER", "file")) != "lpt":
+        return grid.task_generator(ledger, model_list, started_only=started_only)
+    planner = Planner.from_env()
+    planner.load_trace(os.getenv("TRACE_PATH", "./traces/trace.jsonl"))
+    cells = lpt_order(planner.plan(ledger, model_list, started_only=started_only))
+    return grid.cell_items((cell["model"], cell["task_id"]) for cell in cells)
 
-async def _run_with_limit(coros: Iterable[Awaitable[Any]], max_concurrency: int = 10,
-                          return_exceptions: bool = True) -> List[Any]:
-    sem = asyncio.Semaphore(max_concurrency)
 
-    async def _guard(coro: Awaitable[Any]):
-        async with sem:
-            return await coro
+def count_cells() -> int:
+    return grid.count_cells(ledger, model_list)
 
-    return await asyncio.gather(*(_guard(c) for c in coros), return_exceptions=return_exceptions)
 
-async def main(tasks: Iterable[Awaitable[Any]], max_concurrency: int = 10) -> List[Any]:
-    return await _run_with_limit(tasks, max_concurrency=max_concurrency)
+async def main(items: Iterable[Dict[str, str]],
+               agent_workers: int = 5,
+               judge_workers: int = 16,
+               extract_workers: int = 4,
+               report_interval: float = 0,
+               judge_schedule: str = "task") -> Dict[str, Dict[str, int]]:
+    """
+    Run the grid as a pipeline: agent runs, judging and extraction each have their own worker pool,
+    connected by bounded queues.
+    :param judge_schedule: "task" judges the queued transcripts of the same task_id back-to-back,
+        so the shared rule/instruction prefix hits the provider cache; "fifo" keeps arrival order
+    """
+    if judge_schedule == "task":
+        # a deeper queue gives more chance to gather the same task together
+        judge = Stage("judge", stage_score, workers=judge_workers, queue_size=judge_workers * 4,
+                      group_by=lambda item: item["task_id"])
+    else:
+        judge = Stage("judge", stage_score, workers=judge_workers)
+    pipeline = Pipeline([
+        Stage("agent", stage_agent, workers=agent_workers),
+        judge,
+        Stage("extract", stage_extract, workers=extract_workers),
+    ], report_interval=report_interval)
+    ScoreExtract.set_workers(extract_workers)
+    watchdog = LoopWatchdog(tracer, threshold=float(os.getenv("LOOP_STALL_THRESHOLD", "0.5")))
+    watchdog.start()
+    try:
+        return await pipeline.run(items)
+    finally:
+        watchdog.stop()
+        tracer.close()
+        print(f"Event loop stalls: {tracer.metrics.stalls} (max {tracer.metrics.stall_max:.2f}s)")
+        print(f"Pipeline: {pipeline.stats()}")
+        print(f"MCP pool: {RunClient.pool_stats()}")
+        print(f"MCP tool cache: {tool_cache.stats()}")
+        print(f"Agent stop reasons: {dict(RunClient.stop_reasons)}")
+        print(f"HTTP pool: {http_pool.stats()}")
+        print(f"LLM cache: {response_cache.stats()}")
+        print(f"Limiters: {limiter_stats()}")
+        print(f"Advice latency: {Advice.policy.stats()}")
+        print(f"Judge token usage: {usage_meter.stats()}")
+        if sampler.enabled:
+            print(f"Judge samples: {sampler.stats()}")
+        print(f"Score parser ({judge_output} judge output): {ScoreExtract.parse_stats.stats()}")
+        print(f"LLM extraction batches: {ScoreExtract.batch_stats()}")
+        print(f"Ledger: {ledger.summary()}")
+        for (model, task_id), error in ledger.failed().items():
+            print(f"[FAILED] {model} {task_id} at {error['stage']}: {error['error']}")
+        await RunClient.close()
+        ScoreExtract.close()
+        await http_pool.aclose()
 
 
 if __name__ == "__main__":
-    tasks = task_generator()
-    print(f"Total tasks: {len(tasks)}")
-    results = asyncio.run(main(tasks, max_concurrency=5))
+    print(f"Total tasks: {count_cells()}")
+    # the per-endpoint limiters do the throttling, these are only the number of items in flight per stage
+    results = asyncio.run(main(
+        task_generator(),
+        agent_workers=int(os.getenv("AGENT_WORKERS", "5")),
+        judge_workers=int(os.getenv("JUDGE_WORKERS", "16")),
+        extract_workers=int(os.getenv("EXTRACT_WORKERS", "4")),
+        report_interval=float(os.getenv("PIPELINE_REPORT_INTERVAL", "30")),
+        judge_schedule=os.getenv("JUDGE_SCHEDULE", "task"),
+    ))
+    print(f"Results: {results}")
     print("All of the tasks is OK!")
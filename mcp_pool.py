@@ -0,0 +1,196 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : mcp_pool.py
+
+"""
+A process-wide pool of warm MCP sessions.
+
+`MultiServerMCPClient.get_tools()` opens a brand-new session (and for stdio servers, a brand-new
+server process) every time it is called. Here every pooled slot keeps one long-lived session per
+configured server, loads the tool list once, and is leased to one agent run at a time.
+
+A waiting lease wakes up when a slot is returned and also when a place frees up (a failed spawn or a
+discarded unhealthy slot), then spawns itself; a failing server gives every waiter its error instead
+of leaving them waiting for a slot which never comes back.
+"""
+import asyncio
+from collections import deque
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional
+
+from langchain_core.tools import BaseTool
+from langchain_mcp_adapters.client import MultiServerMCPClient
+from langchain_mcp_adapters.tools import load_mcp_tools
+
+
+class _PooledSession:
+    """
+    One warm set of MCP sessions (one per server) with its tools.
+
+    The sessions are opened and closed inside a dedicated task, because the stdio transport uses
+    anyio cancel scopes which must be exited by the same task that entered them.
+    """
+
+    def __init__(self, client: MultiServerMCPClient, server_names: List[str]):
+        self.client = client
+        self.server_names = server_names
+        self.sessions: Dict[str, Any] = {}
+        self.tools: List[BaseTool] = []
+        self._ready = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._error: Optional[BaseException] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> "_PooledSession":
+        self._task = asyncio.create_task(self._serve())
+        await self._ready.wait()
+        if self._error is not None:
+            raise self._error
+        return self
+
+    async def _serve(self) -> None:
+        try:
+            async with AsyncExitStack() as stack:
+                for name in self.server_names:
+                    session = await stack.enter_async_context(self.client.session(name))
+                    self.sessions[name] = session
+                    self.tools.extend(await load_mcp_tools(session))
+                self._ready.set()
+                await self._closing.wait()
+        except Exception as e:
+            self._error = e
+            self._ready.set()
+
+    async def healthy(self, timeout: float) -> bool:
+        if self._task is None or self._task.done():
+            return False
+        try:
+            for session in self.sessions.values():
+                await asyncio.wait_for(session.send_ping(), timeout=timeout)
+        except Exception:
+            return False
+        return True
+
+    async def close(self) -> None:
+        self._closing.set()
+        if self._task is not None:
+            try:
+                await self._task
+            except Exception:
+                pass
+
+
+class MCPSessionPool:
+    """
+    Lease/return pool of warm MCP sessions.
+
+    Usage:
+        async with pool.lease() as tools:
+            agent = create_react_agent(model=llm, tools=tools, ...)
+
+    :param connections: the `mcpServers` part of servers_config.json
+    :param size: the max number of warm slots (each slot = one process per stdio server)
+    :param health_check_timeout: seconds to wait for a ping before the slot is replaced
+    """
+
+    def __init__(self,
+                 connections: Dict[str, Any],
+                 size: int = 5,
+                 health_check_timeout: float = 5.0):
+        self.client = MultiServerMCPClient(connections)
+        self.server_names = list(connections)
+        self.size = max(1, size)
+        self.health_check_timeout = health_check_timeout
+
+        self._idle: Deque[_PooledSession] = deque()
+        self._slots: List[_PooledSession] = []
+        self._cond: Optional[asyncio.Condition] = None
+
+        self.spawned = 0
+        self.replaced = 0
+
+    def _condition(self) -> asyncio.Condition:
+        # create the asyncio primitives lazily, inside the running loop
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def _notify(self) -> None:
+        cond = self._condition()
+        async with cond:
+            cond.notify_all()
+
+    async def _spawn(self) -> _PooledSession:
+        slot = await _PooledSession(self.client, self.server_names).start()
+        self.spawned += 1
+        return slot
+
+    async def _discard(self, slot: _PooledSession) -> None:
+        if slot in self._slots:
+            self._slots.remove(slot)
+        # 空出了一个位置，等着的 lease 可以自己去起一个新的
+        await self._notify()
+        await slot.close()
+
+    async def _acquire(self) -> _PooledSession:
+        cond = self._condition()
+        while True:
+            async with cond:
+                await cond.wait_for(lambda: self._idle or len(self._slots) < self.size)
+                if self._idle:
+                    slot, placeholder = self._idle.popleft(), None
+                else:
+                    # reserve the place before the (slow) spawn so the pool never grows past size
+                    placeholder = _PooledSession(self.client, self.server_names)
+                    self._slots.append(placeholder)
+
+            if placeholder is not None:
+                try:
+                    slot = await self._spawn()
+                except BaseException:
+                    self._slots.remove(placeholder)
+                    await self._notify()
+                    raise
+                self._slots[self._slots.index(placeholder)] = slot
+                return slot
+
+            if await slot.healthy(self.health_check_timeout):
+                return slot
+            # 服务挂掉了，换一个新的
+            self.replaced += 1
+            await self._discard(slot)
+
+    async def _release(self, slot: _PooledSession) -> None:
+        if slot in self._slots:
+            cond = self._condition()
+            async with cond:
+                self._idle.append(slot)
+                cond.notify()
+
+    @asynccontextmanager
+    async def lease(self) -> AsyncIterator[List[BaseTool]]:
+        slot = await self._acquire()
+        try:
+            yield slot.tools
+        finally:
+            await self._release(slot)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": self.size,
+            "alive": len(self._slots),
+            "idle": len(self._idle),
+            "spawned": self.spawned,
+            "replaced": self.replaced,
+        }
+
+    async def close(self) -> None:
+        slots, self._slots = self._slots, []
+        await asyncio.gather(*(slot.close() for slot in slots), return_exceptions=True)
+        self._idle.clear()
+        self._cond = None
@@ -1,15 +1,23 @@
 import os
+from functools import lru_cache
 from typing import List
 
 from dotenv import load_dotenv
-from openai import OpenAI
 
 load_dotenv()
 
-client = OpenAI(
-    base_url=os.getenv("OPENROUTER_BASE_URL"),
-    api_key=os.getenv("OPENROUTER_API_KEY")
-)
+
+@lru_cache(maxsize=1)
+def get_client():
+    from openai import OpenAI
+    from http_pool import http_pool
+
+    http_pool.on_close(get_client.cache_clear)
+    return OpenAI(
+        base_url=os.getenv("OPENROUTER_BASE_URL"),
+        api_key=os.getenv("OPENROUTER_API_KEY"),
+        http_client=http_pool.sync_client(),
+    )
 
 model_list: List[str] = ["THE MODELS YOU WANT TO USE"]
 
@@ -19,7 +27,7 @@ def test_api():
     """
     free_model = "deepseek/deepseek-chat-v3.1:free"
 
-    response = client.chat.completions.create(
+    response = get_client().chat.completions.create(
         model=free_model,
         messages=[
             {"role": "system", "content": "You are a helpful assistant."},
@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : pipeline.py
+
+"""
+A stage-pipelined executor.
+
+Each stage has its own worker pool and a bounded input queue, so a slow stage applies backpressure
+to the one before it while the stages themselves overlap (agents keep running while the judge works).
+
+    pipeline = Pipeline([
+        Stage("agent", stage_agent, workers=5),
+        Stage("judge", stage_score, workers=16),
+        Stage("extract", stage_extract, workers=4),
+    ])
+    counts = await pipeline.run(items)
+
+A handler takes an item and returns the item for the next stage, or None to drop it (e.g. done).
+"""
+import asyncio
+from collections import OrderedDict, deque
+from typing import Any, AsyncIterable, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Union
+
+_DONE = object()
+
+
+class _Groups:
+    """Deque-like storage for GroupedQueue: groups in arrival order, items FIFO inside a group."""
+
+    def __init__(self, key: Callable[[Any], Hashable]):
+        self.key = key
+        self.groups: "OrderedDict[Hashable, deque]" = OrderedDict()
+        self.last: Optional[Hashable] = None
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def append(self, item: Any) -> None:
+        group = item if item is _DONE else self.key(item)
+        self.groups.setdefault(group, deque()).append(item)
+        self.size += 1
+
+    def popleft(self) -> Any:
+        # 优先继续处理上一次的分组，没有了再按到达顺序取下一组
+        group = self.last if self.last in self.groups else next(iter(self.groups))
+        items = self.groups[group]
+        item = items.popleft()
+        if not items:
+            del self.groups[group]
+        self.last = group
+        self.size -= 1
+        return item
+
+
+class GroupedQueue(asyncio.Queue):
+    """
+    An asyncio.Queue which hands out the items of one group back-to-back,
+    e.g. every model's transcript of the same task_id so the judge prompt prefix stays warm.
+    """
+
+    def __init__(self, maxsize: int = 0, key: Callable[[Any], Hashable] = None):
+        self._key = key
+        super().__init__(maxsize)
+
+    def _init(self, maxsize: int) -> None:
+        self._queue = _Groups(self._key)
+
+
+class Stage:
+    """
+    :param name: name used in the stats
+    :param handler: async callable item -> item | None
+    :param workers: the size of the worker pool
+    :param queue_size: capacity of the input queue, default to 2 × workers
+    :param group_by: if given, the input queue is a GroupedQueue on this key
+    """
+
+    def __init__(self,
+                 name: str,
+                 handler: Callable[[Any], Awaitable[Optional[Any]]],
+                 workers: int = 1,
+                 queue_size: Optional[int] = None,
+                 group_by: Optional[Callable[[Any], Hashable]] = None):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue_size = queue_size or self.workers * 2
+        self.group_by = group_by
+
+        self.queue: Optional[asyncio.Queue] = None
+        self.processed = 0
+        self.failed = 0
+        self.busy = 0
+        self.max_depth = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "depth": self.queue.qsize() if self.queue is not None else 0,
+            "max_depth": self.max_depth,
+            "busy": self.busy,
+            "workers": self.workers,
+            "processed": self.processed,
+            "failed": self.failed,
+        }
+
+
+class Pipeline:
+    def __init__(self, stages: List[Stage], report_interval: float = 0):
+        self.stages = stages
+        self.report_interval = report_interval
+
+    async def _put(self, stage: Stage, item: Any) -> None:
+        await stage.queue.put(item)
+        stage.max_depth = max(stage.max_depth, stage.queue.qsize())
+
+    async def _worker(self, idx: int) -> None:
+        stage = self.stages[idx]
+        nxt = self.stages[idx + 1] if idx + 1 < len(self.stages) else None
+        while True:
+            item = await stage.queue.get()
+            if item is _DONE:
+                return
+            stage.busy += 1
+            try:
+                out = await stage.handler(item)
+            except Exception as e:
+                # 失败的条目在 handler 里已经记录，这里只计数，不影响其他条目
+                stage.failed += 1
+                print(f"[{stage.name}] failed: {e!r}")
+                continue
+            finally:
+                stage.busy -= 1
+            stage.processed += 1
+            if out is not None and nxt is not None:
+                await self._put(nxt, out)
+
+    async def _run_stage(self, idx: int) -> None:
+        stage = self.stages[idx]
+        await asyncio.gather(*(self._worker(idx) for _ in range(stage.workers)))
+        # 这一层的 worker 都退出了，通知下一层
+        if idx + 1 < len(self.stages):
+            nxt = self.stages[idx + 1]
+            for _ in range(nxt.workers):
+                await nxt.queue.put(_DONE)
+
+    async def _produce(self, items: Union[Iterable[Any], AsyncIterable[Any]]) -> None:
+        first = self.stages[0]
+        if hasattr(items, "__aiter__"):
+            # e.g. the items of a work queue, which are claimed off the event loop
+            async for item in items:
+                await self._put(first, item)
+        else:
+            for item in items:
+                await self._put(first, item)
+        for _ in range(first.workers):
+            await first.queue.put(_DONE)
+
+    async def _report(self) -> None:
+        while True:
+            await asyncio.sleep(self.report_interval)
+            print(f"Pipeline: {self.stats()}")
+
+    async def run(self, items: Union[Iterable[Any], AsyncIterable[Any]]) -> Dict[str, Dict[str, int]]:
+        for stage in self.stages:
+            if stage.group_by is not None:
+                stage.queue = GroupedQueue(maxsize=stage.queue_size, key=stage.group_by)
+            else:
+                stage.queue = asyncio.Queue(maxsize=stage.queue_size)
+
+        tasks = [asyncio.create_task(self._produce(items))]
+        tasks += [asyncio.create_task(self._run_stage(i)) for i in range(len(self.stages))]
+        reporter = asyncio.create_task(self._report()) if self.report_interval > 0 else None
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for t in tasks:
+                t.cancel()
+            if reporter is not None:
+                reporter.cancel()
+        return self.stats()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {stage.name: stage.stats() for stage in self.stages}
@@ -0,0 +1,221 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : planner.py
+
+"""
+Estimate the pending grid before it runs, and order it longest first.
+
+Every pending cell gets an estimate of its tokens, cost and wall-clock time:
+    - the size of a cell is the tokens of the agent system prompt + task + reference answer
+    - with history (the `cell`, `agent.run`, `agent.llm` and `judge.request` records of the trace file),
+      a model's seconds, tokens and cost per cell are scaled by the size of the cell relative to the
+      cells the model ran before; a model without history uses the history of all the models
+    - without any history, PLAN_DEFAULT_SECONDS and PLAN_AGENT_STEPS give a rough guess
+A cell which resumes after the agent stage only pays for the judge.
+
+`makespan()` simulates the agent workers taking the cells in a given order. `lpt_order()` sorts the
+cells longest first (LPT), so long tasks and slow models start early instead of stretching the tail.
+`run --order lpt` (RUN_ORDER=lpt) uses it; the default file order streams the grid instead, compare
+the two with the makespans of `plan`.
+
+Environment:
+    PLAN_DEFAULT_SECONDS   seconds per cell of an average size when there is no history, default 300
+    PLAN_AGENT_STEPS       times the agent context is sent when there is no history, default 8
+"""
+import heapq
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import grid
+from ledger import RunLedger
+from limiter import estimate_tokens
+from tracing import estimate_cost
+
+_POOLED = "*"  # the history of all the models together
+
+
+def _new_history() -> Dict[str, float]:
+    return {"cells": 0, "size": 0, "seconds": 0.0, "agent_runs": 0, "agent_seconds": 0.0,
+            "tokens": 0, "cost": 0.0}
+
+
+class Planner:
+    def __init__(self,
+                 tasks_dir: str = "./tasks",
+                 answers_dir: str = "./answers",
+                 default_seconds: float = 300.0,
+                 agent_steps: int = 8):
+        """
+        :param default_seconds: seconds of a cell of the average size when there is no history at all
+        :param agent_steps: without history, the agent tokens are this many times the cell size
+        """
+        self.tasks_dir = tasks_dir
+        self.answers_dir = answers_dir
+        self.default_seconds = default_seconds
+        self.agent_steps = agent_steps
+        from prompts import system_prompt
+
+        self.system_tokens = estimate_tokens(system_prompt)
+        self._sizes: Dict[str, Optional[int]] = {}
+        self.history: Dict[str, Dict[str, float]] = {}
+        self.judge = {"cells": 0, "tokens": 0, "cost": 0.0}
+
+    @classmethod
+    def from_env(cls, tasks_dir: str = "./tasks", answers_dir: str = "./answers") -> "Planner":
+        return cls(
+            tasks_dir=tasks_dir,
+            answers_dir=answers_dir,
+            default_seconds=float(os.getenv("PLAN_DEFAULT_SECONDS", "300")),
+            agent_steps=int(os.getenv("PLAN_AGENT_STEPS", "8")),
+        )
+
+    def size(self, task_id: str) -> Optional[int]:
+        """The tokens the agent starts with: system prompt + task + reference answer, None if the task is gone."""
+        if task_id not in self._sizes:
+            try:
+                text = (Path(self.tasks_dir) / f"{task_id}.md").read_text(encoding="utf-8")
+                text += (Path(self.answers_dir) / f"{task_id}.md").read_text(encoding="utf-8")
+            except OSError:
+                self._sizes[task_id] = None
+            else:
+                self._sizes[task_id] = self.system_tokens + estimate_tokens(text)
+        return self._sizes[task_id]
+
+    def _add(self, model: str, **values: float) -> None:
+        for key in (model, _POOLED):
+            history = self.history.setdefault(key, _new_history())
+            for name, value in values.items():
+                history[name] += value
+
+    def load_trace(self, path: Optional[str]) -> int:
+        """
+        Learn the per-model history from a trace file (see tracing.py), it is streamed, not kept.
+        :return: the number of finished cells found
+        """
+        if not path or not os.path.exists(path):
+            return 0
+        cells = 0
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                kind, name, model = record.get("type"), record.get("name"), record.get("model")
+                if kind == "cell":
+                    size = self.size(record["task_id"])
+                    if size is None:
+                        continue
+                    self._add(model, cells=1, size=size, seconds=record["duration"])
+                    self.judge["cells"] += 1
+                    cells += 1
+                elif kind != "span" or "error" in record:
+                    continue
+                elif name == "agent.run":
+                    self._add(model, agent_runs=1, agent_seconds=record["duration"])
+                elif name == "agent.llm":
+                    self._add(model, tokens=record.get("prompt_tokens", 0) + record.get("completion_tokens", 0),
+                              cost=record.get("cost_usd", 0.0))
+                elif name == "judge.request":
+                    self.judge["tokens"] += record.get("prompt_tokens", 0) + record.get("completion_tokens", 0)
+                    self.judge["cost"] += record.get("cost_usd", 0.0)
+        return cells
+
+    def _judge_default(self, size: int) -> Tuple[float, float]:
+        # 两次建议 + 一次打分，每次都带着任务、参考答案和（压缩后的）过程
+        processer = int(os.getenv("JUDGE_TOKEN_BUDGET", "24000")) // 2
+        prompt = 3 * (size - self.system_tokens + processer)
+        completion = 3 * 1000
+        cost = (estimate_cost("deepseek-reasoner", prompt * 2 // 3, 0, completion * 2 // 3)
+                + estimate_cost("deepseek-chat", prompt // 3, 0, completion // 3))
+        return prompt + completion, cost
+
+    def estimate(self, model: str, task_id: str, stage: Optional[str] = "agent") -> Dict[str, Any]:
+        """
+        :param stage: the stage the cell resumes at (grid.next_stage)
+        :return: {"seconds", "agent_tokens", "judge_tokens", "cost", "source"}
+        """
+        size = self.size(task_id) or self.system_tokens
+        history = self.history.get(model)
+        source = "model"
+        if not history or not history["cells"]:
+            history, source = self.history.get(_POOLED), "pooled"
+        if history and history["cells"]:
+            scale = size / (history["size"] / history["cells"])
+            seconds = history["seconds"] / history["cells"] * scale
+            agent_share = min(1.0, history["agent_seconds"] / history["seconds"]) if history["seconds"] else 1.0
+            runs = history["agent_runs"] or history["cells"]
+            agent_tokens = history["tokens"] / runs * scale
+            agent_cost = history["cost"] / runs * scale
+            judge_tokens = self.judge["tokens"] / self.judge["cells"]
+            judge_cost = self.judge["cost"] / self.judge["cells"]
+        else:
+            source = "default"
+            sizes = [s for s in self._sizes.values() if s]
+            seconds = self.default_seconds * size / (sum(sizes) / len(sizes) if sizes else size)
+            agent_share = 0.8
+            # 每一步都把到目前为止的上下文重新发一遍
+            agent_tokens = self.agent_steps * size
+            agent_cost = estimate_cost(model, agent_tokens, 0, 0)
+            judge_tokens, judge_cost = self._judge_default(size)
+        if stage in ("score", "extract"):
+            # agent 已经跑完了
+            seconds *= 1 - agent_share
+            agent_tokens = agent_cost = 0
+        if stage == "extract":
+            seconds = judge_tokens = judge_cost = 0
+        return {
+            "seconds": seconds,
+            "agent_tokens": int(agent_tokens),
+            "judge_tokens": int(judge_tokens),
+            "cost": agent_cost + judge_cost,
+            "source": source,
+        }
+
+    def plan(self, ledger: RunLedger, models: Sequence[str], started_only: bool = False) -> List[Dict[str, Any]]:
+        """The estimates of every pending cell, in the file order of the grid."""
+        for task_id in grid.list_tasks(self.tasks_dir):
+            self.size(task_id)  # the default estimate is relative to the average task size
+        cells = []
+        for model, task_id in grid.pending_cells(ledger, models, self.tasks_dir, started_only=started_only):
+            stage = grid.next_stage(ledger, model, task_id)
+            cells.append({"model": model, "task_id": task_id, "stage": stage,
+                          **self.estimate(model, task_id, stage)})
+        return cells
+
+
+def lpt_order(cells: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Longest processing time first; equal estimates keep their order."""
+    return sorted(cells, key=lambda cell: -cell["seconds"])
+
+
+def makespan(seconds: Sequence[float], workers: int) -> float:
+    """The wall-clock of `workers` workers each taking the next cell in this order as soon as it is free."""
+    free = [0.0] * max(1, workers)
+    for s in seconds:
+        heapq.heappush(free, heapq.heappop(free) + s)
+    return max(free)
+
+
+def summary(cells: List[Dict[str, Any]], workers: int) -> Dict[str, Any]:
+    total = sum(cell["seconds"] for cell in cells)
+    return {
+        "cells": len(cells),
+        "agent_tokens": sum(cell["agent_tokens"] for cell in cells),
+        "judge_tokens": sum(cell["judge_tokens"] for cell in cells),
+        "cost_usd": round(sum(cell["cost"] for cell in cells), 4),
+        "cell_seconds": round(total, 1),
+        "workers": workers,
+        "makespan_file_order": round(makespan([cell["seconds"] for cell in cells], workers), 1),
+        "makespan_lpt": round(makespan([cell["seconds"] for cell in lpt_order(cells)], workers), 1),
+        # 下界：总工作量平均分给每个 worker，或者最长的那个 cell
+        "makespan_lower_bound": round(max(total / max(1, workers),
+                                          max((cell["seconds"] for cell in cells), default=0.0)), 1),
+    }
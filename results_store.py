@@ -0,0 +1,227 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : results_store.py
+
+"""
+The consolidated results store and the leaderboard.
+
+`outputs/{model}_{task}.jsonl` (from `lx.io.save_annotated_documents`, the model percent-encoded as in
+grid.cell_stem) and the raw `score_str/*.txt` files, also in sub directories (`outputs/{provider}/...`),
+are ingested incrementally into one SQLite table with a typed column per score; a file is only read
+again when its size or mtime changed. The aggregates use NumPy: per-model / per-task means with
+bootstrap confidence intervals, the resamples are drawn as count matrices in chunks of bounded size.
+
+Usage:
+    python cli.py aggregate                 # leaderboard by model
+    python cli.py aggregate --by task
+"""
+import json
+import re
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import unquote
+
+import numpy as np
+
+from score_parser import ScoreParseError, ScoreParser
+
+SCORE_COLUMNS = ("final", "result", "processer", "reasoning", "tool_usage", "error_handling", "planning")
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def _number(text: Optional[str]) -> Optional[float]:
+    if text is None:
+        return None
+    m = _NUMBER.search(str(text))
+    return float(m.group()) if m else None
+
+
+def _scores_from_extractions(values: Dict[str, str]) -> Dict[str, Optional[float]]:
+    return {col: _number(values.get(f"{col}_score")) for col in SCORE_COLUMNS}
+
+
+class ResultsStore:
+    def __init__(self, path: str = "./results/results.sqlite"):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        cols = ", ".join(f"{c} REAL" for c in SCORE_COLUMNS)
+        self.conn.execute(
+            f"CREATE TABLE IF NOT EXISTS scores ("
+            f" model TEXT NOT NULL, task_id TEXT NOT NULL, {cols},"
+            f" language TEXT, task_time TEXT, source TEXT, ingested_at REAL,"
+            f" PRIMARY KEY (model, task_id))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS ingested_files ("
+            " path TEXT PRIMARY KEY, size INTEGER, mtime REAL)"
+        )
+        self.conn.commit()
+
+    # ------------------------------------------------------------------ ingest
+    def _changed(self, file: Path) -> bool:
+        st = file.stat()
+        row = self.conn.execute("SELECT size, mtime FROM ingested_files WHERE path = ?", (str(file),)).fetchone()
+        return row is None or row[0] != st.st_size or row[1] != st.st_mtime
+
+    def _mark(self, file: Path) -> None:
+        st = file.stat()
+        self.conn.execute("INSERT OR REPLACE INTO ingested_files (path, size, mtime) VALUES (?, ?, ?)",
+                          (str(file), st.st_size, st.st_mtime))
+
+    def _upsert(self, model: str, task_id: str, scores: Dict[str, Optional[float]],
+                language: Optional[str], task_time: Optional[str], source: str, overwrite: bool = True) -> None:
+        verb = "INSERT OR REPLACE" if overwrite else "INSERT OR IGNORE"
+        cols = ", ".join(SCORE_COLUMNS)
+        marks = ", ".join("?" for _ in SCORE_COLUMNS)
+        self.conn.execute(
+            f"{verb} INTO scores (model, task_id, {cols}, language, task_time, source, ingested_at)"
+            f" VALUES (?, ?, {marks}, ?, ?, ?, ?)",
+            (model, task_id, *(scores[c] for c in SCORE_COLUMNS), language, task_time, source, time.time()),
+        )
+
+    def _ingest_output(self, file: Path, stem: str) -> int:
+        count = 0
+        with open(file, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                doc = json.loads(line)
+                values: Dict[str, str] = {}
+                for ext in doc.get("extractions") or []:
+                    values.setdefault(ext.get("extraction_class"), ext.get("extraction_text"))
+                task_id = (values.get("task_id") or "").strip()
+                suffix = f"_{task_id}"
+                # 文件名是 grid.cell_stem：{model}_{task_id}，model 里也可能有下划线，所以按 task_id 从后面切
+                if task_id and stem.endswith(suffix):
+                    model = unquote(stem[:-len(suffix)])
+                else:
+                    model = (values.get("task_model") or stem).strip()
+                    task_id = task_id or stem
+                self._upsert(model, task_id, _scores_from_extractions(values),
+                             values.get("language"), values.get("task_time"), "outputs")
+                count += 1
+        return count
+
+    def _ingest_score_str(self, file: Path, stem: str) -> int:
+        # score_str/{model}_{task_id}_score.txt, only used where outputs/ has no record
+        text = file.read_text(encoding="utf-8")
+        parser = ScoreParser()
+        parser.feed(text)
+        try:
+            spans = parser.close()
+        except ScoreParseError:
+            return 0
+        values = {name: text[start:end] for name, start, end in spans}
+        task_id = values["task_id"].strip()
+        stem = stem[:-len("_score")] if stem.endswith("_score") else stem
+        model = unquote(stem[:-len(task_id) - 1]) if stem.endswith(f"_{task_id}") else values.get("task_model", stem)
+        self._upsert(model, task_id, _scores_from_extractions(values),
+                     values.get("language"), values.get("task_time"), "score_str", overwrite=False)
+        return 1
+
+    def ingest(self, outputs_dir: str = "./outputs", score_str_dir: str = "./score_str") -> Dict[str, int]:
+        """Read the new or changed result files, return how many files and records were ingested."""
+        files = records = 0
+        for directory, pattern, reader in ((outputs_dir, "*.jsonl", self._ingest_output),
+                                           (score_str_dir, "*.txt", self._ingest_score_str)):
+            root = Path(directory)
+            if not root.is_dir():
+                continue
+            for file in sorted(root.rglob(pattern)):
+                if not self._changed(file):
+                    continue
+                # outputs/deepseek/chat_T1.jsonl 是模型 deepseek/chat 的结果
+                records += reader(file, file.relative_to(root).with_suffix("").as_posix())
+                self._mark(file)
+                files += 1
+        self.conn.commit()
+        return {"files": files, "records": records}
+
+    # --------------------------------------------------------------- aggregate
+    def columns(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """:return: (models, task_ids, scores[n, len(SCORE_COLUMNS)]) with NaN for missing values"""
+        rows = self.conn.execute(
+            f"SELECT model, task_id, {', '.join(SCORE_COLUMNS)} FROM scores"
+        ).fetchall()
+        if not rows:
+            return np.array([], dtype=object), np.array([], dtype=object), np.empty((0, len(SCORE_COLUMNS)))
+        models = np.array([r[0] for r in rows], dtype=object)
+        tasks = np.array([r[1] for r in rows], dtype=object)
+        scores = np.array([r[2:] for r in rows], dtype=float)  # None -> nan
+        return models, tasks, scores
+
+    @staticmethod
+    def bootstrap(values: np.ndarray, n_boot: int = 2000, alpha: float = 0.05,
+                  rng: Optional[np.random.Generator] = None,
+                  chunk_elements: int = 1 << 22) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Mean and percentile bootstrap CI of every column.
+        A resample is a row of counts (how often every value was drawn), its means are one matrix product
+        with the values, so the memory is chunk × n counts instead of n_boot × n × k values.
+        :param values: shape (n, k), NaN is ignored
+        :param chunk_elements: the max size of one count matrix
+        :return: (mean[k], low[k], high[k])
+        """
+        rng = rng or np.random.default_rng(0)
+        n = values.shape[0]
+        mean = np.nanmean(values, axis=0)
+        if n < 2:
+            return mean, mean.copy(), mean.copy()
+        valid = ~np.isnan(values)
+        filled = np.where(valid, values, 0.0)
+        boot = np.empty((n_boot, values.shape[1]))
+        chunk = max(1, chunk_elements // n)
+        for start in range(0, n_boot, chunk):
+            rows = min(chunk, n_boot - start)
+            idx = rng.integers(0, n, size=(rows, n))
+            counts = np.bincount((idx + n * np.arange(rows)[:, None]).ravel(), minlength=rows * n)
+            counts = counts.reshape(rows, n).astype(float)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                boot[start:start + rows] = (counts @ filled) / (counts @ valid)
+        low, high = np.nanpercentile(boot, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+        return mean, low, high
+
+    def aggregate(self, by: str = "model", n_boot: int = 2000, alpha: float = 0.05) -> List[Dict[str, Any]]:
+        models, tasks, scores = self.columns()
+        keys = models if by == "model" else tasks
+        if keys.size == 0:
+            return []
+        groups, inverse = np.unique(keys.astype(str), return_inverse=True)
+        order = np.argsort(inverse, kind="stable")
+        bounds = np.searchsorted(inverse[order], np.arange(len(groups) + 1))
+        rng = np.random.default_rng(0)
+        out = []
+        for g, name in enumerate(groups):
+            values = scores[order[bounds[g]:bounds[g + 1]]]
+            mean, low, high = self.bootstrap(values, n_boot, alpha, rng)
+            row: Dict[str, Any] = {by: name, "n": int(values.shape[0])}
+            for i, col in enumerate(SCORE_COLUMNS):
+                row[col] = float(mean[i])
+                row[f"{col}_ci"] = (float(low[i]), float(high[i]))
+            out.append(row)
+        out.sort(key=lambda r: -np.nan_to_num(r["final"], nan=-1))
+        return out
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def format_table(rows: List[Dict[str, Any]], by: str) -> str:
+    lines = [f"{by:<36} {'n':>4} {'final (95% CI)':>22} " + " ".join(f"{c[:10]:>10}" for c in SCORE_COLUMNS[1:])]
+    for r in rows:
+        lo, hi = r["final_ci"]
+        lines.append(
+            f"{str(r[by])[:36]:<36} {r['n']:>4} {r['final']:>7.2f} [{lo:>6.2f}, {hi:>6.2f}] "
+            + " ".join(f"{r[c]:>10.2f}" for c in SCORE_COLUMNS[1:])
+        )
+    return "\n".join(lines)
+
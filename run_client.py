@@ -9,69 +9,297 @@
 
 import os
 import json
+import time
+import asyncio
+from collections import Counter
+from contextlib import aclosing
 from pathlib import Path
-from typing import List
+from typing import Any, Callable, Dict, List, Optional
+from uuid import UUID
 
 from langchain.chat_models import init_chat_model
-from langchain_core.messages import BaseMessage
-from langchain_mcp_adapters.client import MultiServerMCPClient
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.messages import BaseMessage, HumanMessage
+from langchain_core.runnables import RunnableBinding
+from langgraph.errors import GraphRecursionError
 from langgraph.prebuilt import create_react_agent
 
-system_prompt = """
-# Role
-You are a senior econometrics expert specializing in causal inference and empirical analysis, with strong data cleaning and preprocessing skills. You are proficient in combining economic theory with data analysis and capable of providing professional support in both academic research and practical applications.
+from http_pool import http_pool
+from lazy import is_loaded, lazy_class_attr
+from limiter import EndpointLimiter, estimate_tokens, get_limiter
+from mcp_pool import MCPSessionPool
+from prompts import system_prompt
+from tool_cache import tool_cache
+from tracing import Span, tracer
 
-# Ability
-You are particularly skilled in writing Stata code to perform various statistical modeling, regression analysis, and visualization tasks. Stata is your primary research tool. At the same time, you are able to flexibly use other auxiliary tools to meet user research needs in different scenarios.
 
-# ReAct
-When performing tasks, you must follow the ReAct (Reasoning + Acting) framework.
-The core idea of ReAct is to combine **reasoning** with **action**:
+class _LimiterCallback(AsyncCallbackHandler):
+    """
+    Hold one endpoint slot for every chat model call the agent graph makes,
+    the call only starts after `on_chat_model_start` returns.
+    """
+    run_inline = True
 
-- **Reasoning**: Develop your thoughts step by step, providing a clear and traceable reasoning chain to explain why specific steps are taken.
-- **Acting**: Call appropriate tools (such as running Stata code, querying knowledge bases, or other functions) to carry out concrete tasks.
-- **Alternation**: Alternate between reasoning and acting, ensuring the process remains transparent and explainable, avoiding "black box" operations.
-- **Goal-oriented**: All reasoning and actions must be directed toward fulfilling the user’s task.
+    def __init__(self, limiter: EndpointLimiter):
+        self.limiter = limiter
+        self._held: Dict[UUID, bool] = {}
 
-# Score
-Your performance will be evaluated:
-- **Process (80 points)**: Requires clear logic, traceable steps, compliance with econometric norms, and methodological correctness.
-- **Result (20 points)**: Requires the final output to meet the user’s task requirements, with professionalism, usability, and academic value.
+    async def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[BaseMessage]],
+                                  *, run_id: UUID, **kwargs: Any) -> None:
+        tokens = estimate_tokens("".join(str(m.content) for batch in messages for m in batch))
+        await self.limiter.acquire(tokens)
+        self._held[run_id] = True
+
+    async def _release(self, run_id: UUID, error: Optional[BaseException] = None) -> None:
+        if self._held.pop(run_id, None):
+            await self.limiter.release(error)
+
+    async def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        await self._release(run_id)
+
+    async def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        await self._release(run_id, error)
+
+    async def release_all(self, error: BaseException) -> None:
+        """
+        Free the slots of the calls which never finished.
+        :param error: why the run stopped, a TimeoutError shrinks the window, a CancelledError only frees the slot
+        """
+        for run_id in list(self._held):
+            await self._release(run_id, error)
+
+
+class _TraceCallback(AsyncCallbackHandler):
+    """
+    One span per chat model call (with its token usage) and per MCP tool call inside the agent graph.
+    """
+    run_inline = True
+
+    def __init__(self, model: str):
+        self.model = model
+        self._spans: Dict[UUID, Span] = {}
+
+    async def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[BaseMessage]],
+                                  *, run_id: UUID, **kwargs: Any) -> None:
+        self._spans[run_id] = tracer.start_span("agent.llm", model=self.model)
+
+    async def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        sp = self._spans.pop(run_id, None)
+        if sp is None:
+            return
+        for generations in response.generations:
+            for gen in generations:
+                message = getattr(gen, "message", None)
+                sp.add_usage(self.model, getattr(message, "usage_metadata", None))
+        sp.end()
+
+    async def on_tool_start(self, serialized: Dict[str, Any], input_str: str,
+                            *, run_id: UUID, **kwargs: Any) -> None:
+        self._spans[run_id] = tracer.start_span("mcp.tool", tool=(serialized or {}).get("name"), model=self.model)
+
+    async def on_tool_end(self, output: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        sp = self._spans.pop(run_id, None)
+        if sp is not None:
+            sp.end()
+
+    async def _error(self, error: BaseException, run_id: UUID) -> None:
+        sp = self._spans.pop(run_id, None)
+        if sp is not None:
+            sp.end(error)
+
+    async def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        await self._error(error, run_id)
+
+    async def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        await self._error(error, run_id)
+
+
+class AgentBudget:
+    """
+    The per-cell limits of one agent run, 0 means unlimited.
+    :param max_steps: max ReAct steps, i.e. chat model calls
+    :param max_tokens: max total tokens reported by the chat model calls
+    :param max_seconds: max wall-clock seconds
+    """
+
+    def __init__(self, max_steps: int = 0, max_tokens: int = 0, max_seconds: float = 0):
+        self.max_steps = max_steps
+        self.max_tokens = max_tokens
+        self.max_seconds = max_seconds
+
+    def recursion_limit(self) -> Optional[int]:
+        # 一个 ReAct step 是 agent + tools 两个 super-step，留一点余量；只是兜底，正常由 exceeded 先停下
+        return 2 * self.max_steps + 3 if self.max_steps else None
+
+    @staticmethod
+    def count(message: BaseMessage, used: Dict[str, int]) -> None:
+        """Add one message of the run to the `{"steps", "tokens"}` counters."""
+        if getattr(message, "type", None) == "ai":
+            used["steps"] += 1
+            used["tokens"] += int((getattr(message, "usage_metadata", None) or {}).get("total_tokens") or 0)
+
+    def exceeded(self, used: Dict[str, int], last: Optional[BaseMessage]) -> Optional[str]:
+        """The name of the budget the run has used up, only when the agent still has work to do."""
+        if last is None:
+            return None
+        pending = last.type == "tool" or (last.type == "ai" and bool(getattr(last, "tool_calls", None)))
+        if not pending:
+            return None
+        if self.max_steps and used["steps"] >= self.max_steps:
+            return "max_steps"
+        if self.max_tokens and used["tokens"] >= self.max_tokens:
+            return "max_tokens"
+        return None
+
+    @classmethod
+    def from_env(cls) -> "AgentBudget":
+        return cls(
+            max_steps=int(os.getenv("AGENT_MAX_STEPS", "0")),
+            max_tokens=int(os.getenv("AGENT_MAX_TOKENS", "0")),
+            max_seconds=float(os.getenv("AGENT_MAX_SECONDS", "0")),
+        )
 
-# Style
-- Use professional and academic expressions, avoiding colloquial or oversimplified wording.
-- Provide structured and well-organized answers, making reasonable use of paragraphs, bullet points, and subheadings.
-- Appropriately apply economics and statistics terminology, while keeping explanations clear and understandable.
-- Avoid unnecessary first-person expressions, emphasizing objectivity and research orientation.
-- Ensure answers reflect a logical chain of "research design + data analysis + interpretation of results".
-"""
 
 class RunClient:
     api_key = os.getenv("OPENROUTER_API_KEY")
     api_base = os.getenv("OPENROUTER_BASE_URL")
 
-    config_path = Path(__file__).parent / "servers_config.json"
+    config_path = Path(os.getenv("MCP_SERVERS_CONFIG", Path(__file__).parent / "servers_config.json"))
 
-    with open(config_path, "r", encoding="utf-8") as f:
-        config = json.load(f)
-    mcp_client = MultiServerMCPClient(config["mcpServers"])
+    # the config is read and the MCP clients are built on first use, not when this module is imported
+    @lazy_class_attr
+    def config():
+        with open(RunClient.config_path, "r", encoding="utf-8") as f:
+            return json.load(f)
 
-    def __init__(self, model: str):
-        self.llm = init_chat_model(
-            model=model,
-            api_base=self.api_base,
-            api_key=self.api_key
+    # 进程内共享的 MCP 会话池，避免每个任务都重新拉起 stata-mcp
+    @lazy_class_attr
+    def mcp_pool():
+        return MCPSessionPool(
+            RunClient.config["mcpServers"],
+            size=int(os.getenv("MCP_POOL_SIZE", "5")),
+            health_check_timeout=float(os.getenv("MCP_HEALTH_CHECK_TIMEOUT", "5")),
         )
 
-    async def run(self, task: str) -> List[BaseMessage]:
-        mcp_tools = await self.mcp_client.get_tools()
-        agent = create_react_agent(
-            model=self.llm,
-            tools=mcp_tools,
-            prompt=system_prompt
+    endpoint = "openrouter"  # the name of the rate limiter, see limiter.py
+    # retries of a chat model call on 429 / 5xx / connection errors, the SDK itself never retries
+    llm_retries = int(os.getenv("AGENT_LLM_RETRIES", "2"))
+    budget = AgentBudget.from_env()
+    stop_reasons: Counter = Counter()  # how the runs of this process ended
+
+    # one chat model per model name for the whole process, they all share the pooled HTTP client
+    _llms: Dict[str, Any] = {}
+
+    def __init__(self, model: str, budget: Optional[AgentBudget] = None):
+        self.model = model
+        self.llm = self.get_llm(model)
+        if budget is not None:
+            self.budget = budget
+        # "completed", or the budget which stopped the run: "max_steps" / "max_tokens" / "timeout"
+        self.stop_reason: Optional[str] = None
+
+    @classmethod
+    def get_llm(cls, model: str):
+        if model not in cls._llms:
+            if not cls._llms:
+                # the chat models hold the pooled clients, drop them when the pool is closed
+                http_pool.on_close(cls._llms.clear)
+            cls._llms[model] = init_chat_model(
+                model=model,
+                base_url=cls.api_base,
+                api_key=cls.api_key,
+                http_client=http_pool.sync_client(),
+                http_async_client=http_pool.async_client(),
+                max_retries=0,
+            )
+        return cls._llms[model]
+
+    def bind_tools(self, tools: List[Any]) -> Any:
+        """
+        The chat model with the tools bound, retrying transient errors outside the SDK: every attempt is a
+        chat model call of its own, so `_LimiterCallback` holds one slot per attempt and AIMD sees every
+        429, which the SDK's internal retries would hide inside one slot.
+        """
+        bound = self.llm.bind_tools(tools)
+        if not self.llm_retries:
+            return bound
+        import openai
+
+        retrying = self.llm.with_retry(
+            retry_if_exception_type=(openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError),
+            stop_after_attempt=self.llm_retries + 1,
         )
-        result = await agent.ainvoke({"messages": task})
-        return result["messages"]
+        # create_react_agent 看到 kwargs 里已经有 tools 的 RunnableBinding 就不会再 bind 一次
+        return RunnableBinding(bound=retrying, kwargs=bound.kwargs, config=bound.config)
+
+    async def run(self, task: str, sink: Optional[Callable[[BaseMessage], None]] = None) -> List[BaseMessage]:
+        """
+        Run the agent within `self.budget`, streaming the graph step by step.
+        When a budget is used up the graph is cancelled and the transcript so far is returned,
+        `self.stop_reason` tells why the run ended.
+        :param sink: called with every message as soon as it is produced (the task message first);
+            when it is given the messages are not kept and the returned list is empty
+        :return: the messages of the run
+        """
+        messages: List[BaseMessage] = []
+        emit = sink or messages.append
+        used = {"steps": 0, "tokens": 0}
+        last: Optional[BaseMessage] = None
+        self.stop_reason = "completed"
+        with tracer.span("agent.run", model=self.model) as sp:
+            async with self.mcp_pool.lease() as mcp_tools:
+                # 幂等的工具走进程内共享的缓存，见 tool_cache.py
+                tools = tool_cache.wrap(mcp_tools)
+                agent = create_react_agent(
+                    model=self.bind_tools(tools),
+                    tools=tools,
+                    prompt=system_prompt
+                )
+                limiter_cb = _LimiterCallback(get_limiter(self.endpoint))
+                config: Dict[str, Any] = {"callbacks": [limiter_cb, _TraceCallback(self.model)]}
+                if self.budget.recursion_limit():
+                    config["recursion_limit"] = self.budget.recursion_limit()
+                start = time.monotonic()
+                first = HumanMessage(content=task)
+                emit(first)
+                # 还没结束的模型调用是被打断的，不是成功
+                stopped: BaseException = asyncio.CancelledError()
+                try:
+                    async with asyncio.timeout(self.budget.max_seconds or None):
+                        # "updates" gives only the new messages of every step, nothing is accumulated here
+                        stream = agent.astream({"messages": [first]}, config=config, stream_mode="updates")
+                        async with aclosing(stream):
+                            async for update in stream:
+                                for node_update in update.values():
+                                    new = (node_update or {}).get("messages") or []
+                                    for message in new if isinstance(new, list) else [new]:
+                                        AgentBudget.count(message, used)
+                                        emit(message)
+                                        last = message
+                                reason = self.budget.exceeded(used, last)
+                                if reason:
+                                    self.stop_reason = reason
+                                    break
+                except TimeoutError as e:
+                    self.stop_reason = "timeout"
+                    stopped = e
+                except GraphRecursionError:
+                    self.stop_reason = "max_steps"
+                finally:
+                    await limiter_cb.release_all(stopped)
+            self.stop_reasons[self.stop_reason] += 1
+            sp.set(stop_reason=self.stop_reason, seconds=round(time.monotonic() - start, 3), **used)
+        return messages
+
+    @classmethod
+    def pool_stats(cls) -> Dict[str, Any]:
+        return cls.mcp_pool.stats() if is_loaded(cls, "mcp_pool") else {}
+
+    @classmethod
+    async def close(cls) -> None:
+        """Close the MCP pool if it was ever started."""
+        if is_loaded(cls, "mcp_pool"):
+            await cls.mcp_pool.close()
 
 
 if __name__ == "__main__":
@@ -84,7 +312,13 @@ if __name__ == "__main__":
     with open(task_file, "r", encoding="utf-8") as f:
         task = f.read()
 
+    async def _main():
+        try:
+            return await client.run(task)
+        finally:
+            await RunClient.close()
+
     start_time = time.time()
-    result = asyncio.run(client.run(task))
+    result = asyncio.run(_main())
     print(result)
     print(f"Time taken: {time.time() - start_time:.2f} seconds")
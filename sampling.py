@@ -0,0 +1,206 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : sampling.py
+
+"""
+Multi-sample judging with sequential early stopping.
+
+The judge is drawn in small concurrent rounds. After every round the Student-t CI of the mean
+FinalScore is checked, and sampling stops once it is narrower than `ci_width` or `max_samples`
+draws were made, so the extra calls go to the cells the judge is unsure about. Two identical integer
+scores say little about the spread, zero variance only counts as converged from 3 samples on.
+A draw which raises counts against `max_samples` and is dropped, the cell only fails when fewer than
+`min_samples` draws returned at all.
+
+Only the final scoring request is re-drawn; the positive / negative advice is requested once per cell
+(`ScoreModel.advices`), the reasoner calls are the expensive part.
+"""
+import asyncio
+import math
+import os
+import threading
+from collections import Counter
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from score_parser import ScoreParseError, ScoreParser
+
+
+def final_score(score_str: str) -> Optional[int]:
+    parser = ScoreParser()
+    parser.feed(score_str)
+    try:
+        parser.close()
+    except ScoreParseError:
+        return None
+    return parser.scores["final"]
+
+
+def _t_coverage(t: float, df: int) -> float:
+    """P(|T| < t) of Student's t with integer df, the finite series of Abramowitz & Stegun 26.7.3 / 26.7.4."""
+    theta = math.atan(t / math.sqrt(df))
+    c2 = math.cos(theta) ** 2
+    if df % 2:
+        total, term = 0.0, 1.0
+        for k in range(1, (df - 1) // 2):
+            term *= c2 * (2 * k) / (2 * k + 1)
+            total += term
+        series = math.sin(theta) * math.cos(theta) * (1 + total) if df > 1 else 0.0
+        return 2 / math.pi * (theta + series)
+    total, term = 1.0, 1.0
+    for k in range(1, df // 2):
+        term *= c2 * (2 * k - 1) / (2 * k)
+        total += term
+    return math.sin(theta) * total
+
+
+@lru_cache(maxsize=256)
+def t_quantile(confidence: float, df: int) -> float:
+    """The two-sided Student-t quantile, e.g. t_quantile(0.95, 1) = 12.706."""
+    lo, hi = 0.0, 1.0
+    while _t_coverage(hi, df) < confidence:
+        hi *= 2
+    for _ in range(100):
+        mid = (lo + hi) / 2
+        if _t_coverage(mid, df) < confidence:
+            lo = mid
+        else:
+            hi = mid
+    return hi
+
+
+class SequentialSampler:
+    def __init__(self,
+                 ci_width: float = 5.0,
+                 round_size: int = 2,
+                 min_samples: int = 2,
+                 max_samples: int = 8,
+                 confidence: float = 0.95):
+        """
+        :param ci_width: stop when the full width of the CI of the mean FinalScore is below this
+        :param round_size: samples drawn concurrently per round
+        :param min_samples: never stop before this many valid samples
+        :param max_samples: hard cap of draws per cell, valid, unparsable or failed
+        :param confidence: the level of the CI, the Student-t quantile with n - 1 degrees of freedom is used
+        """
+        self.ci_width = ci_width
+        self.round_size = max(1, round_size)
+        self.min_samples = max(1, min_samples)
+        self.max_samples = max(1, max_samples)
+        self.confidence = confidence
+        self._lock = threading.Lock()
+        self.cells = 0
+        self.draws = 0
+        self.invalid = 0
+        self.failed = 0
+        self.counts: Counter = Counter()
+        self.stopped: Counter = Counter()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_samples > 1
+
+    def width(self, finals: List[int]) -> float:
+        n = len(finals)
+        if n < 2:
+            return math.inf
+        mean = sum(finals) / n
+        var = sum((x - mean) ** 2 for x in finals) / (n - 1)
+        return 2 * t_quantile(self.confidence, n - 1) * math.sqrt(var / n)
+
+    def converged(self, finals: List[int]) -> bool:
+        n = len(finals)
+        if n < self.min_samples:
+            return False
+        if n < 3 and len(set(finals)) == 1:
+            return False  # 两个一样的整数分，方差为 0 也说明不了什么
+        return self.width(finals) <= self.ci_width
+
+    async def run(self, draw: Callable[[int], Awaitable[str]]) -> Dict[str, Any]:
+        """
+        :param draw: coroutine function, draw(sample_index) -> score string
+        :return: {"score": the sample closest to the mean, "n", "valid", "failed", "finals", "mean", "var",
+            "ci_width", "stop"}
+        :raise: the first error of a failed draw, when fewer than min_samples draws returned
+        """
+        samples: List[str] = []
+        finals: List[Optional[int]] = []
+        errors: List[Exception] = []
+        stop = "max_samples"
+        draws = 0
+        while draws < self.max_samples:
+            batch = min(self.round_size, self.max_samples - draws)
+            outs = await asyncio.gather(*(draw(i) for i in range(draws, draws + batch)), return_exceptions=True)
+            draws += batch
+            for out in outs:
+                if isinstance(out, Exception):
+                    errors.append(out)
+                elif isinstance(out, BaseException):
+                    raise out  # 取消之类的不算失败的样本
+                else:
+                    samples.append(out)
+                    finals.append(final_score(out))
+            valid = [f for f in finals if f is not None]
+            if self.converged(valid):
+                stop = "converged"
+                break
+
+        with self._lock:
+            self.failed += len(errors)
+        if errors and len(samples) < min(self.min_samples, self.max_samples):
+            raise errors[0]
+
+        valid = [f for f in finals if f is not None]
+        mean = sum(valid) / len(valid) if valid else None
+        var = sum((x - mean) ** 2 for x in valid) / (len(valid) - 1) if len(valid) > 1 else 0.0
+        if valid:
+            # 代表样本：FinalScore 离均值最近的那一次，后面的抽取和存储都用它
+            best = min((i for i, f in enumerate(finals) if f is not None), key=lambda i: abs(finals[i] - mean))
+        else:
+            best, stop = 0, "unparsable"
+        with self._lock:
+            self.cells += 1
+            self.draws += draws
+            self.invalid += len(samples) - len(valid)
+            self.counts[draws] += 1
+            self.stopped[stop] += 1
+        width = self.width(valid)
+        return {
+            "score": samples[best],
+            "n": len(samples),
+            "valid": len(valid),
+            "failed": len(errors),
+            "finals": finals,
+            "mean": round(mean, 4) if mean is not None else None,
+            "var": round(var, 4),
+            "ci_width": round(width, 4) if math.isfinite(width) else None,
+            "stop": stop,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "cells": self.cells,
+                "draws": self.draws,
+                "invalid": self.invalid,
+                "failed": self.failed,
+                "mean_samples": round(self.draws / self.cells, 3) if self.cells else 0.0,
+                "sample_counts": dict(sorted(self.counts.items())),
+                "stopped": dict(self.stopped),
+            }
+
+    @classmethod
+    def from_env(cls) -> "SequentialSampler":
+        """JUDGE_SAMPLES_MAX=1 (the default) keeps the single-sample behaviour."""
+        return cls(
+            ci_width=float(os.getenv("JUDGE_CI_WIDTH", "5")),
+            round_size=int(os.getenv("JUDGE_SAMPLE_ROUND", "2")),
+            min_samples=int(os.getenv("JUDGE_SAMPLES_MIN", "2")),
+            max_samples=int(os.getenv("JUDGE_SAMPLES_MAX", "1")),
+            confidence=float(os.getenv("JUDGE_CI_LEVEL", "0.95")),
+        )
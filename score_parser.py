@@ -0,0 +1,287 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : score_parser.py
+
+"""
+A deterministic parser for the `<score>` layout which `ScoreModel.instruction` asks for.
+
+It emits the same extraction classes as the LangExtract example in `extract_info.py`
+(task_id, language, final_score, result_score, result_reason, ...), with the char offsets of
+every value in the original text. The LLM extraction is only needed when this parser fails.
+"""
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+
+class ScoreParseError(ValueError):
+    pass
+
+
+# tag -> prefix of the extraction class
+_SECTIONS = {
+    "score_from_results": "result",
+    "score_from_processer": "processer",
+    "agent_reasoning": "reasoning",
+    "tool_usage": "tool_usage",
+    "error_handling": "error_handling",
+    "planning": "planning",
+}
+DIMENSIONS = ("reasoning", "tool_usage", "error_handling", "planning")
+
+_TAG_RE = re.compile(r"^\s*<(/?)([a-z_]+)>\s*$")
+_SCORE_RE = re.compile(r"^\s*(?:Result |Processer )?Score\s*[:：]\s*(\d+)\s*/\s*(\d+)")
+_REASON_RE = re.compile(r"^\s*Reason\s*[:：]\s*")
+_FINAL_RE = re.compile(r"^\s*FinalScore\s*[:：]\s*(\d+)\s*=\s*(\d+)\s*\+\s*(\d+)")
+_META_RE = re.compile(r"^\s*(TaskID|Language|Model name|Task time)\s*[:：]\s*(.*?)\s*$")
+_META_CLASS = {
+    "TaskID": "task_id",
+    "Language": "language",
+    "Model name": "task_model",
+    "Task time": "task_time",
+}
+
+
+class ScoreParser:
+    """
+    Line based streaming parser, feed it chunks as they come and call `close()` at the end.
+
+    Usage:
+        parser = ScoreParser()
+        parser.feed(score_str)
+        records = parser.close()  # [(extraction_class, start, end), ...]
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._buffer = ""
+        self._offset = 0  # offset of the first char in self._buffer
+
+        self._section: Optional[str] = None
+        self._reason: Optional[Tuple[str, int, int]] = None  # (class, start, end)
+        self._spans: Dict[str, Tuple[int, int]] = {}
+        self.scores: Dict[str, int] = {}
+        self._equation: Optional[Tuple[int, int, int]] = None
+
+    def feed(self, chunk: str) -> None:
+        self.text += chunk
+        self._buffer += chunk
+        while True:
+            idx = self._buffer.find("\n")
+            if idx < 0:
+                break
+            line = self._buffer[:idx]
+            self._line(line, self._offset)
+            self._offset += idx + 1
+            self._buffer = self._buffer[idx + 1:]
+
+    def _set(self, name: str, start: int, end: int) -> None:
+        # 只保留第一次出现的值，避免模型重复输出时被覆盖
+        self._spans.setdefault(name, (start, end))
+
+    def _end_reason(self) -> None:
+        if self._reason is not None:
+            name, start, end = self._reason
+            if end > start:
+                self._set(name, start, end)
+            self._reason = None
+
+    def _line(self, line: str, pos: int) -> None:
+        if line.strip().startswith("```"):
+            return
+
+        tag = _TAG_RE.match(line)
+        if tag:
+            self._end_reason()
+            closing, name = tag.groups()
+            if name in _SECTIONS:
+                self._section = None if closing else _SECTIONS[name]
+            return
+
+        m = _SCORE_RE.match(line)
+        if m and self._section is not None:
+            self._end_reason()
+            self._set(f"{self._section}_score", pos + m.start(1), pos + m.end(1))
+            self.scores[self._section] = int(m.group(1))
+            return
+
+        m = _REASON_RE.match(line)
+        if m and self._section is not None:
+            self._end_reason()
+            start = pos + m.end()
+            self._reason = (f"{self._section}_reason", start, pos + len(line.rstrip()))
+            return
+
+        m = _FINAL_RE.match(line)
+        if m:
+            self._end_reason()
+            self._set("final_score", pos + m.start(1), pos + m.end(1))
+            self._equation = (int(m.group(1)), int(m.group(2)), int(m.group(3)))
+            return
+
+        m = _META_RE.match(line)
+        if m:
+            self._end_reason()
+            if m.group(2):
+                self._set(_META_CLASS[m.group(1)], pos + m.start(2), pos + m.end(2))
+            return
+
+        # 多行的 Reason
+        if self._reason is not None and line.strip():
+            name, start, _ = self._reason
+            self._reason = (name, start, pos + len(line.rstrip()))
+
+    def close(self) -> List[Tuple[str, int, int]]:
+        """
+        Finish the stream and check the scores.
+        :return: list of (extraction_class, start, end), the value is self.text[start:end]
+        :raise ScoreParseError: when a field is missing or the scores do not sum up
+        """
+        if self._buffer:
+            self._line(self._buffer, self._offset)
+            self._offset += len(self._buffer)
+            self._buffer = ""
+        self._end_reason()
+        self._validate()
+
+        order = ["task_id", "language", "task_model", "task_time", "final_score",
+                 "result_score", "result_reason", "processer_score", "processer_reason"]
+        for dim in DIMENSIONS:
+            order += [f"{dim}_score", f"{dim}_reason"]
+        return [(name, *self._spans[name]) for name in order if name in self._spans]
+
+    def _validate(self) -> None:
+        required = ["task_id", "language", "final_score", "result_score", "result_reason",
+                    "processer_score", "processer_reason"]
+        for dim in DIMENSIONS:
+            required += [f"{dim}_score", f"{dim}_reason"]
+        missing = [name for name in required if name not in self._spans]
+        if missing:
+            raise ScoreParseError(f"missing: {', '.join(missing)}")
+
+        final, result_part, processer_part = self._equation
+        result = self.scores["result"]
+        processer = self.scores["processer"]
+        if result > 20 or any(self.scores[dim] > 20 for dim in DIMENSIONS) or processer > 80:
+            raise ScoreParseError("score out of range")
+        if sum(self.scores[dim] for dim in DIMENSIONS) != processer:
+            raise ScoreParseError("dimension scores do not sum to the processer score")
+        if (result_part, processer_part) != (result, processer) or final != result + processer:
+            raise ScoreParseError("final score is not result + processer")
+        self.scores["final"] = final
+
+
+def parse_score(text: str) -> List[Tuple[str, int, int]]:
+    parser = ScoreParser()
+    parser.feed(text)
+    return parser.close()
+
+
+# ---------------------------------------------------------------- structured output
+# the fields of the JSON the judge returns in the structured mode (ScoreModel.score_it_json)
+_SCORE_MAX = {"result": 20, "processer": 80, **{dim: 20 for dim in DIMENSIONS}}
+SCORE_FIELDS = ["language", "final_score"] + [
+    f"{part}_{kind}" for part in _SCORE_MAX for kind in ("score", "reason")
+]
+
+
+def score_json_schema() -> Dict[str, object]:
+    """The JSON schema for `response_format`, every field is required and nothing else is allowed."""
+    properties: Dict[str, object] = {
+        "language": {"type": "string", "enum": ["EN", "zh-CN"]},
+        "final_score": {"type": "integer", "minimum": 0, "maximum": 100},
+    }
+    for part, top in _SCORE_MAX.items():
+        properties[f"{part}_score"] = {"type": "integer", "minimum": 0, "maximum": top}
+        properties[f"{part}_reason"] = {"type": "string"}
+    return {"type": "object", "properties": properties, "required": SCORE_FIELDS, "additionalProperties": False}
+
+
+def validate_score_json(data: object) -> Dict[str, object]:
+    """
+    Check the structured judge output with the same rules as `ScoreParser`.
+    :raise ScoreParseError: on a missing field, a wrong type, a score out of range or scores which do not sum up
+    """
+    if not isinstance(data, dict):
+        raise ScoreParseError("not a JSON object")
+    missing = [name for name in SCORE_FIELDS if name not in data]
+    if missing:
+        raise ScoreParseError(f"missing: {', '.join(missing)}")
+    scores = {}
+    for part in ("final", *_SCORE_MAX):
+        value = data[f"{part}_score"]
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ScoreParseError(f"{part}_score is not an integer")
+        if not 0 <= value <= _SCORE_MAX.get(part, 100):
+            raise ScoreParseError("score out of range")
+        scores[part] = value
+    for part in _SCORE_MAX:
+        if not isinstance(data[f"{part}_reason"], str) or not data[f"{part}_reason"].strip():
+            raise ScoreParseError(f"empty {part}_reason")
+    if sum(scores[dim] for dim in DIMENSIONS) != scores["processer"]:
+        raise ScoreParseError("dimension scores do not sum to the processer score")
+    if scores["final"] != scores["result"] + scores["processer"]:
+        raise ScoreParseError("final score is not result + processer")
+    return data
+
+
+def render_score(data: Dict[str, object], task_id: str) -> str:
+    """
+    Write validated structured output in the `<score>` layout, so the score string, score_str/ and the
+    extraction (`ScoreParser`, always exact on this text) stay the same as in the text mode.
+    """
+    def reason(part: str) -> str:
+        # 一行写完，避免原因里的内容被当成标签或分数行
+        return " ".join(str(data[f"{part}_reason"]).split())
+
+    lines = [
+        "<meta>", f"TaskID: {task_id}", f"Language: {data['language']}", "</meta>",
+        "<score>",
+        "<score_from_results>",
+        f"Result Score: {data['result_score']} / 20", f"Reason: {reason('result')}",
+        "</score_from_results>",
+        "<score_from_processer>",
+        f"Processer Score: {data['processer_score']} / 80", f"Reason: {reason('processer')}",
+        "<detail>",
+    ]
+    for tag, dim in zip(("agent_reasoning", "tool_usage", "error_handling", "planning"), DIMENSIONS):
+        lines += [f"<{tag}>", f"Score: {data[f'{dim}_score']} / 20", f"Reason: {reason(dim)}", f"</{tag}>"]
+    lines += [
+        "</detail>",
+        "</score_from_processer>",
+        "<final_score>",
+        f"FinalScore: {data['final_score']} = {data['result_score']} + {data['processer_score']}",
+        "</final_score>",
+        "</score>",
+    ]
+    return "\n".join(lines)
+
+
+class ParseStats:
+    """Count how many score strings the fast path handled and why the others fell back."""
+
+    def __init__(self):
+        self.parsed = 0
+        self.fallback = 0
+        self.reasons: Counter = Counter()
+
+    def record(self, ok: bool, reason: str = None) -> None:
+        if ok:
+            self.parsed += 1
+        else:
+            self.fallback += 1
+            self.reasons[reason] += 1
+
+    def stats(self) -> Dict[str, object]:
+        total = self.parsed + self.fallback
+        return {
+            "parsed": self.parsed,
+            "fallback": self.fallback,
+            "parse_rate": round(self.parsed / total, 4) if total else 0.0,
+            "fallback_reasons": dict(self.reasons),
+        }
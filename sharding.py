@@ -0,0 +1,253 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : sharding.py
+
+"""
+Running the model × task grid in several processes or on several machines.
+
+Two ways to split the work:
+    - static shards: `--shard i/n` keeps the cells whose stable hash of (model, task_id) is i modulo n,
+      every process gets a fixed, disjoint part of the grid and needs no coordination
+    - a work queue: the cells are rows of a SQLite table, a worker leases one cell at a time and keeps
+      the lease alive while the cell is in flight; the lease of a crashed worker expires and another
+      worker picks the cell up. The SQLite file must be on a filesystem with working locks (a local
+      disk, or a network filesystem which supports them)
+
+Each worker writes its own ledger (`ledger/ledger.<worker>.jsonl`), so no two processes append to one
+file; `merge_ledgers` joins them into one ledger afterwards. A worker replays the merged ledger (and a
+queue worker the other workers' ledgers too) before its own, so the cells finished or half done in an
+earlier run resume instead of starting over. outputs/, score_str/ and transcripts/ are one file per
+cell already, the workers write them into the same directories.
+
+The queue is SQLite with blocking locks: the pipeline calls it through `asyncio.to_thread`, a busy
+queue never stalls the cells in flight.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from grid import cell_items
+from ledger import RunLedger
+
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """'2/8' -> (2, 8), shards are numbered from 0"""
+    index, _, count = spec.partition("/")
+    i, n = int(index), int(count)
+    if n < 1 or not 0 <= i < n:
+        raise ValueError(f"bad shard {spec!r}, expected i/n with 0 <= i < n")
+    return i, n
+
+
+def shard_of(model: str, task_id: str, count: int) -> int:
+    # 不能用内置 hash()，它每个进程的种子都不一样
+    digest = hashlib.sha1(f"{model}\0{task_id}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+def in_shard(items: Iterable[Dict[str, Any]], index: int, count: int) -> Iterator[Dict[str, Any]]:
+    for item in items:
+        if shard_of(item["model"], item["task_id"], count) == index:
+            yield item
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class WorkQueue:
+    def __init__(self, path: str, worker_id: Optional[str] = None, lease_seconds: float = 900, max_attempts: int = 3):
+        """
+        :param path: the SQLite file shared by the workers
+        :param lease_seconds: a leased cell goes back to the queue if its lease is not renewed in time
+        :param max_attempts: a cell which failed this many times is given up
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.worker_id = worker_id or default_worker_id()
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        # cells leased by this worker -> the ledger error the cell had when it was leased
+        self.held: Dict[Tuple[str, str], Any] = {}
+        # used from the worker threads of asyncio.to_thread, one at a time
+        self._lock = threading.RLock()
+        self.conn = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA busy_timeout=60000")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS cells ("
+            " model TEXT NOT NULL, task_id TEXT NOT NULL,"
+            " state TEXT NOT NULL DEFAULT 'pending',"  # pending / leased / done / failed
+            " owner TEXT, lease_until REAL, attempts INTEGER NOT NULL DEFAULT 0, error TEXT,"
+            " PRIMARY KEY (model, task_id))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS cells_state ON cells (state, lease_until)")
+
+    def seed(self, cells: Iterable[Tuple[str, str]]) -> int:
+        """Add the cells, the ones already in the queue keep their state. Every worker may call this."""
+        with self._lock:
+            before = self.conn.total_changes
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany("INSERT OR IGNORE INTO cells (model, task_id) VALUES (?, ?)", cells)
+            self.conn.execute("COMMIT")
+            return self.conn.total_changes - before
+
+    def claim(self, ledger: Optional[RunLedger] = None) -> Optional[Tuple[str, str]]:
+        """
+        Lease the next free cell (pending, or leased with an expired lease), None when there is none.
+        :param ledger: this worker's ledger, an error it already has for the cell is not counted again
+        """
+        with self._lock:
+            now = time.time()
+            self.conn.execute("BEGIN IMMEDIATE")  # 拿写锁，两个 worker 不会领到同一个 cell
+            try:
+                row = self.conn.execute(
+                    "SELECT model, task_id FROM cells"
+                    " WHERE state = 'pending' OR (state = 'leased' AND lease_until < ?)"
+                    " ORDER BY task_id, model LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is not None:
+                    self.conn.execute(
+                        "UPDATE cells SET state = 'leased', owner = ?, lease_until = ?, attempts = attempts + 1"
+                        " WHERE model = ? AND task_id = ?",
+                        (self.worker_id, now + self.lease_seconds, *row),
+                    )
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            if row is None:
+                return None
+            self.held[row] = ledger.cell(*row).get("error") if ledger is not None else None
+            return row
+
+    def renew(self) -> None:
+        """Extend the leases of every cell this worker holds."""
+        with self._lock:
+            if not self.held:
+                return
+            until = time.time() + self.lease_seconds
+            self.conn.execute("BEGIN IMMEDIATE")
+            self.conn.executemany(
+                "UPDATE cells SET lease_until = ? WHERE model = ? AND task_id = ? AND owner = ? AND state = 'leased'",
+                [(until, model, task_id, self.worker_id) for model, task_id in self.held],
+            )
+            self.conn.execute("COMMIT")
+
+    def complete(self, model: str, task_id: str) -> None:
+        with self._lock:
+            self.conn.execute(
+                "UPDATE cells SET state = 'done', lease_until = NULL, error = NULL WHERE model = ? AND task_id = ?",
+                (model, task_id),
+            )
+            self.held.pop((model, task_id), None)
+
+    def fail(self, model: str, task_id: str, error: str) -> None:
+        """Give the cell back to the queue, or give it up after max_attempts."""
+        with self._lock:
+            self.conn.execute(
+                "UPDATE cells SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,"
+                " owner = NULL, lease_until = NULL, error = ? WHERE model = ? AND task_id = ?",
+                (self.max_attempts, error, model, task_id),
+            )
+            self.held.pop((model, task_id), None)
+
+    def reconcile(self, ledger: RunLedger, release: bool = False) -> None:
+        """
+        Settle the held cells from this worker's ledger: finished ones are done, failed ones go back.
+        :param release: also give back the cells which are neither, e.g. when the worker stops
+        """
+        with self._lock:
+            for (model, task_id), old_error in list(self.held.items()):
+                cell = ledger.cell(model, task_id)
+                if ledger.is_done(model, task_id):
+                    self.complete(model, task_id)
+                elif "error" in cell and cell["error"] != old_error:
+                    self.fail(model, task_id, json.dumps(cell["error"], ensure_ascii=False))
+                elif release:
+                    self.fail(model, task_id, "released")
+
+    async def keep_alive(self, ledger: RunLedger, interval: Optional[float] = None) -> None:
+        """Renew the leases and settle finished cells until cancelled, run it next to the pipeline."""
+        interval = interval or max(1.0, self.lease_seconds / 3)
+        while True:
+            await asyncio.sleep(interval)
+            await asyncio.to_thread(self.reconcile, ledger)
+            await asyncio.to_thread(self.renew)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self.conn.execute("SELECT state, COUNT(*) FROM cells GROUP BY state").fetchall()
+            counts = {"pending": 0, "leased": 0, "done": 0, "failed": 0}
+            counts.update(dict(rows))
+            counts["held"] = len(self.held)
+            return counts
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+async def queue_items(queue: WorkQueue,
+                      ledger: RunLedger,
+                      tasks_dir: str = "./tasks",
+                      answers_dir: str = "./answers") -> AsyncIterator[Dict[str, str]]:
+    """
+    The work items of a queue worker: a cell is leased only when the pipeline asks for the next item,
+    so a worker never holds much more than its pipeline can take.
+    Before a cell is handed out the ledgers of the other workers are read again, a cell re-leased from a
+    crashed worker resumes after the stages that worker finished.
+    """
+    while True:
+        cell = await asyncio.to_thread(queue.claim, ledger)
+        if cell is None:
+            return
+        model, task_id = cell
+        await asyncio.to_thread(ledger.refresh)
+        if ledger.is_done(model, task_id):
+            await asyncio.to_thread(queue.complete, model, task_id)
+            continue
+        for item in cell_items([cell], tasks_dir, answers_dir):
+            yield item
+
+
+def merge_ledgers(paths: Sequence[str], out: str) -> Dict[str, int]:
+    """
+    Join the worker ledgers into one, records in time order; a torn last line is skipped.
+    Replaying the merged ledger gives every cell its latest state.
+    """
+    sources = [path for path in paths if os.path.abspath(path) != os.path.abspath(out)]
+    if os.path.exists(out):
+        sources.insert(0, out)  # merging again keeps what was merged before
+    records: List[Dict[str, Any]] = []
+    seen = set()
+    for path in sources:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                key = (record["model"], record["task_id"], record["stage"], record.get("ts"))
+                if key not in seen:
+                    seen.add(key)
+                    records.append(record)
+    records.sort(key=lambda r: r.get("ts", 0))
+    Path(out).parent.mkdir(parents=True, exist_ok=True)
+    tmp = f"{out}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(tmp, out)
+    return RunLedger(out).summary()
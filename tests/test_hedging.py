@@ -0,0 +1,147 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : test_hedging.py
+
+"""
+HedgePolicy: retries, deadlines and hedged duplicates, with and without an endpoint limiter.
+The latencies are a few milliseconds, the histogram gets matching buckets.
+"""
+import asyncio
+
+import pytest
+
+from hedging import HedgePolicy, LatencyHistogram, is_retryable_error
+from limiter import EndpointLimiter
+
+
+class _Status(Exception):
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def _fast_policy(**kwargs) -> HedgePolicy:
+    """A policy which hedges after 20ms."""
+    policy = HedgePolicy(backoff=0, min_samples=1, hedge_budget=1.0, **kwargs)
+    policy.histogram.bounds = [0.02]
+    policy.histogram.counts = [0, 0]
+    policy.histogram.observe(0.01)
+    return policy
+
+
+def test_histogram_quantiles():
+    histogram = LatencyHistogram()
+    assert histogram.quantile(0.9) is None
+    for seconds in [0.1] * 8 + [4, 700]:
+        histogram.observe(seconds)
+    assert histogram.quantile(0.5) == 0.5
+    assert histogram.quantile(0.9) == 5
+    assert histogram.quantile(1.0) == float("inf")
+    assert histogram.snapshot()["count"] == 10
+
+
+def test_retryable_errors_follow_the_cause():
+    wrapped = RuntimeError("inference failed")
+    wrapped.__cause__ = _Status(503)
+    assert is_retryable_error(wrapped)
+    assert is_retryable_error(ConnectionResetError())
+    assert not is_retryable_error(_Status(400))
+    assert not is_retryable_error(ValueError())
+
+
+def test_retries_retryable_errors_then_succeeds():
+    policy = HedgePolicy(backoff=0, retries=2, hedge=False)
+    calls = []
+
+    async def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise _Status(429)
+        return "ok"
+
+    assert asyncio.run(policy.call(flaky)) == "ok"
+    assert len(calls) == 3
+    assert policy.stats()["retried"] == 2
+
+
+def test_other_errors_are_raised_at_once():
+    policy = HedgePolicy(backoff=0, retries=2, hedge=False)
+    calls = []
+
+    async def broken():
+        calls.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        asyncio.run(policy.call(broken))
+    assert len(calls) == 1
+
+
+def test_deadline_cancels_the_attempt_and_counts_as_overload():
+    policy = HedgePolicy(deadline=0.02, retries=1, backoff=0, hedge=False)
+    endpoint = EndpointLimiter("test", concurrency=4)
+
+    async def slow():
+        await asyncio.sleep(1)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(policy.call(slow, limiter=endpoint))
+    stats = endpoint.stats()
+    assert (stats["calls"], stats["overloads"], stats["in_flight"]) == (2, 2, 0)
+
+
+def test_hedge_wins_and_the_loser_is_only_cancelled():
+    policy = _fast_policy()
+    endpoint = EndpointLimiter("test", concurrency=4)
+    calls = []
+
+    async def first_slow():
+        calls.append(1)
+        await asyncio.sleep(1 if len(calls) == 1 else 0)
+        return len(calls)
+
+    assert asyncio.run(policy.call(first_slow, limiter=endpoint)) == 2
+    assert (policy.hedged, policy.hedge_wins) == (1, 1)
+    stats = endpoint.stats()
+    assert (stats["calls"], stats["cancelled"], stats["overloads"], stats["in_flight"]) == (2, 1, 0, 0)
+
+
+def test_hedge_is_skipped_without_a_free_slot():
+    policy = _fast_policy()
+    endpoint = EndpointLimiter("test", concurrency=1, max_concurrency=1)
+
+    async def slowish():
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    assert asyncio.run(policy.call(slowish, limiter=endpoint)) == "ok"
+    assert (policy.hedged, policy.hedge_skipped) == (0, 1)
+
+
+def test_the_wait_for_a_slot_is_not_timed():
+    policy = HedgePolicy(deadline=0.05, retries=0, hedge=False)
+    endpoint = EndpointLimiter("test", concurrency=1, max_concurrency=1)
+
+    async def fast():
+        await asyncio.sleep(0.01)
+        return "ok"
+
+    async def run():
+        async def hold():
+            async with endpoint.slot():
+                await asyncio.sleep(0.1)
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        # 排队 0.1s 比 deadline 长，但请求本身只要 0.01s
+        result = await policy.call(fast, limiter=endpoint)
+        await holder
+        return result
+
+    assert asyncio.run(run()) == "ok"
+    assert policy.histogram.total == 1
+    assert policy.histogram.sum < 0.05
@@ -0,0 +1,96 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : test_ledger.py
+
+"""
+Replaying the run ledger: finished cells are skipped, unfinished cells resume at their next stage,
+a torn last line (a crash in the middle of a write) is ignored.
+"""
+import json
+
+from grid import next_stage, pending_cells
+from ledger import RunLedger
+
+
+def _line(model, task_id, stage, data="ok"):
+    return json.dumps({"model": model, "task_id": task_id, "stage": stage, "ts": 0, "data": data}) + "\n"
+
+
+def test_replay_resumes_after_the_last_stage(tmp_path):
+    path = tmp_path / "ledger.jsonl"
+    ledger = RunLedger(str(path))
+    for stage in ("agent", "format", "score", "extract"):
+        ledger.record("m1", "t1", stage, stage)
+    ledger.record("m1", "t2", "agent", "agent")
+    ledger.record("m1", "t2", "error", {"stage": "score", "error": "boom"})
+
+    replayed = RunLedger(str(path))
+    assert replayed.is_done("m1", "t1")
+    assert not replayed.is_done("m1", "t2")
+    assert next_stage(replayed, "m1", "t1") is None
+    assert next_stage(replayed, "m1", "t2") == "format"
+    assert next_stage(replayed, "m2", "t1") == "agent"
+    assert replayed.failed() == {("m1", "t2"): {"stage": "score", "error": "boom"}}
+    assert replayed.summary() == {"agent": 2, "format": 1, "score": 1, "extract": 1, "error": 1}
+
+
+def test_a_later_stage_clears_the_error(tmp_path):
+    path = tmp_path / "ledger.jsonl"
+    ledger = RunLedger(str(path))
+    ledger.record("m1", "t1", "error", {"stage": "agent", "error": "boom"})
+    ledger.record("m1", "t1", "agent", "agent")
+    assert RunLedger(str(path)).failed() == {}
+
+
+def test_torn_and_blank_lines_are_skipped(tmp_path):
+    path = tmp_path / "ledger.jsonl"
+    path.write_text(_line("m1", "t1", "agent") + "\n" + _line("m1", "t1", "format")[:25], encoding="utf-8")
+    ledger = RunLedger(str(path))
+    assert ledger.cell("m1", "t1") == {"agent": "ok"}
+    # 接着写的记录不受那半行影响
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("\n")
+    ledger.record("m1", "t1", "format", "ok")
+    assert RunLedger(str(path)).cell("m1", "t1") == {"agent": "ok", "format": "ok"}
+
+
+def test_bases_are_replayed_and_refreshed_up_to_the_last_full_line(tmp_path):
+    base = tmp_path / "other.jsonl"
+    base.write_text(_line("m1", "t1", "agent"), encoding="utf-8")
+    ledger = RunLedger(str(tmp_path / "mine.jsonl"), bases=[str(base), str(tmp_path / "mine.jsonl")])
+    assert ledger.cell("m1", "t1") == {"agent": "ok"}
+
+    torn = _line("m1", "t1", "format")
+    with open(base, "a", encoding="utf-8") as f:
+        f.write(torn[:20])
+    ledger.refresh()
+    assert ledger.cell("m1", "t1") == {"agent": "ok"}
+    with open(base, "a", encoding="utf-8") as f:
+        f.write(torn[20:])
+    ledger.refresh()
+    assert ledger.cell("m1", "t1") == {"agent": "ok", "format": "ok"}
+
+    # 只往自己的文件里写，base 不动
+    ledger.record("m1", "t2", "agent", "ok")
+    assert "t2" not in base.read_text(encoding="utf-8")
+
+
+def test_pending_cells_skip_finished_and_filter_started(tmp_path):
+    tasks = tmp_path / "tasks"
+    tasks.mkdir()
+    for task_id in ("t1", "t2", "t3"):
+        (tasks / f"{task_id}.md").write_text(task_id, encoding="utf-8")
+    (tasks / ".DS_Store").write_text("", encoding="utf-8")
+    ledger = RunLedger(str(tmp_path / "ledger.jsonl"))
+    for stage in ("agent", "format", "score", "extract"):
+        ledger.record("m1", "t1", stage, "ok")
+    ledger.record("m2", "t2", "agent", "ok")
+
+    assert pending_cells(ledger, ["m1", "m2"], str(tasks)) == [
+        ("m2", "t1"), ("m1", "t2"), ("m2", "t2"), ("m1", "t3"), ("m2", "t3")]
+    assert pending_cells(ledger, ["m1", "m2"], str(tasks), started_only=True) == [("m2", "t2")]
@@ -0,0 +1,151 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : test_limiter.py
+
+"""
+The token buckets and the AIMD concurrency window of the per-endpoint limiter, on a fake clock.
+"""
+import asyncio
+
+import pytest
+
+import limiter
+from limiter import DEADLINE, AdaptiveConcurrency, EndpointLimiter, TokenBucket, is_cancelled, is_overload_error
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(limiter.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(limiter.asyncio, "sleep", clock.sleep)
+    return clock
+
+
+class _Status(Exception):
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def test_bucket_bursts_then_waits_for_the_refill(clock):
+    bucket = TokenBucket(per_minute=60, capacity=2)
+
+    async def take(n):
+        for _ in range(n):
+            await bucket.acquire()
+
+    asyncio.run(take(3))
+    assert clock.slept == [pytest.approx(1.0)]  # 两个 burst，第三个等一秒
+    assert not bucket.available()
+    clock.now += 1
+    assert bucket.available()
+
+
+def test_unlimited_bucket_never_waits(clock):
+    bucket = TokenBucket(per_minute=0)
+    asyncio.run(bucket.acquire(10 ** 9))
+    assert bucket.available(10 ** 9)
+    assert clock.slept == []
+
+
+def test_oversized_request_is_capped_to_the_capacity(clock):
+    bucket = TokenBucket(per_minute=600, capacity=100)
+    asyncio.run(bucket.acquire(10 ** 6))
+    assert clock.slept == []
+    assert bucket.tokens == 0
+
+
+def test_window_halves_on_overload_and_grows_by_one_per_window():
+    window = AdaptiveConcurrency(initial=8, minimum=2, maximum=10)
+
+    async def call(ok, overload):
+        await window.acquire()
+        await window.release(ok=ok, overload=overload)
+
+    asyncio.run(call(False, True))
+    assert window.limit == 4
+    asyncio.run(call(False, True))
+    asyncio.run(call(False, True))
+    assert window.limit == 2  # minimum
+    for _ in range(2):
+        asyncio.run(call(True, False))
+    assert window.limit == pytest.approx(2 + 1 / 2 + 1 / 2.5)
+    for _ in range(200):
+        asyncio.run(call(True, False))
+    assert window.limit == 10  # maximum
+    # 普通的失败不改变窗口
+    asyncio.run(call(False, False))
+    assert window.limit == 10 and window.in_flight == 0
+
+
+def test_window_blocks_above_the_limit_and_try_acquire_does_not_wait():
+    async def run():
+        window = AdaptiveConcurrency(initial=2)
+        await window.acquire()
+        await window.acquire()
+        assert not window.try_acquire()
+        waiter = asyncio.create_task(window.acquire())
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        await window.release(ok=True, overload=False)
+        await asyncio.wait_for(waiter, 1)
+        assert window.in_flight == 2
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("exc, overload, cancelled", [
+    (_Status(429), True, False),
+    (_Status(503), True, False),
+    (_Status(400), False, False),
+    (asyncio.TimeoutError(), True, False),
+    (asyncio.CancelledError(DEADLINE), True, False),
+    (asyncio.CancelledError(), False, True),
+])
+def test_error_classification(exc, overload, cancelled):
+    assert is_overload_error(exc) is overload
+    assert is_cancelled(exc) is cancelled
+
+
+def test_slot_counts_outcomes_and_releases_on_error():
+    endpoint = EndpointLimiter("test", concurrency=4)
+
+    async def run():
+        async with endpoint.slot():
+            pass
+        for exc in (_Status(429), ValueError("bad"), asyncio.CancelledError()):
+            with pytest.raises(type(exc)):
+                async with endpoint.slot():
+                    raise exc
+
+    asyncio.run(run())
+    stats = endpoint.stats()
+    assert (stats["calls"], stats["overloads"], stats["failures"], stats["cancelled"]) == (4, 1, 1, 1)
+    assert stats["in_flight"] == 0
+    assert stats["concurrency"] < 4
+
+
+def test_try_acquire_takes_from_every_bucket(clock):
+    endpoint = EndpointLimiter("test", rpm=60, tpm=600, concurrency=4)
+    endpoint.requests.capacity = endpoint.requests.tokens = 1
+    assert endpoint.try_acquire(tokens=100)
+    assert endpoint.tokens.tokens == 500
+    assert not endpoint.try_acquire(tokens=100)  # 没有请求额度了
+    assert endpoint.window.in_flight == 1
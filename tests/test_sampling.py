@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : test_sampling.py
+
+"""
+The Student-t quantile and the stopping rule of the sequential multi-sample judge.
+"""
+import asyncio
+
+import pytest
+
+from sampling import SequentialSampler, t_quantile
+from score_parser import render_score
+
+
+def _score(final: int) -> str:
+    """A valid score string with the given FinalScore (result 20, the rest spread over the dimensions)."""
+    processer = final - 20
+    dims = [processer // 4 + (1 if i < processer % 4 else 0) for i in range(4)]
+    data = {"language": "EN", "final_score": final, "result_score": 20, "processer_score": processer}
+    for part, value in zip(("reasoning", "tool_usage", "error_handling", "planning"), dims):
+        data[f"{part}_score"] = value
+    for part in ("result", "processer", "reasoning", "tool_usage", "error_handling", "planning"):
+        data[f"{part}_reason"] = "ok"
+    return render_score(data, "0001")
+
+
+def _draws(finals):
+    """draw(i) returns the i-th final score, None for an unparsable answer, an exception is raised."""
+    async def draw(i):
+        value = finals[i]
+        if isinstance(value, Exception):
+            raise value
+        return "no score here" if value is None else _score(value)
+    return draw
+
+
+@pytest.mark.parametrize("confidence, df, expected", [
+    (0.95, 1, 12.706),
+    (0.95, 2, 4.303),
+    (0.95, 5, 2.571),
+    (0.95, 30, 2.042),
+    (0.99, 3, 5.841),
+    (0.90, 10, 1.812),
+])
+def test_t_quantile_matches_the_tables(confidence, df, expected):
+    assert t_quantile(confidence, df) == pytest.approx(expected, abs=1e-3)
+
+
+def test_stops_as_soon_as_the_ci_is_narrow():
+    sampler = SequentialSampler(ci_width=5, round_size=2, min_samples=2, max_samples=8)
+    result = asyncio.run(sampler.run(_draws([70, 70, 71, 70, 90, 90, 90, 90])))
+    # 前两个一样的分不算收敛，第二轮之后 CI 足够窄
+    assert result["stop"] == "converged"
+    assert result["n"] == 4
+    assert result["finals"] == [70, 70, 71, 70]
+    assert result["mean"] == 70.25
+
+
+def test_noisy_scores_run_to_the_cap():
+    sampler = SequentialSampler(ci_width=5, round_size=3, min_samples=2, max_samples=5)
+    result = asyncio.run(sampler.run(_draws([40, 90, 60, 80, 50])))
+    assert result["stop"] == "max_samples"
+    assert result["n"] == 5
+    # 代表样本是离均值（64）最近的那一次
+    assert "FinalScore: 60" in result["score"]
+    assert sampler.stats()["sample_counts"] == {5: 1}
+
+
+def test_unparsable_samples_count_but_are_not_scored():
+    sampler = SequentialSampler(ci_width=5, round_size=2, min_samples=2, max_samples=4)
+    result = asyncio.run(sampler.run(_draws([None, None, None, None])))
+    assert result["stop"] == "unparsable"
+    assert (result["n"], result["valid"]) == (4, 0)
+    assert sampler.stats()["invalid"] == 4
+
+
+def test_failed_draws_are_dropped():
+    sampler = SequentialSampler(ci_width=5, round_size=2, min_samples=2, max_samples=6)
+    error = RuntimeError("upstream 500")
+    result = asyncio.run(sampler.run(_draws([error, 70, 70, 71, 90, 90])))
+    assert result["stop"] == "converged"
+    assert (result["n"], result["failed"]) == (3, 1)
+    assert result["finals"] == [70, 70, 71]
+    assert sampler.stats()["failed"] == 1
+    assert sampler.stats()["draws"] == 4
+
+
+def test_too_few_samples_raise_the_first_error():
+    sampler = SequentialSampler(ci_width=5, round_size=2, min_samples=2, max_samples=4)
+    first = RuntimeError("first")
+    with pytest.raises(RuntimeError, match="first"):
+        asyncio.run(sampler.run(_draws([first, RuntimeError("second"), RuntimeError("third"), 70])))
+    assert sampler.stats()["failed"] == 3
+    assert sampler.stats()["cells"] == 0
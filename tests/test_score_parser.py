@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : test_score_parser.py
+
+"""
+The local `<score>` parser and the structured-output validator share the same rules.
+"""
+import pytest
+
+from score_parser import ScoreParseError, ScoreParser, parse_score, render_score, validate_score_json
+
+SCORE_TEXT = """```
+<meta>
+TaskID: 0001
+Language: EN
+</meta>
+<score>
+<score_from_results>
+Result Score: 15 / 20
+Reason: The coefficient is right,
+the standard errors are not clustered.
+</score_from_results>
+<score_from_processer>
+Processer Score: 50 / 80
+Reason: Reasonable steps.
+<detail>
+<agent_reasoning>
+Score: 14 / 20
+Reason: Clear.
+</agent_reasoning>
+<tool_usage>
+Score: 12 / 20
+Reason: One wasted call.
+</tool_usage>
+<error_handling>
+Score: 10 / 20
+Reason: Ignored a warning.
+</error_handling>
+<planning>
+Score: 14 / 20
+Reason: Good plan.
+</planning>
+</detail>
+</score_from_processer>
+<final_score>
+FinalScore: 65 = 15 + 50
+</final_score>
+</score>
+```"""
+
+
+def _json(**overrides):
+    data = {"language": "EN", "final_score": 65, "result_score": 15, "processer_score": 50,
+            "reasoning_score": 14, "tool_usage_score": 12, "error_handling_score": 10, "planning_score": 14}
+    for part in ("result", "processer", "reasoning", "tool_usage", "error_handling", "planning"):
+        data[f"{part}_reason"] = f"{part} reason"
+    data.update(overrides)
+    return data
+
+
+def test_parse_gives_the_values_with_their_offsets():
+    values = {name: SCORE_TEXT[start:end] for name, start, end in parse_score(SCORE_TEXT)}
+    assert values["task_id"] == "0001"
+    assert values["language"] == "EN"
+    assert values["final_score"] == "65"
+    assert values["processer_score"] == "50"
+    assert values["planning_score"] == "14"
+    assert values["result_reason"] == "The coefficient is right,\nthe standard errors are not clustered."
+
+
+def test_streaming_in_small_chunks_gives_the_same_records():
+    parser = ScoreParser()
+    for i in range(0, len(SCORE_TEXT), 7):
+        parser.feed(SCORE_TEXT[i:i + 7])
+    assert parser.close() == parse_score(SCORE_TEXT)
+    assert parser.scores["final"] == 65
+
+
+def test_first_value_wins_when_repeated():
+    text = SCORE_TEXT.replace("TaskID: 0001", "TaskID: 0001\nTaskID: 9999")
+    values = {name: text[start:end] for name, start, end in parse_score(text)}
+    assert values["task_id"] == "0001"
+
+
+@pytest.mark.parametrize("old, new, message", [
+    ("Language: EN\n", "", "missing: language"),
+    ("Score: 12 / 20", "Score: 13 / 20", "do not sum"),
+    ("FinalScore: 65 = 15 + 50", "FinalScore: 66 = 15 + 50", "not result \\+ processer"),
+    ("Result Score: 15 / 20", "Result Score: 25 / 20", "out of range"),
+])
+def test_parse_rejects_broken_scores(old, new, message):
+    with pytest.raises(ScoreParseError, match=message):
+        parse_score(SCORE_TEXT.replace(old, new, 1))
+
+
+def test_validate_score_json_accepts_consistent_scores():
+    data = _json()
+    assert validate_score_json(data) is data
+
+
+@pytest.mark.parametrize("data, message", [
+    ([], "not a JSON object"),
+    ({k: v for k, v in _json().items() if k != "planning_reason"}, "missing: planning_reason"),
+    (_json(result_score="15"), "result_score is not an integer"),
+    (_json(result_score=True), "result_score is not an integer"),
+    (_json(result_score=21, final_score=71), "out of range"),
+    (_json(tool_usage_reason="  "), "empty tool_usage_reason"),
+    (_json(planning_score=15), "do not sum"),
+    (_json(final_score=64), "not result \\+ processer"),
+])
+def test_validate_score_json_rejects(data, message):
+    with pytest.raises(ScoreParseError, match=message):
+        validate_score_json(data)
+
+
+def test_rendered_json_parses_back_to_the_same_scores():
+    parser = ScoreParser()
+    parser.feed(render_score(_json(result_reason="two\nlines"), "0001"))
+    parser.close()
+    assert parser.scores == {"result": 15, "processer": 50, "reasoning": 14, "tool_usage": 12,
+                             "error_handling": 10, "planning": 14, "final": 65}
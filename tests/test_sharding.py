@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : test_sharding.py
+
+"""
+Static shards, the SQLite work queue (claims, lease expiry, retries) and merging the worker ledgers.
+"""
+import json
+import threading
+
+import pytest
+
+import sharding
+from ledger import RunLedger
+from sharding import WorkQueue, in_shard, merge_ledgers, parse_shard, shard_of
+
+CELLS = [(f"model-{m}", f"{t:04d}") for m in range(3) for t in range(40)]
+
+
+def test_parse_shard():
+    assert parse_shard("2/8") == (2, 8)
+    for bad in ("8/8", "-1/2", "1/0"):
+        with pytest.raises(ValueError):
+            parse_shard(bad)
+
+
+def test_shards_are_stable_and_disjoint():
+    # 固定的值：换了进程、换了机器都一样
+    assert shard_of("deepseek/deepseek-chat-v3.1:free", "0001", 8) == 6
+    assert shard_of("m", "t", 1000) == 192
+    items = [{"model": m, "task_id": t} for m, t in CELLS]
+    parts = [list(in_shard(items, i, 4)) for i in range(4)]
+    assert sorted(sum(parts, []), key=lambda item: (item["model"], item["task_id"])) == items
+    assert all(parts)
+
+
+def test_two_workers_never_claim_the_same_cell(tmp_path):
+    path = str(tmp_path / "queue.sqlite")
+    WorkQueue(path).seed(CELLS)
+    claimed = {}
+
+    def work(worker_id):
+        queue = WorkQueue(path, worker_id=worker_id)
+        mine = claimed.setdefault(worker_id, [])
+        while (cell := queue.claim()) is not None:
+            mine.append(cell)
+            queue.complete(*cell)
+        queue.close()
+
+    threads = [threading.Thread(target=work, args=(f"w{i}",)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    everything = sum(claimed.values(), [])
+    assert sorted(everything) == sorted(CELLS)
+    assert WorkQueue(path).stats()["done"] == len(CELLS)
+
+
+def test_seed_keeps_the_state_of_known_cells(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"))
+    assert queue.seed(CELLS[:2]) == 2
+    queue.complete(*queue.claim())
+    assert queue.seed(CELLS[:3]) == 1
+    assert queue.stats()["done"] == 1
+
+
+def test_an_expired_lease_goes_to_another_worker(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(sharding.time, "time", lambda: now[0])
+    path = str(tmp_path / "queue.sqlite")
+    crashed = WorkQueue(path, worker_id="crashed", lease_seconds=60)
+    crashed.seed(CELLS[:1])
+    assert crashed.claim() == CELLS[0]
+
+    other = WorkQueue(path, worker_id="other", lease_seconds=60)
+    assert other.claim() is None
+    now[0] += 30
+    crashed.renew()
+    now[0] += 45
+    assert other.claim() is None  # 续过租，还没过期
+    now[0] += 30
+    assert other.claim() == CELLS[0]
+    assert other.stats()["leased"] == 1
+
+
+def test_failed_cells_are_retried_then_given_up(tmp_path):
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"), max_attempts=2)
+    queue.seed(CELLS[:1])
+    queue.fail(*queue.claim(), "boom")
+    assert queue.stats()["pending"] == 1
+    queue.fail(*queue.claim(), "boom")
+    assert queue.claim() is None
+    assert queue.stats()["failed"] == 1
+
+
+def test_reconcile_settles_the_held_cells_from_the_ledger(tmp_path):
+    ledger = RunLedger(str(tmp_path / "ledger.jsonl"))
+    queue = WorkQueue(str(tmp_path / "queue.sqlite"))
+    queue.seed(CELLS[:3])
+    done, failed, _ = (queue.claim(ledger) for _ in range(3))
+    for stage in ("agent", "format", "score", "extract"):
+        ledger.record(*done, stage, "ok")
+    ledger.record(*failed, "error", {"stage": "agent", "error": "boom"})
+
+    queue.reconcile(ledger)
+    assert queue.stats() == {"pending": 1, "leased": 1, "done": 1, "failed": 0, "held": 1}
+    queue.reconcile(ledger, release=True)
+    assert queue.stats() == {"pending": 2, "leased": 0, "done": 1, "failed": 0, "held": 0}
+
+
+def test_merge_ledgers_joins_in_time_order_and_is_idempotent(tmp_path):
+    def write(path, records):
+        with open(path, "w", encoding="utf-8") as f:
+            for model, task_id, stage, ts in records:
+                f.write(json.dumps({"model": model, "task_id": task_id, "stage": stage, "ts": ts, "data": ts}) + "\n")
+
+    a, b, out = tmp_path / "ledger.a.jsonl", tmp_path / "ledger.b.jsonl", tmp_path / "merged" / "ledger.jsonl"
+    write(a, [("m1", "t1", "agent", 1), ("m1", "t1", "error", 3)])
+    write(b, [("m1", "t1", "agent", 2), ("m2", "t1", "agent", 4)])
+    with open(b, "a", encoding="utf-8") as f:
+        f.write('{"model": "m2", "task_id": "t1", "sta')
+
+    summary = merge_ledgers([str(a), str(b)], str(out))
+    assert summary["agent"] == 2 and summary["error"] == 1
+    lines = out.read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line)["ts"] for line in lines] == [1, 2, 3, 4]
+
+    # 再合并一次（包括已经合并的文件本身）不会重复记录
+    merge_ledgers([str(a), str(b), str(out)], str(out))
+    assert out.read_text(encoding="utf-8").splitlines() == lines
+    assert RunLedger(str(out)).failed() == {("m1", "t1"): 3}
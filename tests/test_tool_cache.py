@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : test_tool_cache.py
+
+"""
+The memoizing MCP tool proxy: which tools are cached, TTL, LRU, file stamps and in-flight sharing.
+"""
+import asyncio
+
+import pytest
+from langchain_core.tools import StructuredTool
+
+import tool_cache as tool_cache_module
+from tool_cache import ToolCache
+
+
+def _tool(name="get_data_info", delay=0.0, metadata=None, fail=None):
+    calls = []
+
+    async def run(path: str) -> str:
+        calls.append(path)
+        await asyncio.sleep(delay)
+        if fail is not None:
+            raise fail
+        return f"{path}#{len(calls)}"
+
+    tool = StructuredTool.from_function(coroutine=run, name=name, description="test tool", metadata=metadata)
+    return tool, calls
+
+
+def _call(tool, path):
+    return asyncio.run(tool.ainvoke({"path": path}))
+
+
+def test_only_idempotent_or_listed_tools_are_wrapped():
+    cache = ToolCache(tools={"get_data_info"}, never={"read_only_but_never"})
+    listed, _ = _tool("get_data_info")
+    hinted, _ = _tool("describe", metadata={"readOnlyHint": True})
+    never, _ = _tool("read_only_but_never", metadata={"readOnlyHint": True})
+    plain, _ = _tool("run_do_file")
+    wrapped = cache.wrap([listed, hinted, never, plain])
+    assert wrapped[0] is not listed and wrapped[1] is not hinted
+    assert wrapped[2] is never and wrapped[3] is plain
+    assert ToolCache(tools={"get_data_info"}, bypass=True).wrap([listed])[0] is listed
+
+
+def test_hit_until_the_ttl_runs_out(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(tool_cache_module.time, "monotonic", lambda: now[0])
+    cache = ToolCache(ttl=10, tools={"get_data_info"})
+    tool, calls = _tool()
+    [wrapped] = cache.wrap([tool])
+
+    assert _call(wrapped, "a.dta") == "a.dta#1"
+    assert _call(wrapped, "a.dta") == "a.dta#1"
+    now[0] += 11
+    assert _call(wrapped, "a.dta") == "a.dta#2"
+    assert len(calls) == 2
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ToolCache(max_entries=2, tools={"get_data_info"})
+    tool, calls = _tool()
+    [wrapped] = cache.wrap([tool])
+    for path in ("a", "b", "a", "c", "a", "b"):
+        _call(wrapped, path)
+    # c 挤掉了 b，a 一直在用所以留下
+    assert calls == ["a", "b", "c", "b"]
+    assert cache.stats()["evictions"] == 2
+
+
+def test_an_edited_file_is_read_again(tmp_path):
+    data = tmp_path / "data.csv"
+    data.write_text("x\n1\n", encoding="utf-8")
+    cache = ToolCache(tools={"get_data_info"})
+    tool, calls = _tool()
+    [wrapped] = cache.wrap([tool])
+    _call(wrapped, str(data))
+    _call(wrapped, str(data))
+    data.write_text("x\n1\n2\n", encoding="utf-8")
+    _call(wrapped, str(data))
+    assert len(calls) == 2
+
+
+def test_identical_calls_in_flight_share_one_round_trip():
+    cache = ToolCache(tools={"get_data_info"})
+    tool, calls = _tool(delay=0.02)
+    [wrapped] = cache.wrap([tool])
+
+    async def run():
+        return await asyncio.gather(*(wrapped.ainvoke({"path": "a"}) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["a#1"] * 5
+    assert len(calls) == 1
+    assert (cache.misses, cache.shared) == (1, 4)
+
+
+def test_errors_are_shared_but_not_cached():
+    cache = ToolCache(tools={"get_data_info"})
+    tool, calls = _tool(delay=0.02, fail=RuntimeError("server down"))
+    [wrapped] = cache.wrap([tool])
+
+    async def run():
+        return await asyncio.gather(*(wrapped.coroutine(path="a") for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(r, RuntimeError) for r in asyncio.run(run()))
+    assert len(calls) == 1
+    with pytest.raises(RuntimeError):
+        asyncio.run(wrapped.coroutine(path="a"))
+    assert len(calls) == 2
+    assert cache.stats()["entries"] == 0
+
+
+def test_a_cancelled_leader_does_not_cancel_the_followers():
+    cache = ToolCache(tools={"get_data_info"})
+    tool, calls = _tool(delay=0.02)
+    [wrapped] = cache.wrap([tool])
+
+    async def run():
+        leader = asyncio.create_task(wrapped.coroutine(path="a"))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(wrapped.coroutine(path="a"))
+        await asyncio.sleep(0)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(run()) == "a#2"
+    assert len(calls) == 2
@@ -0,0 +1,195 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : test_utils.py
+
+"""
+ResortBuilder must give the same {"processer", "result"} as the list based resort_ai_msg it replaced.
+`baseline_resort_ai_msg` is that implementation, copied verbatim from the first commit; it has no
+compactor and no stop_reason. `reference_resort` extends the same slicing with those two, it is the
+spec of the compacted / stopped transcripts and is itself checked against the baseline without them.
+Both are compared with ResortBuilder on randomized transcripts.
+"""
+import random
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytest
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+
+from utils import ResortBuilder, TranscriptCompactor, _stringify, resort_ai_msg
+
+
+def baseline_resort_ai_msg(messages: List[BaseMessage]) -> Dict[str, str]:
+    """
+    Make the AI_Message change to AI-Agent's processer and result
+    """
+
+    def _stringify(content: Any) -> str:
+        # LangChain content 可能是 str / list[dict|str] / None
+        if content is None:
+            return ""
+        if isinstance(content, str):
+            return content
+        if isinstance(content, list):
+            parts = []
+            for it in content:
+                if isinstance(it, str):
+                    parts.append(it)
+                elif isinstance(it, dict):
+                    # 尽量抽取常见字段
+                    for k in ("text", "content", "output", "result", "message"):
+                        v = it.get(k)
+                        if isinstance(v, str):
+                            parts.append(v)
+                            break
+                    else:
+                        parts.append(str(it))
+                else:
+                    parts.append(str(it))
+            return "\n".join(p for p in parts if p)
+        # 兜底
+        return str(content)
+
+    # 找到最后一个 AI 消息，作为 result
+    last_ai_idx = None
+    for i in range(len(messages) - 1, -1, -1):
+        if getattr(messages[i], "type", None) == "ai":
+            last_ai_idx = i
+            break
+
+    # 过程部分：不包含最后一个 AI 消息
+    process_slice = messages[:last_ai_idx] if last_ai_idx is not None else messages
+
+    lines: List[str] = []
+    for m in process_slice:
+        mtype = getattr(m, "type", "")
+        if mtype == "system":
+            continue  # 忽略 system
+        if mtype == "human":
+            header = "# Human MSG"
+        elif mtype == "ai":
+            header = "# AI MSG"
+        elif mtype in ("tool", "function"):
+            header = "# Tool MSG"
+        else:
+            # 其他类型忽略，避免破坏格式
+            continue
+
+        body = _stringify(getattr(m, "content", ""))
+        # 保证都是 str
+        body = "" if body is None else str(body)
+        lines.append(f"{header}\n{body}".rstrip())
+
+    processer_str = "\n".join(lines).strip()
+
+    # 结果部分：最后一个 AI 的文本
+    result_str = ""
+    if last_ai_idx is not None:
+        result_str = _stringify(getattr(messages[last_ai_idx], "content", "")).strip()
+
+    return {
+        "processer": processer_str,
+        "result": result_str,
+    }
+
+
+def reference_resort(messages: List[BaseMessage],
+                     compactor: Optional[TranscriptCompactor] = None,
+                     stop_reason: Optional[str] = None) -> Dict[str, str]:
+    # 最后一个 AI 消息是 result，它以及它之后的消息都不进 processer
+    last_ai_idx = None
+    for i in range(len(messages) - 1, -1, -1):
+        if getattr(messages[i], "type", None) == "ai":
+            last_ai_idx = i
+            break
+    process_slice = messages[:last_ai_idx] if last_ai_idx is not None else messages
+
+    headers = {"human": "# Human MSG", "ai": "# AI MSG", "tool": "# Tool MSG", "function": "# Tool MSG"}
+    entries: List[Tuple[str, str]] = []
+    for m in process_slice:
+        header = headers.get(getattr(m, "type", ""))
+        if header is not None:
+            entries.append((header, _stringify(getattr(m, "content", ""))))
+
+    if compactor is not None:
+        entries = compactor.compact(entries)
+    if stop_reason and stop_reason != "completed":
+        entries.append(("# Note", f"The agent run was stopped by the {stop_reason} budget before it finished, "
+                                  f"the transcript is partial."))
+    formatted = {
+        "processer": "\n".join(f"{header}\n{body}".rstrip() for header, body in entries).strip(),
+        "result": _stringify(messages[last_ai_idx].content).strip() if last_ai_idx is not None else "",
+    }
+    if stop_reason:
+        formatted["stop_reason"] = stop_reason
+    return formatted
+
+
+def _content(rng: random.Random):
+    words = ["reg y x", "  ", "", "error: file not found", "done\n", "结果", "coef 0.42"]
+    kind = rng.random()
+    if kind < 0.6:
+        return rng.choice(words) * rng.randint(1, 3)
+    if kind < 0.8:
+        return [rng.choice([{"text": rng.choice(words)}, {"type": "image"}, rng.choice(words)])
+                for _ in range(rng.randint(0, 3))]
+    # 很长的工具输出，让 compactor 真的去截断
+    return "line of output\n" * rng.randint(50, 400)
+
+
+def _transcript(rng: random.Random) -> List[BaseMessage]:
+    messages: List[BaseMessage] = []
+    for i in range(rng.randint(0, 20)):
+        kind = rng.choice(["system", "human", "ai", "ai", "tool", "tool"])
+        if kind == "system":
+            messages.append(SystemMessage(content=_content(rng)))
+        elif kind == "human":
+            messages.append(HumanMessage(content=_content(rng)))
+        elif kind == "ai":
+            messages.append(AIMessage(content=_content(rng)))
+        else:
+            messages.append(ToolMessage(content=_content(rng), tool_call_id=f"call_{i}"))
+        if rng.random() < 0.15 and messages:
+            messages.append(messages[-1])  # 重复的消息，collapse 要处理
+    return messages
+
+
+@pytest.mark.parametrize("seed", range(300))
+def test_resort_builder_matches_the_baseline(seed):
+    messages = _transcript(random.Random(seed))
+    expected = baseline_resort_ai_msg(messages)
+    assert reference_resort(messages) == expected
+
+    builder = ResortBuilder()
+    for m in messages:
+        builder.add(m)
+    assert builder.finish() == expected
+
+
+@pytest.mark.parametrize("seed", range(300))
+def test_resort_builder_matches_reference(seed):
+    rng = random.Random(seed)
+    messages = _transcript(rng)
+    stop_reason = rng.choice([None, "completed", "timeout", "max_steps"])
+    compactor = TranscriptCompactor(token_budget=rng.choice([200, 2000, 24000]),
+                                    max_tool_tokens=100, min_tool_tokens=20) if rng.random() < 0.5 else None
+    expected = reference_resort(messages, compactor, stop_reason)
+
+    builder = ResortBuilder()
+    for m in messages:
+        builder.add(m)
+    if compactor is not None:
+        compactor = TranscriptCompactor(compactor.token_budget, compactor.max_tool_tokens, compactor.min_tool_tokens)
+    assert builder.finish(compactor, stop_reason) == expected
+    assert builder.count == len(messages)
+
+
+def test_resort_ai_msg_accepts_a_generator():
+    messages = [HumanMessage(content="task"), AIMessage(content="step"), ToolMessage(content="out", tool_call_id="1"),
+                AIMessage(content=" answer "), ToolMessage(content="late", tool_call_id="2")]
+    assert resort_ai_msg(iter(messages)) == baseline_resort_ai_msg(messages)
+    assert resort_ai_msg(messages)["result"] == "answer"
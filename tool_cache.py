@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : tool_cache.py
+
+"""
+A memoizing proxy in front of the MCP tools.
+
+Agents call the same read-only tools with the same arguments again and again (describe the same
+dataset, look for the same file), within one run and across models. The results of idempotent tools
+are kept in a process-wide TTL + LRU store shared by every cell, keyed by tool name + arguments +
+the mtime and size of every existing file an argument points to, so an edited file is read again.
+Concurrent identical calls share one round trip.
+
+A tool is cached when the server marks it `readOnlyHint` / `idempotentHint`, or when it is listed in
+MCP_CACHE_TOOLS; MCP_NO_CACHE_TOOLS overrides both.
+
+Environment:
+    MCP_CACHE_TOOLS      comma separated tool names, default "get_data_info"
+    MCP_NO_CACHE_TOOLS   comma separated tool names never cached
+    MCP_CACHE_TTL        seconds, default 3600
+    MCP_CACHE_SIZE       max entries, default 2048
+    MCP_CACHE_BYPASS     "1" turns the proxy off
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from langchain_core.tools import BaseTool
+
+
+def _names(value: str) -> Set[str]:
+    return {name.strip() for name in value.split(",") if name.strip()}
+
+
+def _file_stamps(value: Any, out: List[Tuple[str, int, int]]) -> None:
+    if isinstance(value, str):
+        if 0 < len(value) < 4096 and os.path.isfile(value):
+            st = os.stat(value)
+            out.append((os.path.abspath(value), st.st_mtime_ns, st.st_size))
+    elif isinstance(value, dict):
+        for v in value.values():
+            _file_stamps(v, out)
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            _file_stamps(v, out)
+
+
+class ToolCache:
+    def __init__(self,
+                 ttl: float = 3600,
+                 max_entries: int = 2048,
+                 tools: Optional[Set[str]] = None,
+                 never: Optional[Set[str]] = None,
+                 bypass: bool = False):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.tools = tools or set()
+        self.never = never or set()
+        self.bypass = bypass
+        self._store: "OrderedDict[str, Tuple[float, float, Any]]" = OrderedDict()  # key -> (expires, latency, result)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0  # calls which waited for an identical call in flight
+        self.evictions = 0
+        self.saved_seconds = 0.0
+        self.per_tool: Dict[str, Dict[str, int]] = {}
+
+    def cacheable(self, tool: BaseTool) -> bool:
+        if self.bypass or tool.name in self.never:
+            return False
+        hints = tool.metadata or {}
+        return tool.name in self.tools or bool(hints.get("readOnlyHint") or hints.get("idempotentHint"))
+
+    @staticmethod
+    def make_key(name: str, arguments: Dict[str, Any]) -> str:
+        stamps: List[Tuple[str, int, int]] = []
+        _file_stamps(arguments, stamps)
+        payload = json.dumps({"tool": name, "args": arguments, "files": stamps},
+                             ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _count(self, name: str, field: str) -> None:
+        counts = self.per_tool.setdefault(name, {"hits": 0, "misses": 0})
+        counts[field] += 1
+
+    def _get(self, key: str) -> Optional[Tuple[float, Any]]:
+        entry = self._store.get(key)
+        if entry is None:
+            return None
+        expires, latency, result = entry
+        if expires < time.monotonic():
+            del self._store[key]
+            return None
+        self._store.move_to_end(key)
+        return latency, result
+
+    def _set(self, key: str, latency: float, result: Any) -> None:
+        self._store[key] = (time.monotonic() + self.ttl, latency, result)
+        self._store.move_to_end(key)
+        while len(self._store) > self.max_entries:
+            self._store.popitem(last=False)
+            self.evictions += 1
+
+    def wrap(self, tools: List[BaseTool]) -> List[BaseTool]:
+        """Copies of the tools whose coroutine goes through the cache; the others are returned as they are."""
+        return [self._wrap(tool) if self.cacheable(tool) and getattr(tool, "coroutine", None) else tool
+                for tool in tools]
+
+    def _wrap(self, tool: BaseTool) -> BaseTool:
+        call = tool.coroutine
+        name = tool.name
+
+        async def cached_call(**kwargs: Any) -> Any:
+            # runtime 之类注入的参数不算进 key
+            arguments = {k: v for k, v in kwargs.items() if k != "runtime"}
+            key = self.make_key(name, arguments)
+            hit = self._get(key)
+            if hit is not None:
+                self.hits += 1
+                self.saved_seconds += hit[0]
+                self._count(name, "hits")
+                return hit[1]
+            if key in self._inflight:
+                self.shared += 1
+                self._count(name, "hits")
+                leader = self._inflight[key]
+                try:
+                    return await asyncio.shield(leader)
+                except asyncio.CancelledError:
+                    # 只是领头的调用被取消了（比如那个 agent 超时），自己再调一次
+                    if not leader.cancelled() or asyncio.current_task().cancelling():
+                        raise
+                    return await call(**kwargs)
+            self.misses += 1
+            self._count(name, "misses")
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[key] = future
+            start = time.perf_counter()
+            try:
+                result = await call(**kwargs)
+            except asyncio.CancelledError:
+                future.cancel()
+                raise
+            except Exception as e:
+                # 失败的调用不缓存，等着的调用拿到同一个异常
+                future.set_exception(e)
+                future.exception()  # mark it retrieved when nobody waits
+                raise
+            else:
+                self._set(key, time.perf_counter() - start, result)
+                future.set_result(result)
+                return result
+            finally:
+                self._inflight.pop(key, None)
+
+        return tool.model_copy(update={"coroutine": cached_call})
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.shared + self.misses
+        return {
+            "hits": self.hits,
+            "shared": self.shared,
+            "misses": self.misses,
+            "hit_rate": round((self.hits + self.shared) / total, 4) if total else 0.0,
+            "saved_seconds": round(self.saved_seconds, 3),
+            "entries": len(self._store),
+            "evictions": self.evictions,
+            "per_tool": self.per_tool,
+            "bypass": self.bypass,
+        }
+
+    @classmethod
+    def from_env(cls) -> "ToolCache":
+        return cls(
+            ttl=float(os.getenv("MCP_CACHE_TTL", "3600")),
+            max_entries=int(os.getenv("MCP_CACHE_SIZE", "2048")),
+            tools=_names(os.getenv("MCP_CACHE_TOOLS", "get_data_info")),
+            never=_names(os.getenv("MCP_NO_CACHE_TOOLS", "")),
+            bypass=os.getenv("MCP_CACHE_BYPASS", "").lower() in ("1", "true", "yes"),
+        )
+
+
+tool_cache = ToolCache.from_env()
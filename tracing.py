@@ -0,0 +1,310 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : tracing.py
+
+"""
+Structured spans, token / cost accounting and event-loop stall detection.
+
+    with tracer.span("judge.advice", kind="positive") as sp:
+        ...
+        sp.add_usage(model_name, resp.usage)
+
+Every finished span is one line of the JSONL trace file, and the aggregated metrics are written as a
+Prometheus text-format snapshot. `LoopWatchdog` runs a thread which notices when the event loop has
+not ticked for a while and records the stack of the blocking call.
+
+Environment:
+    TRACE_PATH        the JSONL trace file (default: ./traces/trace.jsonl), empty to disable
+    TRACE_PROM_PATH   the Prometheus snapshot (default: ./traces/metrics.prom)
+    LLM_PRICES        json {"model": [input, cached_input, output]} in USD per 1M tokens, merged into PRICES
+"""
+import asyncio
+import bisect
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from usage import cached_tokens
+
+# USD per 1M tokens: (input, cached input, output)
+PRICES: Dict[str, List[float]] = {
+    "deepseek-chat": [0.27, 0.07, 1.10],
+    "deepseek-reasoner": [0.55, 0.14, 2.19],
+}
+PRICES.update(json.loads(os.getenv("LLM_PRICES", "{}")))
+
+
+def estimate_cost(model: str, prompt: int, cached: int, completion: int) -> float:
+    price = PRICES.get(model) or PRICES.get(model.split("/")[-1])
+    if price is None:
+        return 0.0
+    return ((prompt - cached) * price[0] + cached * price[1] + completion * price[2]) / 1_000_000
+
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    def __init__(self, tracer: "Tracer", name: str, attrs: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.span_id = uuid.uuid4().hex[:16]
+        parent = _current_span.get()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self.duration: Optional[float] = None
+
+    def set(self, **attrs: Any) -> None:
+        self.attrs.update(attrs)
+
+    def add_usage(self, model: str, usage: Any) -> None:
+        """Add the token usage of one LLM response (OpenAI usage object, dict or LangChain usage_metadata)."""
+        if usage is None:
+            return
+        get = usage.get if isinstance(usage, dict) else lambda k: getattr(usage, k, None)
+        prompt = int(get("prompt_tokens") or get("input_tokens") or 0)
+        completion = int(get("completion_tokens") or get("output_tokens") or 0)
+        cached = cached_tokens(usage)
+        if not cached and isinstance(usage, dict):
+            cached = int((usage.get("input_token_details") or {}).get("cache_read") or 0)
+        cost = estimate_cost(model, prompt, cached, completion)
+
+        self.attrs["model"] = model
+        for key, value in (("prompt_tokens", prompt), ("completion_tokens", completion),
+                           ("cached_tokens", cached), ("cost_usd", cost)):
+            self.attrs[key] = self.attrs.get(key, 0) + value
+        self.tracer.metrics.add_tokens(model, prompt, cached, completion, cost)
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._t0
+        if error is not None:
+            self.attrs["error"] = repr(error)
+        self.tracer._finish(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "type": "span",
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration": round(self.duration, 6) if self.duration is not None else None,
+            **self.attrs,
+        }
+
+
+class Metrics:
+    """Aggregated metrics, rendered in the Prometheus text format."""
+    buckets = [0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200]
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.spans: Dict[str, Dict[str, Any]] = {}
+        self.tokens: Dict[str, Dict[str, float]] = {}
+        self.stalls = 0
+        self.stall_max = 0.0
+
+    def observe(self, name: str, seconds: float, error: bool) -> None:
+        with self._lock:
+            row = self.spans.setdefault(name, {
+                "count": 0, "sum": 0.0, "errors": 0, "buckets": [0] * len(self.buckets),
+            })
+            row["count"] += 1
+            row["sum"] += seconds
+            row["errors"] += int(error)
+            idx = bisect.bisect_left(self.buckets, seconds)
+            if idx < len(self.buckets):
+                row["buckets"][idx] += 1
+
+    def add_tokens(self, model: str, prompt: int, cached: int, completion: int, cost: float) -> None:
+        with self._lock:
+            row = self.tokens.setdefault(model, {"prompt": 0, "cached": 0, "completion": 0, "cost": 0.0})
+            row["prompt"] += prompt
+            row["cached"] += cached
+            row["completion"] += completion
+            row["cost"] += cost
+
+    def stall(self, seconds: float) -> None:
+        with self._lock:
+            self.stalls += 1
+            self.stall_max = max(self.stall_max, seconds)
+
+    def render(self) -> str:
+        lines = ["# TYPE span_duration_seconds histogram"]
+        with self._lock:
+            for name, row in sorted(self.spans.items()):
+                cumulative = 0
+                for le, count in zip(self.buckets, row["buckets"]):
+                    cumulative += count
+                    lines.append(f'span_duration_seconds_bucket{{span="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'span_duration_seconds_bucket{{span="{name}",le="+Inf"}} {row["count"]}')
+                lines.append(f'span_duration_seconds_sum{{span="{name}"}} {row["sum"]:.6f}')
+                lines.append(f'span_duration_seconds_count{{span="{name}"}} {row["count"]}')
+            lines.append("# TYPE span_errors_total counter")
+            for name, row in sorted(self.spans.items()):
+                lines.append(f'span_errors_total{{span="{name}"}} {row["errors"]}')
+            lines.append("# TYPE llm_tokens_total counter")
+            for model, row in sorted(self.tokens.items()):
+                for kind in ("prompt", "cached", "completion"):
+                    lines.append(f'llm_tokens_total{{model="{model}",kind="{kind}"}} {row[kind]}')
+            lines.append("# TYPE llm_cost_usd_total counter")
+            for model, row in sorted(self.tokens.items()):
+                lines.append(f'llm_cost_usd_total{{model="{model}"}} {row["cost"]:.6f}')
+            lines.append("# TYPE event_loop_stalls_total counter")
+            lines.append(f"event_loop_stalls_total {self.stalls}")
+            lines.append("# TYPE event_loop_stall_seconds_max gauge")
+            lines.append(f"event_loop_stall_seconds_max {self.stall_max:.6f}")
+        return "\n".join(lines) + "\n"
+
+
+class Tracer:
+    def __init__(self, path: Optional[str] = "./traces/trace.jsonl", prom_path: Optional[str] = "./traces/metrics.prom"):
+        self.path = Path(path) if path else None
+        self.prom_path = Path(prom_path) if prom_path else None
+        self.metrics = Metrics()
+        self._lock = threading.Lock()
+        self._file = None
+
+    @classmethod
+    def from_env(cls) -> "Tracer":
+        return cls(
+            path=os.getenv("TRACE_PATH", "./traces/trace.jsonl"),
+            prom_path=os.getenv("TRACE_PROM_PATH", "./traces/metrics.prom"),
+        )
+
+    def start_span(self, name: str, **attrs: Any) -> Span:
+        """Start a span which is ended explicitly, e.g. from LangChain callbacks."""
+        return Span(self, name, attrs)
+
+    @contextmanager
+    def span(self, name: str, **attrs: Any) -> Iterator[Span]:
+        sp = Span(self, name, attrs)
+        token = _current_span.set(sp)
+        try:
+            yield sp
+        except BaseException as e:
+            sp.end(e)
+            raise
+        finally:
+            _current_span.reset(token)
+        sp.end()
+
+    def current(self) -> Optional[Span]:
+        return _current_span.get()
+
+    def _finish(self, sp: Span) -> None:
+        self.metrics.observe(sp.name, sp.duration, "error" in sp.attrs)
+        self.emit(sp.to_dict())
+
+    def emit(self, record: Dict[str, Any]) -> None:
+        if self.path is None:
+            return
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            if self._file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line)
+            self._file.flush()
+
+    def write_metrics(self) -> None:
+        if self.prom_path is None:
+            return
+        self.prom_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.prom_path.with_suffix(".tmp")
+        tmp.write_text(self.metrics.render(), encoding="utf-8")
+        os.replace(tmp, self.prom_path)
+
+    def close(self) -> None:
+        self.write_metrics()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class LoopWatchdog:
+    """
+    Detect event-loop stalls caused by blocking calls.
+
+    A coroutine bumps a heartbeat every `interval` seconds; a daemon thread checks it and, when the
+    loop has not ticked for `threshold` seconds, records a "loop_stall" event with the stack of the
+    loop thread, i.e. the code which is blocking it.
+    :param snapshot_interval: also refresh the Prometheus snapshot this often, 0 to disable
+    """
+
+    def __init__(self, tracer: Tracer, interval: float = 0.05, threshold: float = 0.5, snapshot_interval: float = 60.0):
+        self.tracer = tracer
+        self.interval = interval
+        self.threshold = threshold
+        self.snapshot_interval = snapshot_interval
+
+        self._beat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    async def _heartbeat(self) -> None:
+        while True:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self) -> None:
+        stalled_since: Optional[float] = None
+        stack: List[str] = []
+        last_snapshot = time.monotonic()
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            lag = now - self._beat
+            if lag > self.threshold:
+                if stalled_since is None:
+                    stalled_since = self._beat
+                    frame = sys._current_frames().get(self._loop_thread_id)
+                    stack = traceback.format_stack(frame)[-8:] if frame is not None else []
+            elif stalled_since is not None:
+                # 卡顿结束了，记录一次
+                seconds = self._beat - stalled_since
+                self.tracer.metrics.stall(seconds)
+                self.tracer.emit({"type": "loop_stall", "start": time.time() - (now - stalled_since),
+                                  "duration": round(seconds, 6), "stack": "".join(stack)})
+                stalled_since = None
+            if self.snapshot_interval and now - last_snapshot > self.snapshot_interval:
+                self.tracer.write_metrics()
+                last_snapshot = now
+
+    def start(self) -> None:
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+
+
+# 进程内共享
+tracer = Tracer.from_env()
@@ -0,0 +1,69 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2025 - Present Sepine Tam, Inc. All Rights Reserved
+#
+# @Author : Sepine Tam (谭淞)
+# @Email  : sepinetam@gmail.com
+# @File   : usage.py
+
+"""
+Token usage accounting, including the provider-side prompt cache hits.
+
+DeepSeek reports the cached prefix as `usage.prompt_cache_hit_tokens`, OpenAI compatible providers
+as `usage.prompt_tokens_details.cached_tokens`; both are read here.
+"""
+import threading
+from typing import Any, Dict
+
+
+def _get(obj: Any, name: str) -> Any:
+    if obj is None:
+        return None
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name, None)
+
+
+def cached_tokens(usage: Any) -> int:
+    hit = _get(usage, "prompt_cache_hit_tokens")
+    if hit is None:
+        hit = _get(_get(usage, "prompt_tokens_details"), "cached_tokens")
+    return int(hit or 0)
+
+
+class UsageMeter:
+    """Sum of the token usage per model."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models: Dict[str, Dict[str, float]] = {}
+
+    def record(self, model: str, usage: Any, latency: float = 0.0) -> None:
+        prompt = int(_get(usage, "prompt_tokens") or 0)
+        completion = int(_get(usage, "completion_tokens") or 0)
+        cached = cached_tokens(usage)
+        with self._lock:
+            row = self._models.setdefault(model, {
+                "calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "latency": 0.0,
+            })
+            row["calls"] += 1
+            row["prompt_tokens"] += prompt
+            row["cached_tokens"] += cached
+            row["completion_tokens"] += completion
+            row["latency"] += latency
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        out = {}
+        with self._lock:
+            for model, row in self._models.items():
+                out[model] = dict(row)
+                out[model]["cache_hit_rate"] = (
+                    round(row["cached_tokens"] / row["prompt_tokens"], 4) if row["prompt_tokens"] else 0.0
+                )
+                out[model]["latency"] = round(row["latency"], 3)
+        return out
+
+
+# 进程内共享
+usage_meter = UsageMeter()
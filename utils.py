@@ -7,80 +7,303 @@
 # @Email  : sepinetam@gmail.com
 # @File   : utils.py
 
-from typing import Dict, List, Any
+import json
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Any, Iterable, Iterator, Optional, Tuple
 
-from langchain_core.messages import BaseMessage
+from langchain_core.messages import BaseMessage, messages_from_dict, messages_to_dict
 
 
-def resort_ai_msg(messages: List[BaseMessage]) -> Dict[str, str]:
+@lru_cache(maxsize=1)
+def _encoding():
+    # tiktoken 是可选的（langchain-openai 会带上），没有就用字符数估计
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
+def count_tokens(text: str) -> int:
+    enc = _encoding()
+    if enc is None:
+        return (len(text) + 3) // 4
+    return len(enc.encode(text, disallowed_special=()))
+
+
+class TranscriptCompactor:
     """
-    Make the AI_Message change to AI-Agent's processer and result
+    Shrink the processer before it is sent to the judge, keeping the evidence of process quality:
+        1. runs of identical messages (e.g. the same failed tool call again and again) become one entry
+           with a repeat count; a tool output identical to an earlier one becomes a back reference
+        2. long tool outputs keep their head and tail around an elision marker
+        3. if the processer is still above token_budget, the tool output cap is lowered, and as the last
+           resort the middle messages are elided
+    :param token_budget: the max tokens of the processer string
+    :param max_tool_tokens: the cap of one tool output
+    :param min_tool_tokens: the cap is never lowered below this
+    :param dedupe_min_chars: shorter tool outputs are not replaced by back references
     """
 
-    def _stringify(content: Any) -> str:
-        # LangChain content 可能是 str / list[dict|str] / None
-        if content is None:
-            return ""
-        if isinstance(content, str):
-            return content
-        if isinstance(content, list):
-            parts = []
-            for it in content:
-                if isinstance(it, str):
-                    parts.append(it)
-                elif isinstance(it, dict):
-                    # 尽量抽取常见字段
-                    for k in ("text", "content", "output", "result", "message"):
-                        v = it.get(k)
-                        if isinstance(v, str):
-                            parts.append(v)
-                            break
+    def __init__(self,
+                 token_budget: int = 24000,
+                 max_tool_tokens: int = 1500,
+                 min_tool_tokens: int = 200,
+                 dedupe_min_chars: int = 80):
+        self.token_budget = token_budget
+        self.max_tool_tokens = max_tool_tokens
+        self.min_tool_tokens = min_tool_tokens
+        self.dedupe_min_chars = dedupe_min_chars
+        self.stats: Dict[str, int] = {}
+
+    @staticmethod
+    def _collapse_runs(entries: List[Tuple[str, str]]) -> Tuple[List[Tuple[str, str]], Dict[int, str], int]:
+        out: List[Tuple[str, str]] = []
+        notes: Dict[int, str] = {}  # index in out -> repeat note, added after the de-duplication
+        collapsed = 0
+        i, n = 0, len(entries)
+        while i < n:
+            best_p, best_k = 1, 1
+            for p in (1, 2, 3):
+                block = entries[i:i + p]
+                if len(block) < p:
+                    break
+                k = 1
+                while entries[i + k * p:i + (k + 1) * p] == block:
+                    k += 1
+                if k > 1 and k * p > best_k * best_p:
+                    best_p, best_k = p, k
+            out.extend(entries[i:i + best_p])
+            if best_k > 1:
+                plural = "message" if best_p == 1 else f"{best_p} messages"
+                notes[len(out) - 1] = f"[the {plural} above repeated {best_k} times in a row]"
+                collapsed += (best_k - 1) * best_p
+            i += best_p * best_k
+        return out, notes, collapsed
+
+    def _dedupe_tools(self, entries: List[Tuple[str, str]]) -> Tuple[List[Tuple[str, str]], int]:
+        first_seen: Dict[str, int] = {}
+        out: List[Tuple[str, str]] = []
+        deduped = 0
+        tool_no = 0
+        for header, body in entries:
+            if header == "# Tool MSG":
+                tool_no += 1
+                if len(body) >= self.dedupe_min_chars:
+                    if body in first_seen:
+                        body = f"[identical to the output of tool call #{first_seen[body]}]"
+                        deduped += 1
                     else:
-                        parts.append(str(it))
+                        first_seen[body] = tool_no
+            out.append((header, body))
+        return out, deduped
+
+    @staticmethod
+    def _head_tail(body: str, max_tokens: int) -> str:
+        tokens = count_tokens(body)
+        if tokens <= max_tokens:
+            return body
+        chars_per_token = len(body) / tokens
+        head = int(max_tokens * 0.6 * chars_per_token)
+        tail = int(max_tokens * 0.4 * chars_per_token)
+        return f"{body[:head]}\n...[{tokens - max_tokens} tokens elided]...\n{body[len(body) - tail:]}"
+
+    @staticmethod
+    def _join(entries: List[Tuple[str, str]]) -> str:
+        return "\n".join(f"{header}\n{body}".rstrip() for header, body in entries).strip()
+
+    def compact(self, entries: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        """
+        :param entries: (header, body) of every message of the processer
+        :return: the compacted entries
+        """
+        before = count_tokens(self._join(entries))
+        entries, notes, collapsed = self._collapse_runs(entries)
+        entries, deduped = self._dedupe_tools(entries)
+        entries = [
+            (header, f"{body}\n{notes[idx]}" if idx in notes else body)
+            for idx, (header, body) in enumerate(entries)
+        ]
+
+        cap = self.max_tool_tokens
+        while True:
+            trimmed = [
+                (header, self._head_tail(body, cap) if header == "# Tool MSG" else body)
+                for header, body in entries
+            ]
+            total = count_tokens(self._join(trimmed))
+            if total <= self.token_budget or cap <= self.min_tool_tokens:
+                break
+            cap = max(self.min_tool_tokens, cap // 2)
+
+        dropped = 0
+        if total > self.token_budget and len(trimmed) > 2:
+            # 还是太长：保留任务本身和最后的若干条消息，中间的省略掉
+            head, tail = trimmed[:1], trimmed[1:]
+            room = self.token_budget - count_tokens(self._join(head)) - 32
+            kept: List[Tuple[str, str]] = []
+            for entry in reversed(tail):
+                size = count_tokens(self._join([entry]))
+                if size > room:
+                    break
+                kept.insert(0, entry)
+                room -= size
+            dropped = len(tail) - len(kept)
+            trimmed = head + [("# Elided", f"[{dropped} messages elided to fit the judge token budget]")] + kept
+            total = count_tokens(self._join(trimmed))
+
+        self.stats = {
+            "tokens_before": before,
+            "tokens_after": total,
+            "collapsed": collapsed,
+            "deduped": deduped,
+            "tool_cap": cap,
+            "dropped": dropped,
+        }
+        return trimmed
+
+
+def _stringify(content: Any) -> str:
+    # LangChain content 可能是 str / list[dict|str] / None
+    if content is None:
+        return ""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        parts = []
+        for it in content:
+            if isinstance(it, str):
+                parts.append(it)
+            elif isinstance(it, dict):
+                # 尽量抽取常见字段
+                for k in ("text", "content", "output", "result", "message"):
+                    v = it.get(k)
+                    if isinstance(v, str):
+                        parts.append(v)
+                        break
                 else:
                     parts.append(str(it))
-            return "\n".join(p for p in parts if p)
-        # 兜底
-        return str(content)
-
-    # 找到最后一个 AI 消息，作为 result
-    last_ai_idx = None
-    for i in range(len(messages) - 1, -1, -1):
-        if getattr(messages[i], "type", None) == "ai":
-            last_ai_idx = i
-            break
-
-    # 过程部分：不包含最后一个 AI 消息
-    process_slice = messages[:last_ai_idx] if last_ai_idx is not None else messages
-
-    lines: List[str] = []
-    for m in process_slice:
-        mtype = getattr(m, "type", "")
-        if mtype == "system":
-            continue  # 忽略 system
-        if mtype == "human":
-            header = "# Human MSG"
-        elif mtype == "ai":
-            header = "# AI MSG"
-        elif mtype in ("tool", "function"):
-            header = "# Tool MSG"
+            else:
+                parts.append(str(it))
+        return "\n".join(p for p in parts if p)
+    # 兜底
+    return str(content)
+
+
+_HEADERS = {"human": "# Human MSG", "ai": "# AI MSG", "tool": "# Tool MSG", "function": "# Tool MSG"}
+
+
+class ResortBuilder:
+    """
+    The incremental form of `resort_ai_msg`: `add()` the messages as the agent produces them,
+    `finish()` gives the same {"processer", "result"} as resort_ai_msg on the whole list.
+    Only the formatted entries are kept, not the message objects.
+    :param max_entry_tokens: if given, longer tool outputs keep their head and tail on arrival,
+        so one huge tool output does not stay in memory until the end of the run
+    """
+
+    def __init__(self, max_entry_tokens: Optional[int] = None):
+        self.max_entry_tokens = max_entry_tokens
+        self.entries: List[Tuple[str, str]] = []
+        self.count = 0
+        # 最后一个 AI 消息是 result，它后面的消息不进 processer；再来一个 AI 消息时才把它们放回去
+        self._last_ai: Optional[str] = None
+        self._after_ai: List[Tuple[str, str]] = []
+
+    def add(self, message: BaseMessage) -> None:
+        self.count += 1
+        mtype = getattr(message, "type", "")
+        header = _HEADERS.get(mtype)
+        if header is None:
+            return  # 忽略 system 和其他类型，避免破坏格式
+        body = _stringify(getattr(message, "content", ""))
+        if self.max_entry_tokens and header == "# Tool MSG":
+            body = TranscriptCompactor._head_tail(body, self.max_entry_tokens)
+        if mtype == "ai":
+            if self._last_ai is not None:
+                self.entries.append(("# AI MSG", self._last_ai))
+                self.entries.extend(self._after_ai)
+                self._after_ai = []
+            self._last_ai = body
+        elif self._last_ai is not None:
+            self._after_ai.append((header, body))
         else:
-            # 其他类型忽略，避免破坏格式
-            continue
+            self.entries.append((header, body))
+
+    def finish(self,
+               compactor: Optional[TranscriptCompactor] = None,
+               stop_reason: Optional[str] = None) -> Dict[str, str]:
+        """
+        :param compactor: if given, the processer is compacted to the judge token budget
+        :param stop_reason: how the agent run ended (see RunClient.stop_reason); a run cut by a budget
+            gets a note at the end of the processer so the judge knows the transcript is partial
+        """
+        entries = list(self.entries)
+        if compactor is not None:
+            entries = compactor.compact(entries)
+        if stop_reason and stop_reason != "completed":
+            entries.append(("# Note", f"The agent run was stopped by the {stop_reason} budget before it finished, "
+                                      f"the transcript is partial."))
+        formatted = {
+            "processer": TranscriptCompactor._join(entries),
+            # 结果部分：最后一个 AI 的文本
+            "result": (self._last_ai or "").strip(),
+        }
+        if stop_reason:
+            formatted["stop_reason"] = stop_reason
+        return formatted
+
+
+def resort_ai_msg(messages: Iterable[BaseMessage],
+                  compactor: Optional[TranscriptCompactor] = None,
+                  stop_reason: Optional[str] = None) -> Dict[str, str]:
+    """
+    Make the AI_Message change to AI-Agent's processer and result
+    :param messages: the messages of the agent run
+    :param compactor: if given, the processer is compacted to the judge token budget
+    :param stop_reason: how the agent run ended, see ResortBuilder.finish
+    """
+    builder = ResortBuilder()
+    for m in messages:
+        builder.add(m)
+    return builder.finish(compactor, stop_reason)
+
+
+class TranscriptWriter:
+    """
+    Append the messages of a running agent to `transcripts/{grid.cell_stem(model, task_id)}.jsonl`, one message a line,
+    so the progress of a cell can be followed live and a partial transcript survives a crash.
+    The file is truncated on open: a new run of the cell starts a new transcript.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._f = open(self.path, "w", encoding="utf-8")
+        self.count = 0
+
+    def write(self, message: BaseMessage) -> None:
+        self._f.write(json.dumps(messages_to_dict([message])[0], ensure_ascii=False) + "\n")
+        self._f.flush()
+        self.count += 1
+
+    def close(self) -> None:
+        self._f.close()
 
-        body = _stringify(getattr(m, "content", ""))
-        # 保证都是 str
-        body = "" if body is None else str(body)
-        lines.append(f"{header}\n{body}".rstrip())
+    def __enter__(self) -> "TranscriptWriter":
+        return self
 
-    processer_str = "\n".join(lines).strip()
+    def __exit__(self, *exc) -> None:
+        self.close()
 
-    # 结果部分：最后一个 AI 的文本
-    result_str = ""
-    if last_ai_idx is not None:
-        result_str = _stringify(getattr(messages[last_ai_idx], "content", "")).strip()
 
-    return {
-        "processer": processer_str,
-        "result": result_str,
-    }
+def read_transcript(path: str) -> Iterator[BaseMessage]:
+    """Stream the messages back from a transcript file, a torn last line is skipped."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            yield from messages_from_dict([record])